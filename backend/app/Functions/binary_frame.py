@@ -0,0 +1,107 @@
+import json, struct
+import numpy as np
+from typing import Dict
+from fastapi.responses import Response
+
+# Layout: magic (4 bytes) | header length (uint32, little-endian) | JSON header | data
+# The header is padded so the data (and every array in it) starts on an 8-byte boundary,
+# the client can then view each array as a typed array without copying.
+MAGIC, MEDIA_TYPE, ALIGN = b'DHF1', 'application/octet-stream', 8
+DTYPES = ('float32', 'float64', 'int32', 'uint32', 'int16', 'uint16', 'int8', 'uint8')
+
+def _padding(size: int) -> int:
+    return (-size) % ALIGN
+
+def pack(arrays: Dict[str, np.ndarray], meta: dict=None) -> bytes:
+    """
+    Pack arrays in a binary frame, with their name, dtype, shape and offset in a JSON header.
+
+    Parameters:
+    ----------
+    arrays: dict
+        The arrays to pack, by name.
+    meta: dict
+        Additional JSON-serializable information.
+
+    Returns:
+    -------
+    bytes
+        The binary frame.
+    """
+    items, entries, offset = [], [], 0
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        if arr.dtype.name not in DTYPES: raise ValueError(f"Unsupported dtype for binary frame: {arr.dtype}")
+        arr = arr.astype(arr.dtype.newbyteorder('<'), copy=False)
+        # Offsets are relative to the start of the data section
+        entries.append({'name': name, 'dtype': arr.dtype.name, 'shape': list(arr.shape), 'offset': offset})
+        items.append(arr)
+        offset += arr.nbytes + _padding(arr.nbytes)
+    header = json.dumps({'meta': meta or {}, 'arrays': entries}, separators=(',', ':')).encode()
+    header += b' ' * _padding(len(MAGIC) + 4 + len(header))
+    parts = [MAGIC, struct.pack('<I', len(header)), header]
+    for arr in items: parts += [arr.tobytes(), b'\0' * _padding(arr.nbytes)]
+    return b''.join(parts)
+
+def encode(content: dict) -> bytes:
+    """
+    Pack the content of a response: numpy arrays are packed as arrays
+    (object arrays, e.g. formatted numbers with None, become float32 with NaN), everything else goes in the header.
+
+    Parameters:
+    ----------
+    content: dict
+        The content of the response.
+
+    Returns:
+    -------
+    bytes
+        The binary frame.
+    """
+    arrays, meta = {}, {}
+    for key, value in content.items():
+        if isinstance(value, np.ndarray): arrays[key] = value.astype(np.float32) if value.dtype == object else value
+        else: meta[key] = value
+    return pack(arrays, meta)
+
+def response(content: dict) -> Response:
+    """
+    Binary response of a route (see encode).
+
+    Parameters:
+    ----------
+    content: dict
+        The content of the response.
+
+    Returns:
+    -------
+    Response
+        The binary response.
+    """
+    return Response(content=encode(content), media_type=MEDIA_TYPE)
+
+def unpack(content: bytes) -> tuple:
+    """
+    Read a binary frame written by pack.
+
+    Parameters:
+    ----------
+    content: bytes
+        The binary frame.
+
+    Returns:
+    -------
+    tuple
+        The arrays by name and the meta information.
+    """
+    if content[:len(MAGIC)] != MAGIC: raise ValueError("Not a binary frame.")
+    size = struct.unpack('<I', content[len(MAGIC):len(MAGIC) + 4])[0]
+    start = len(MAGIC) + 4 + size
+    header = json.loads(content[len(MAGIC) + 4:start])
+    arrays = {}
+    for entry in header['arrays']:
+        dtype = np.dtype(entry['dtype']).newbyteorder('<')
+        count = int(np.prod(entry['shape'], dtype=np.int64))
+        arrays[entry['name']] = np.frombuffer(content, dtype=dtype, count=count,
+            offset=start + entry['offset']).reshape(entry['shape'])
+    return arrays, header['meta']
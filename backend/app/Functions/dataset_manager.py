@@ -1,32 +1,109 @@
 import os, threading
 import xarray as xr
-from typing import Dict
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+def estimate_nbytes(ds: xr.Dataset) -> int:
+    """
+    Estimate the resident memory of an opened dataset.
+    Variables without chunks (loaded in memory) count fully, lazy (dask) variables count one chunk.
+    """
+    total = 0
+    for var in ds.variables.values():
+        if var.chunks:
+            count = 1
+            for c in var.chunks: count *= int(max(c))
+            total += count * var.dtype.itemsize
+        else: total += var.nbytes
+    return int(total)
 
 class DatasetManager:
-    def __init__(self):
-        # Cache store dataset and timestamp
-        self._cache: Dict[str, xr.Dataset] = {}
+    def __init__(self, max_entries: int=0, max_bytes: int=0,
+            on_evict: Optional[Callable[[str, xr.Dataset], None]]=None):
+        # Cache store dataset and timestamp, ordered from least to most recently used
+        self._cache: "OrderedDict[str, xr.Dataset]" = OrderedDict()
         self._timestamp: Dict[str, float] = {}
+        self._nbytes: Dict[str, int] = {}
         self._lock = threading.Lock()
+        # Limits (0 = unlimited)
+        self.max_entries, self.max_bytes = int(max_entries or 0), int(max_bytes or 0)
+        self.on_evict = on_evict
+        self.hits = self.misses = self.evictions = 0
+
+    def _open(self, path: str, mtime: float) -> xr.Dataset:
+        # self._cache[path] = xr.open_dataset(path, chunks='auto')
+        ds = xr.open_zarr(path, consolidated=True)
+        self._cache[path], self._timestamp[path] = ds, mtime
+        self._nbytes[path] = estimate_nbytes(ds)
+        return ds
+
+    def _drop(self, path: str) -> xr.Dataset:
+        ds = self._cache.pop(path)
+        self._timestamp.pop(path, None)
+        self._nbytes.pop(path, None)
+        try: ds.close()
+        except Exception as e: print(f"Error closing dataset: {path} - {str(e)}")
+        return ds
+
+    def _evict(self, keep: str) -> list:
+        # Evict least recently used datasets until the limits are respected
+        evicted = []
+        while len(self._cache) > 1:
+            over_entries = self.max_entries > 0 and len(self._cache) > self.max_entries
+            over_bytes = self.max_bytes > 0 and sum(self._nbytes.values()) > self.max_bytes
+            if not (over_entries or over_bytes): break
+            path = next(iter(self._cache))
+            if path == keep: break
+            print(f"Evicting dataset: {path}")
+            evicted.append((path, self._drop(path)))
+            self.evictions += 1
+        return evicted
 
     def get(self, path: str) -> xr.Dataset:
         # Get dataset from cache, if not in cache or if the file has been modified, open the dataset
         mtime = os.path.getmtime(path)
+        reloaded = None
         with self._lock:
             if path not in self._cache:
                 print(f"Opening: {path}")
-                # self._cache[path] = xr.open_dataset(path, chunks='auto')
-                self._cache[path] = xr.open_zarr(path, consolidated=True)
-                self._timestamp[path] = mtime
+                self.misses += 1
+                ds = self._open(path, mtime)
             elif self._timestamp[path] != mtime:
                 print(f"Reload dataset: {path}")
-                self._cache[path].close()
-                del self._cache[path]
-                # self._cache[path] = xr.open_dataset(path, chunks='auto')
-                self._cache[path] = xr.open_zarr(path, consolidated=True)
-                self._timestamp[path] = mtime
-            else: print(f"Using cached dataset: {path}")
-            return self._cache[path]
+                self.misses += 1
+                reloaded = (path, self._drop(path))
+                ds = self._open(path, mtime)
+            else:
+                print(f"Using cached dataset: {path}")
+                self.hits += 1
+                self._cache.move_to_end(path)
+                ds = self._cache[path]
+                self._nbytes[path] = estimate_nbytes(ds)
+            evicted = self._evict(keep=path)
+            # The former dataset of a reloaded file is closed too, its users must drop it
+            if reloaded: evicted.insert(0, reloaded)
+        # Notify outside the lock so the callback can safely call back into the manager
+        if self.on_evict:
+            for old_path, old_ds in evicted:
+                try: self.on_evict(old_path, old_ds)
+                except Exception as e: print(f"Eviction callback error: {old_path} - {str(e)}")
+        return ds
+
+    def evict(self, path: str) -> bool:
+        # Remove one dataset from the cache explicitly
+        with self._lock:
+            if path not in self._cache: return False
+            ds = self._drop(path)
+            self.evictions += 1
+        if self.on_evict: self.on_evict(path, ds)
+        return True
+
+    def stats(self) -> dict:
+        # Cache statistics
+        with self._lock:
+            return {"entries": len(self._cache), "bytes": sum(self._nbytes.values()),
+                "max_entries": self.max_entries, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
 
     def close(self):
         # Close all datasets, usually at shutdown
@@ -38,3 +115,4 @@ class DatasetManager:
             except Exception as e: print(f"Error closing dataset: {path} - {str(e)}")
         self._cache.clear()
         self._timestamp.clear()
+        self._nbytes.clear()
@@ -0,0 +1,93 @@
+import time, threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable
+
+class _Session:
+    def __init__(self, reader: Callable[[int], Any], n_steps: int):
+        self.reader, self.n_steps = reader, n_steps
+        # Frames read ahead (or being read) by time index
+        self.frames: Dict[int, Future] = {}
+        self.last_used = time.monotonic()
+
+class FramePrefetcher:
+    def __init__(self, depth: int=8, idle_seconds: float=60, max_sessions: int=16, workers: int=2):
+        # One session per client stream (user, project, variable, layer), ordered from least to most recently used
+        self._sessions: "OrderedDict[Hashable, _Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix='prefetch')
+        # Limits (depth 0 = no read-ahead)
+        self.depth, self.idle_seconds, self.max_sessions = int(depth), float(idle_seconds), int(max_sessions)
+        self.hits = self.misses = self.dropped = 0
+
+    def _schedule(self, session: _Session, step: int):
+        # Keep the next frames (looping at the end, as the playback does) and drop the others
+        wanted = [(step + i) % session.n_steps for i in range(1, self.depth + 1)]
+        for idx in list(session.frames):
+            if idx not in wanted: session.frames.pop(idx).cancel()
+        for idx in wanted:
+            if idx != step and idx not in session.frames:
+                session.frames[idx] = self._executor.submit(session.reader, idx)
+
+    def get(self, key: Hashable, step: int, reader: Callable[[int], Any], n_steps: int) -> Any:
+        """
+        Get the frame of a time step and read the next frames ahead in the background.
+
+        Parameters:
+        ----------
+        key: Hashable
+            The session of the client stream, a new key starts a new buffer.
+        step: int
+            The index of the time step.
+        reader: Callable
+            Reads the frame of one time step (called in the request thread or in a worker thread).
+        n_steps: int
+            The number of time steps.
+
+        Returns:
+        -------
+        Any
+            The frame returned by the reader.
+        """
+        if self.depth <= 0 or n_steps <= 1: return reader(step)
+        step = step % n_steps
+        with self._lock:
+            self._sweep()
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = _Session(reader, n_steps)
+                while len(self._sessions) > self.max_sessions: self._drop(next(iter(self._sessions)))
+            self._sessions.move_to_end(key)
+            session.last_used = time.monotonic()
+            future = session.frames.pop(step, None)
+            if future is None or future.cancelled(): self.misses += 1
+            else: self.hits += 1
+            self._schedule(session, step)
+        if future is None or future.cancelled(): return reader(step)
+        return future.result()
+
+    def _drop(self, key: Hashable):
+        session = self._sessions.pop(key)
+        for future in session.frames.values(): future.cancel()
+        session.frames.clear()
+        self.dropped += 1
+
+    def _sweep(self):
+        now = time.monotonic()
+        for key in [k for k, s in self._sessions.items() if now - s.last_used > self.idle_seconds]: self._drop(key)
+
+    def sweep(self):
+        # Drop the buffers of idle sessions
+        with self._lock: self._sweep()
+
+    def stats(self) -> dict:
+        # Prefetch statistics
+        with self._lock:
+            return {"sessions": len(self._sessions), "buffered": sum(len(s.frames) for s in self._sessions.values()),
+                "depth": self.depth, "hits": self.hits, "misses": self.misses, "dropped": self.dropped}
+
+    def close(self):
+        # Drop all sessions and stop the workers, usually at shutdown
+        with self._lock:
+            for key in list(self._sessions): self._drop(key)
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,11 +1,14 @@
-import shapely, os, re, shutil, stat, json, asyncio
-import base64, time, subprocess, signal, chardet
+import shapely, os, re, shutil, stat, json, asyncio, gzip, math
+import base64, secrets, time, subprocess, signal, chardet, threading, warnings, dask
 import geopandas as gpd, pandas as pd
 import numpy as np, xarray as xr, dask.array as da
 from scipy.spatial import cKDTree
 from uuid import uuid4
 from scipy.ndimage import distance_transform_edt, gaussian_filter
-from config import PROJECT_STATIC_ROOT, ALLOWED_USERS_PATH
+from config import PROJECT_STATIC_ROOT, ALLOWED_USERS_PATH, ZARR_CODEC, ZARR_CLEVEL, ZARR_WORKERS, ZARR_DOWNCAST, \
+    MAP_LOD_LEVELS, MAP_LOD_MIN_CLUSTERS, MAP_LOD_PIXELS, STREAMLINE_SEEDS, STREAMLINE_STEPS, STREAMLINE_CACHE_STEPS, TRANSECT_CHUNK, STREAM_TOKEN_TTL, \
+    SHARED_CACHE_MAX_MAPPED, SHARED_CACHE_MAX_TAGGED
+from Functions import shared_cache, mesh_functions, binary_frame, zarr_converter
 from redis.asyncio.lock import Lock
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi import Depends, HTTPException, status
@@ -33,6 +36,25 @@ def basic_auth(credentials: HTTPBasicCredentials=Depends(security)):
         )
     return username
 
+async def streamToken(redis, username: str) -> str:
+    # Single-use token for a WebSocket handshake, browsers do not reliably send Basic credentials with it
+    token = secrets.token_urlsafe(24)
+    await redis.set(f"stream_token:{token}", username, ex=STREAM_TOKEN_TTL)
+    return token
+
+async def websocket_auth(redis, token: str, authorization: str):
+    # User of a WebSocket handshake: token from /stream_token (consumed), else Basic credentials of the header
+    if token:
+        async with redis.pipeline(transaction=True) as pipe:
+            username, _ = await pipe.get(f"stream_token:{token}").delete(f"stream_token:{token}").execute()
+        return username.decode('utf-8') if username else None
+    scheme, _, encoded = (authorization or '').partition(' ')
+    if scheme.lower() != 'basic': return None
+    try: username, _, password = base64.b64decode(encoded).decode('utf-8').partition(':')
+    except Exception: return None
+    if username not in ALLOWED_USERS or ALLOWED_USERS[username] != password: return None
+    return username
+
 def project_definer(old_name, username='admin'):
     new_name = f'{username}/{old_name}' if username!='admin' else 'demo'
     name_id = f'{new_name}/{uuid4()}'
@@ -84,9 +106,16 @@ async def load_dataset_cached(project_cache, key, dm, dir_path, filename):
     path = os.path.normpath(os.path.join(dir_path, filename))
     if not os.path.exists(path): return None
     ds = dm.get(path)
-    project_cache[key] = ds
+    project_cache[key], project_cache[f"{key}_path"] = ds, path
     return ds
 
+def sharedCache(project_name: str) -> shared_cache.SharedArrayCache:
+    """
+    Get the memory-mapped cache shared by all workers of a project (stored in output/config/shared).
+    """
+    return shared_cache.get_cache(os.path.join(PROJECT_STATIC_ROOT, project_name, "output", "config", "shared"),
+        SHARED_CACHE_MAX_MAPPED, SHARED_CACHE_MAX_TAGGED)
+
 variablesNames = {
     # For In-situ options
     'temperature':'Temperature (°C)', 'salinity':'Salinity (ppt)', 'contaminant':'Contaminant (mg/m³)', # For hydrodynamic stations
@@ -216,9 +245,10 @@ units = {
     'volume': 'Volume (m³)'
 }
 
-def numberFormatter(arr: np.array, decimals: int=2) -> list:
+def numberFormatter(arr: np.array, decimals: int=2) -> np.ndarray:
     """
-    Format the numbers in the array to a specified number of decimal places.
+    Format the numbers in the array: values >= 1 (in absolute) are rounded to a specified number
+    of decimal places, smaller values to (decimals + 1) significant digits.
 
     Parameters:
     ----------
@@ -229,31 +259,31 @@ def numberFormatter(arr: np.array, decimals: int=2) -> list:
 
     Returns:
     -------
-    list
-        The list with formatted numbers.
+    np.ndarray
+        The float array with formatted numbers, NaN for missing (non-finite) values.
+        Use jsonSafe to serialize it to JSON.
     """
-    try:
-        arr = np.asarray(arr, dtype=float)
-        result = np.empty(arr.shape, dtype=object)
-        finite_mask = np.isfinite(arr)
-        abs_arr = np.abs(arr)
-        # Make a mask for large numbers
-        large_mask = finite_mask & (abs_arr >= 1)
-        result[large_mask] = np.round(arr[large_mask], decimals)
-        # Make a mask for small numbers
-        small_mask = finite_mask & (abs_arr < 1) & (arr != 0)
-        fmt = f"%.{decimals}e"
-        result[small_mask] = [float(fmt % v) for v in arr[small_mask]]
-        # Make a mask for zero
-        zero_mask = finite_mask & (arr == 0)
-        result[zero_mask] = 0.0
-        # NaN -> None
-        nan_mask = ~finite_mask
-        result[nan_mask] = None
-        return np.reshape(result, arr.shape)
-    except:
+    try: arr = np.asarray(arr, dtype=np.float64)
+    except (TypeError, ValueError):
         print("Input array contains non-numeric values")
         return list(arr)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        result = np.asarray(np.round(arr, decimals)) # Scalars too
+        abs_arr = np.abs(arr)
+        small_mask = np.isfinite(arr) & (abs_arr < 1) & (arr != 0)
+        if np.any(small_mask):
+            # Round small numbers to significant digits (same as "%.{decimals}e")
+            small = arr[small_mask]
+            scale = 10.0 ** (decimals - np.floor(np.log10(abs_arr[small_mask])))
+            result[small_mask] = np.round(small * scale) / scale
+        result[~np.isfinite(arr)] = np.nan
+    return result
+
+def jsonSafe(arr: np.array):
+    """Convert a (formatted) numeric array to a JSON-serializable list or scalar, NaN becomes None."""
+    arr = np.asarray(arr, dtype=np.float64)
+    if arr.ndim == 0: return None if np.isnan(arr) else arr.item()
+    return np.where(np.isnan(arr), None, arr).tolist()
 
 def getVectorNames() -> list:
     """
@@ -264,27 +294,89 @@ def getVectorNames() -> list:
     list
         The list containing the names of the vector variables.
     """
-    result = [(0,'Velocity')]
+    result = [(0,'Velocity'), (1,'Velocity streamlines')]
+    return result
+
+# Time steps reduced to check a variable when it has no statistics
+DISCOVERY_SAMPLES = 8
+
+def _rangeCheck(vmin: float, vmax: float) -> bool:
+    vmin, vmax = (np.nan if v is None else float(v) for v in (vmin, vmax))
+    if np.isnan(vmin) or np.isnan(vmax): return False # Empty or all NaN
+    if vmin < -900 and vmax < -900: return False # Only fill values
+    return bool(vmin != vmax)
+
+def _rangeChecks(variables: dict) -> dict:
+    # Min and max of all variables reduced together, chunk by chunk and concurrently
+    tasks = [(var.min(skipna=True).data, var.max(skipna=True).data) for var in variables.values()]
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning) # All-NaN slices
+        results = dask.compute(*tasks)
+    return {name: _rangeCheck(vmin, vmax) for name, (vmin, vmax) in zip(variables, results)}
+
+def discoverVariables(data: xr.Dataset, names: list) -> dict:
+    """
+    Check which variables are present, not empty, not all NaN, not only fill values and not constant.
+    The statistics sidecar answers directly, otherwise a sample of time steps is reduced first:
+    a variable passing on the sample passes on the whole, the others are confirmed on all time steps.
+
+    Parameters:
+    ----------
+    data: xr.Dataset
+        The dataset received from *.zarr file.
+    names: list
+        The names of the variables to check.
+
+    Returns:
+    -------
+    dict
+        True or False by variable name.
+    """
+    result, sampled, full = {}, {}, {}
+    stats = datasetStatistics(data, compute=False)
+    for name in names:
+        if name not in data.variables or data[name].dtype.kind not in 'fiu' or data[name].size == 0:
+            result[name] = False
+        elif name in stats: result[name] = _rangeCheck(stats[name]['min'], stats[name]['max'])
+        else:
+            var = data[name]
+            time_dim = next((d for d in var.dims if d in zarr_converter.TIME_DIMS), None)
+            if time_dim is None or var.sizes[time_dim] <= DISCOVERY_SAMPLES: full[name] = var
+            else:
+                idx = np.unique(np.linspace(0, var.sizes[time_dim] - 1, DISCOVERY_SAMPLES).round().astype(int))
+                sampled[name] = var.isel({time_dim: idx})
+    if sampled:
+        for name, valid in _rangeChecks(sampled).items():
+            if valid: result[name] = True
+            else: full[name] = data[name]
+    if full: result.update(_rangeChecks(full))
     return result
 
 def checkVariables(data: xr.Dataset, variablesNames: str) -> bool:
     """
-    Check if all variables are available in the variablesNames dictionary.
+    Check if a variable is available (see discoverVariables).
 
     Returns:
     -------
     bool
-        True if all variables are available, False otherwise.
-    """
-    if variablesNames not in data.variables: return False
-    var = data[variablesNames]
-    if var.size == 0: return False # Empty variable
-    # Check if all values are NaN in a sample slice
-    if np.isnan(var.data.compute()).all(): return False
-    # Check if min and max are the same value
-    vmin, vmax = var.min(skipna=True).compute(), var.max(skipna=True).compute()
-    if float(vmin) < -900 and float(vmax) < -900: return False
-    return bool(float(vmin) != float(vmax))
+        True if the variable is available, False otherwise.
+    """
+    return discoverVariables(data, [variablesNames])[variablesNames]
+
+# Time series of the hydrodynamic _his file offered in the menus (see getVariablesNames)
+hydHisVariables = (
+    'waterlevel', 'waterdepth', 'Qtot', 'rain', 'wind', 'Tair', 'rhum', 'Qsun', 'Qeva', 'Qfreva', 'Qcon',
+    'Qfrcon', 'Qlong', 'clou', 'source_sink_prescribed_discharge', 'source_sink_prescribed_salinity_increment',
+    'source_sink_prescribed_temperature_increment', 'source_sink_current_discharge',
+    'source_sink_cumulative_volume', 'source_sink_discharge_average', 'cross_section_velocity',
+    'cross_section_area', 'cross_section_discharge', 'cross_section_cumulative_discharge',
+    'cross_section_salt', 'cross_section_cumulative_salt', 'cross_section_temperature',
+    'cross_section_cumulative_temperature', 'cross_section_Contaminant',
+    'cross_section_cumulative_Contaminant', 'water_balance_total_volume', 'water_balance_storage',
+    'water_balance_boundaries_in', 'water_balance_boundaries_out', 'water_balance_boundaries_total',
+    'water_balance_precipitation_total', 'water_balance_evaporation', 'water_balance_source_sink',
+    'water_balance_groundwater_in', 'water_balance_groundwater_out', 'water_balance_groundwater_total',
+    'water_balance_precipitation_on_ground', 'water_balance_volume_error')
 
 def getVariablesNames(out_files: list, model_type: str='', filename: str='') -> dict:
     """
@@ -310,6 +402,7 @@ def getVariablesNames(out_files: list, model_type: str='', filename: str='') ->
         # This is a hydrodynamic his file
         if 'time' in data.sizes and any(k in data.sizes for k in ['stations', 'cross_section', 'source_sink']):
             print(f"- Checking Hydrodynamic Simulation: His file...")
+            checks = discoverVariables(data, hydHisVariables)
             # Prepare data for hydrodynamic options
             result['hyd_obs'] = data.sizes['stations'] > 0 if ('stations' in data.sizes) else False
             result['cross_sections'] = False
@@ -321,21 +414,21 @@ def getVariablesNames(out_files: list, model_type: str='', filename: str='') ->
             # Prepare data for measured locations
             # 1. Observation points
             # 1.1. Hydrodynamics
-            result['hyd_waterlevel'] = checkVariables(data, 'waterlevel')
-            result['hyd_waterdepth'] = checkVariables(data, 'waterdepth')
+            result['hyd_waterlevel'] = checks.get('waterlevel', False)
+            result['hyd_waterdepth'] = checks.get('waterdepth', False)
             # 1.2. Meteorology
-            result['hyd_total_heat_flux'] = checkVariables(data, 'Qtot')
-            result['hyd_precipitation_rate'] = checkVariables(data, 'rain')
-            result['hyd_wind_speed'] = checkVariables(data, 'wind')
-            result['hyd_air_temperature'] = checkVariables(data, 'Tair')
-            result['hyd_relative_humidity'] = checkVariables(data, 'rhum')
-            result['hyd_solar_influx'] = checkVariables(data, 'Qsun')
-            result['hyd_evaporative_heat_flux'] = checkVariables(data, 'Qeva')
-            result['hyd_free_convection_evaporative_heat_flux'] = checkVariables(data, 'Qfreva')
-            result['hyd_sensible_heat_flux'] = checkVariables(data, 'Qcon')
-            result['hyd_free_convection_sensible_heat_flux'] = checkVariables(data, 'Qfrcon')
-            result['hyd_long_wave_back_radiation'] = checkVariables(data, 'Qlong')
-            result['hyd_cloudiness'] = checkVariables(data, 'clou')
+            result['hyd_total_heat_flux'] = checks.get('Qtot', False)
+            result['hyd_precipitation_rate'] = checks.get('rain', False)
+            result['hyd_wind_speed'] = checks.get('wind', False)
+            result['hyd_air_temperature'] = checks.get('Tair', False)
+            result['hyd_relative_humidity'] = checks.get('rhum', False)
+            result['hyd_solar_influx'] = checks.get('Qsun', False)
+            result['hyd_evaporative_heat_flux'] = checks.get('Qeva', False)
+            result['hyd_free_convection_evaporative_heat_flux'] = checks.get('Qfreva', False)
+            result['hyd_sensible_heat_flux'] = checks.get('Qcon', False)
+            result['hyd_free_convection_sensible_heat_flux'] = checks.get('Qfrcon', False)
+            result['hyd_long_wave_back_radiation'] = checks.get('Qlong', False)
+            result['hyd_cloudiness'] = checks.get('clou', False)
             result['hyd_meteorology'] = True if (result['hyd_total_heat_flux'] or
                 result['hyd_precipitation_rate'] or result['hyd_wind_speed'] or
                 result['hyd_air_temperature'] or result['hyd_relative_humidity'] or
@@ -345,38 +438,38 @@ def getVariablesNames(out_files: list, model_type: str='', filename: str='') ->
                 result['hyd_long_wave_back_radiation'] or result['hyd_cloudiness']) else False
             # 2. Sources/Sinks Points
             if result['sources']:
-                result['source_prescribed_discharge'] = checkVariables(data, 'source_sink_prescribed_discharge')
-                result['source_prescribed_salinity'] = checkVariables(data, 'source_sink_prescribed_salinity_increment')
-                result['source_prescribed_temperature'] = checkVariables(data, 'source_sink_prescribed_temperature_increment')
-                result['source_current_discharge'] = checkVariables(data, 'source_sink_current_discharge')
-                result['source_cumulative_volume'] = checkVariables(data, 'source_sink_cumulative_volume')
-                result['source_average_discharge'] = checkVariables(data, 'source_sink_discharge_average')
+                result['source_prescribed_discharge'] = checks.get('source_sink_prescribed_discharge', False)
+                result['source_prescribed_salinity'] = checks.get('source_sink_prescribed_salinity_increment', False)
+                result['source_prescribed_temperature'] = checks.get('source_sink_prescribed_temperature_increment', False)
+                result['source_current_discharge'] = checks.get('source_sink_current_discharge', False)
+                result['source_cumulative_volume'] = checks.get('source_sink_cumulative_volume', False)
+                result['source_average_discharge'] = checks.get('source_sink_discharge_average', False)
             # 3. Cross sections
             if result['cross_sections']:
-                result['cross_sections_velocity'] = checkVariables(data, 'cross_section_velocity')
-                result['cross_sections_area'] = checkVariables(data, 'cross_section_area')
-                result['cross_sections_discharge'] = checkVariables(data, 'cross_section_discharge')
-                result['cross_sections_cumulative_discharge'] = checkVariables(data, 'cross_section_cumulative_discharge')
-                result['cross_section_salt'] = checkVariables(data, 'cross_section_salt')
-                result['cross_sections_cumulative_salt'] = checkVariables(data, 'cross_section_cumulative_salt')
-                result['cross_section_temperature'] = checkVariables(data, 'cross_section_temperature')
-                result['cross_section_cumulative_temperature'] = checkVariables(data, 'cross_section_cumulative_temperature')
-                result['cross_section_contaminant'] = checkVariables(data, 'cross_section_Contaminant')
-                result['cross_section_cumulative_contaminant'] = checkVariables(data, 'cross_section_cumulative_Contaminant')
+                result['cross_sections_velocity'] = checks.get('cross_section_velocity', False)
+                result['cross_sections_area'] = checks.get('cross_section_area', False)
+                result['cross_sections_discharge'] = checks.get('cross_section_discharge', False)
+                result['cross_sections_cumulative_discharge'] = checks.get('cross_section_cumulative_discharge', False)
+                result['cross_section_salt'] = checks.get('cross_section_salt', False)
+                result['cross_sections_cumulative_salt'] = checks.get('cross_section_cumulative_salt', False)
+                result['cross_section_temperature'] = checks.get('cross_section_temperature', False)
+                result['cross_section_cumulative_temperature'] = checks.get('cross_section_cumulative_temperature', False)
+                result['cross_section_contaminant'] = checks.get('cross_section_Contaminant', False)
+                result['cross_section_cumulative_contaminant'] = checks.get('cross_section_cumulative_Contaminant', False)
             # 4. Hydrodynamic Water balance
-            result['hyd_wb_total_volume'] = checkVariables(data, 'water_balance_total_volume')
-            result['hyd_wb_storage'] = checkVariables(data, 'water_balance_storage')
-            result['hyd_wb_inflow_boundaries'] = checkVariables(data, 'water_balance_boundaries_in')
-            result['hyd_wb_outflow_boundaries'] = checkVariables(data, 'water_balance_boundaries_out')
-            result['hyd_wb_total_boundaries'] = checkVariables(data, 'water_balance_boundaries_total')
-            result['hyd_wb_total_precipitation'] = checkVariables(data, 'water_balance_precipitation_total')
-            result['hyd_wb_total_evaporation'] = checkVariables(data, 'water_balance_evaporation')
-            result['hyd_wb_source_sink'] = checkVariables(data, 'water_balance_source_sink')
-            result['hyd_wb_inflow_groundwater'] = checkVariables(data, 'water_balance_groundwater_in')
-            result['hyd_wb_outflow_groundwater'] = checkVariables(data, 'water_balance_groundwater_out')
-            result['hyd_wb_total_groundwater'] = checkVariables(data, 'water_balance_groundwater_total')
-            result['hyd_wb_ground_precipitation'] = checkVariables(data, 'water_balance_precipitation_on_ground')
-            result['hyd_wb_volume_error'] = checkVariables(data, 'water_balance_volume_error')
+            result['hyd_wb_total_volume'] = checks.get('water_balance_total_volume', False)
+            result['hyd_wb_storage'] = checks.get('water_balance_storage', False)
+            result['hyd_wb_inflow_boundaries'] = checks.get('water_balance_boundaries_in', False)
+            result['hyd_wb_outflow_boundaries'] = checks.get('water_balance_boundaries_out', False)
+            result['hyd_wb_total_boundaries'] = checks.get('water_balance_boundaries_total', False)
+            result['hyd_wb_total_precipitation'] = checks.get('water_balance_precipitation_total', False)
+            result['hyd_wb_total_evaporation'] = checks.get('water_balance_evaporation', False)
+            result['hyd_wb_source_sink'] = checks.get('water_balance_source_sink', False)
+            result['hyd_wb_inflow_groundwater'] = checks.get('water_balance_groundwater_in', False)
+            result['hyd_wb_outflow_groundwater'] = checks.get('water_balance_groundwater_out', False)
+            result['hyd_wb_total_groundwater'] = checks.get('water_balance_groundwater_total', False)
+            result['hyd_wb_ground_precipitation'] = checks.get('water_balance_precipitation_on_ground', False)
+            result['hyd_wb_volume_error'] = checks.get('water_balance_volume_error', False)
             result['hyd_water_balance'] = True if (result['hyd_wb_total_volume'] or
                 result['hyd_wb_inflow_boundaries'] or result['hyd_wb_outflow_boundaries'] or
                 result['hyd_wb_total_boundaries'] or result['hyd_wb_total_precipitation'] or
@@ -387,21 +480,23 @@ def getVariablesNames(out_files: list, model_type: str='', filename: str='') ->
         # This is a hydrodynamic map file
         elif ('time' in data.sizes and any(k in data.sizes for k in ['mesh2d_nNodes', 'mesh2d_nEdges'])):
             print(f"- Checking Hydrodynamic Simulation: Map file...")
-            result['z_layers'] = checkVariables(data, 'mesh2d_layer_z')
+            checks = discoverVariables(data, ['mesh2d_layer_z', 'mesh2d_tem1', 'mesh2d_s1', 'mesh2d_waterdepth',
+                'mesh2d_sa1', 'mesh2d_Contaminant'])
+            result['z_layers'] = checks.get('mesh2d_layer_z', False)
             # Prepare data for thermocline parameters
             # 1. Thermocline
-            result['thermocline_hyd'] = checkVariables(data, 'mesh2d_tem1')
+            result['thermocline_hyd'] = checks.get('mesh2d_tem1', False)
             # 2. Spatial single layer hydrodynamic maps
-            result['hyd_wl_dynamic'] = checkVariables(data, 'mesh2d_s1')
-            result['hyd_wd_dynamic'] = checkVariables(data, 'mesh2d_waterdepth')
+            result['hyd_wl_dynamic'] = checks.get('mesh2d_s1', False)
+            result['hyd_wd_dynamic'] = checks.get('mesh2d_waterdepth', False)
             result['single_layer'] = True if (result['hyd_wl_dynamic'] or result['hyd_wd_dynamic']) else False
             # 3. Spatial multi layer hydrodynamic maps
-            result['spatial_salinity'] = checkVariables(data, 'mesh2d_sa1')
-            result['spatial_contaminant'] = checkVariables(data, 'mesh2d_Contaminant')
+            result['spatial_salinity'] = checks.get('mesh2d_sa1', False)
+            result['spatial_contaminant'] = checks.get('mesh2d_Contaminant', False)
             result['multi_layer'] = True if (result['thermocline_hyd'] or
                 result['spatial_salinity'] or result['spatial_contaminant']) else False
             # 4. Spatial static maps
-            result['waterdepth_static'] = checkVariables(data, 'mesh2d_waterdepth')
+            result['waterdepth_static'] = checks.get('mesh2d_waterdepth', False)
             result['spatial_static'] = True if (result['waterdepth_static']) else False
             result['spatial_map'] = True if (result['single_layer'] or result['multi_layer']) else False
             result['hide_map'] = result['spatial_map']
@@ -409,13 +504,14 @@ def getVariablesNames(out_files: list, model_type: str='', filename: str='') ->
         elif ('nTimesDlwq' in data.sizes and not any(k in data.sizes for k in ['mesh2d_nNodes', 'mesh2d_nEdges'])):
             print(f"- Checking Water Quality Simulation: His file...")
             variables = set(data.variables.keys()) - set(['nTimesDlwqBnd', 'station_name', 'station_x', 'station_y', 'station_z', 'nTimesDlwq'])
+            checks = discoverVariables(data, variables)
             result['waq_his'] = False
             # Prepare data for Physical option
             # 1. Conservative and Decaying Tracers
             if model_type == 'conservative-tracers':
                 result['waq_his_conservative_selector'] = []
                 for item in variables:
-                    if checkVariables(data, item): result['waq_his_conservative_selector'].append(item)
+                    if checks.get(item, False): result['waq_his_conservative_selector'].append(item)
                 if len(result['waq_his_conservative_selector']) > 0:
                     result['waq_his_conservative_decay'] = True
                     result['waq_his_conservative_decay_name'] = filename
@@ -427,7 +523,7 @@ def getVariablesNames(out_files: list, model_type: str='', filename: str='') ->
             elif model_type == 'suspend-sediment':
                 result['waq_his_suspended_sediment_selector'] = []
                 for item in variables:
-                    if checkVariables(data, item): result['waq_his_suspended_sediment_selector'].append(item)
+                    if checks.get(item, False): result['waq_his_suspended_sediment_selector'].append(item)
                 if len(result['waq_his_suspended_sediment_selector']) > 0:
                     result['waq_his_suspended_sediment'] = True
                     result['waq_his_suspended_sediment_name'] = filename
@@ -440,7 +536,7 @@ def getVariablesNames(out_files: list, model_type: str='', filename: str='') ->
             elif model_type == 'simple-oxygen':
                 result['waq_his_simple_oxygen_selector'] = []
                 for item in variables:
-                    if checkVariables(data, item): result['waq_his_simple_oxygen_selector'].append(item)
+                    if checks.get(item, False): result['waq_his_simple_oxygen_selector'].append(item)
                 if len(result['waq_his_simple_oxygen_selector']) > 0:
                     result['waq_his_simple_oxygen'] = True
                     result['waq_his_simple_oxygen_name'] = filename
@@ -452,7 +548,7 @@ def getVariablesNames(out_files: list, model_type: str='', filename: str='') ->
             elif model_type == 'oxygen-bod-water':
                 result['waq_his_oxygen_bod_selector'] = []
                 for item in variables:
-                    if checkVariables(data, item): result['waq_his_oxygen_bod_selector'].append(item)            
+                    if checks.get(item, False): result['waq_his_oxygen_bod_selector'].append(item)            
                 if len(result['waq_his_oxygen_bod_selector']) > 0:
                     result['waq_his_oxygen_bod'] = True
                     result['waq_his_oxygen_bod_name'] = filename
@@ -464,7 +560,7 @@ def getVariablesNames(out_files: list, model_type: str='', filename: str='') ->
             elif model_type == 'cadmium':
                 result['waq_his_cadmium_selector'] = []
                 for item in variables:
-                    if checkVariables(data, item): result['waq_his_cadmium_selector'].append(item)
+                    if checks.get(item, False): result['waq_his_cadmium_selector'].append(item)
                 if len(result['waq_his_cadmium_selector']) > 0:
                     result['waq_his_cadmium'] = True
                     result['waq_his_cadmium_name'] = filename
@@ -476,7 +572,7 @@ def getVariablesNames(out_files: list, model_type: str='', filename: str='') ->
             elif model_type == 'eutrophication':
                 result['waq_his_eutrophication_selector'] = []
                 for item in variables:
-                    if checkVariables(data, item): result['waq_his_eutrophication_selector'].append(item)
+                    if checks.get(item, False): result['waq_his_eutrophication_selector'].append(item)
                 if len(result['waq_his_eutrophication_selector']) > 0:
                     result['waq_his_eutrophication'] = True
                     result['waq_his_eutrophication_name'] = filename
@@ -488,7 +584,7 @@ def getVariablesNames(out_files: list, model_type: str='', filename: str='') ->
             elif model_type == 'trace-metals':
                 result['waq_his_trace_metals_selector'] = []
                 for item in variables:
-                    if checkVariables(data, item): result['waq_his_trace_metals_selector'].append(item)
+                    if checks.get(item, False): result['waq_his_trace_metals_selector'].append(item)
                 if len(result['waq_his_trace_metals_selector']) > 0:
                     result['waq_his_trace_metals'] = True
                     result['waq_his_trace_metals_name'] = filename
@@ -500,7 +596,7 @@ def getVariablesNames(out_files: list, model_type: str='', filename: str='') ->
             elif model_type == 'coliform':
                 result['waq_his_coliform_selector'] = []
                 for item in variables:
-                    if checkVariables(data, item): result['waq_his_coliform_selector'].append(item)
+                    if checks.get(item, False): result['waq_his_coliform_selector'].append(item)
                 if len(result['waq_his_coliform_selector']) > 0:
                     result['waq_his_coliform'] = True
                     result['waq_his_coliform_name'] = filename
@@ -515,6 +611,7 @@ def getVariablesNames(out_files: list, model_type: str='', filename: str='') ->
             variables = set(data.variables.keys()) - set(['mesh2d', 'mesh2d_node_x', 'mesh2d_node_y', 'mesh2d_edge_x',
                 'mesh2d_edge_y', 'mesh2d_face_x_bnd', 'mesh2d_face_y_bnd', 'mesh2d_edge_nodes', 'mesh2d_edge_faces',
                 'mesh2d_face_nodes', 'mesh2d_layer_dlwq', 'nTimesDlwqBnd', 'mesh2d_face_x', 'mesh2d_face_y', 'nTimesDlwq'])
+            checks = discoverVariables(data, variables)
             # Prepare data for Physical option
             # 1. Conservative and Decaying Tracers
             if model_type == 'conservative-tracers':
@@ -522,7 +619,7 @@ def getVariablesNames(out_files: list, model_type: str='', filename: str='') ->
                 result['waq_map_conservative_decay_name'] = 'Conservative and decaying tracers'
                 for item in variables:
                     item1 = item.replace('mesh2d_', '').replace('2d_', '')
-                    if checkVariables(data, item): 
+                    if checks.get(item, False): 
                         elements_check = {x[0] for x in result['waq_map_conservative_selector']}
                         if item1 not in elements_check: result['waq_map_conservative_selector'].append(item1)
                 result['waq_map_conservative_selector'] = list(dict.fromkeys(result['waq_map_conservative_selector']))
@@ -535,7 +632,7 @@ def getVariablesNames(out_files: list, model_type: str='', filename: str='') ->
                 result['waq_map_suspended_sediment_name'] = 'Suspended sediment (three fractions)'
                 for item in variables:
                     item1 = item.replace('mesh2d_', '').replace('2d_', '')
-                    if checkVariables(data, item):
+                    if checks.get(item, False):
                         elements_check = {x[0] for x in result['waq_map_suspended_sediment_selector']}
                         if item1 not in elements_check: result['waq_map_suspended_sediment_selector'].append(item1)
                 result['waq_map_suspended_sediment_selector'] = list(dict.fromkeys(result['waq_map_suspended_sediment_selector']))
@@ -549,7 +646,7 @@ def getVariablesNames(out_files: list, model_type: str='', filename: str='') ->
                 result['waq_map_simple_oxygen_name'] = 'Simple Oxygen'
                 for item in variables:
                     item1 = item.replace('mesh2d_', '').replace('2d_', '')
-                    if checkVariables(data, item):
+                    if checks.get(item, False):
                         elements_check = {x[0] for x in result['waq_map_simple_oxygen_selector']}
                         if item1 not in elements_check: result['waq_map_simple_oxygen_selector'].append(item1)
                 result['waq_map_simple_oxygen_selector'] = list(dict.fromkeys(result['waq_map_simple_oxygen_selector']))
@@ -562,7 +659,7 @@ def getVariablesNames(out_files: list, model_type: str='', filename: str='') ->
                 result['waq_map_oxygen_bod_name'] = 'Oxygen and BOD (water phase only)'
                 for item in variables:
                     item1 = item.replace('mesh2d_', '').replace('2d_', '')
-                    if checkVariables(data, item):
+                    if checks.get(item, False):
                         elements_check = {x[0] for x in result['waq_map_oxygen_bod_selector']}
                         if item1 not in elements_check: result['waq_map_oxygen_bod_selector'].append(item1)
                 result['waq_map_oxygen_bod_selector'] = list(dict.fromkeys(result['waq_map_oxygen_bod_selector']))
@@ -575,7 +672,7 @@ def getVariablesNames(out_files: list, model_type: str='', filename: str='') ->
                 result['waq_map_cadmium_name'] = 'Cadmium'
                 for item in variables:
                     item1 = item.replace('mesh2d_', '').replace('2d_', '')
-                    if checkVariables(data, item):
+                    if checks.get(item, False):
                         elements_check = {x[0] for x in result['waq_map_cadmium_selector']}
                         if item1 not in elements_check: result['waq_map_cadmium_selector'].append(item1)
                 result['waq_map_cadmium_selector'] = list(dict.fromkeys(result['waq_map_cadmium_selector']))
@@ -588,7 +685,7 @@ def getVariablesNames(out_files: list, model_type: str='', filename: str='') ->
                 result['waq_map_eutrophication_name'] = 'Eutrophication'
                 for item in variables:
                     item1 = item.replace('mesh2d_', '').replace('2d_', '')
-                    if checkVariables(data, item):
+                    if checks.get(item, False):
                         elements_check = {x[0] for x in result['waq_map_eutrophication_selector']}
                         if item1 not in elements_check: result['waq_map_eutrophication_selector'].append(item1)
                 result['waq_map_eutrophication_selector'] = list(dict.fromkeys(result['waq_map_eutrophication_selector']))
@@ -601,7 +698,7 @@ def getVariablesNames(out_files: list, model_type: str='', filename: str='') ->
                 result['waq_map_trace_metals_name'] = 'Trace Metals'
                 for item in variables:
                     item1 = item.replace('mesh2d_', '').replace('2d_', '')
-                    if checkVariables(data, item):
+                    if checks.get(item, False):
                         elements_check = {x[0] for x in result['waq_map_trace_metals_selector']}
                         if item1 not in elements_check: result['waq_map_trace_metals_selector'].append(item1)
                 result['waq_map_trace_metals_selector'] = list(dict.fromkeys(result['waq_map_trace_metals_selector']))
@@ -614,7 +711,7 @@ def getVariablesNames(out_files: list, model_type: str='', filename: str='') ->
                 result['waq_map_coliform_name'] = 'Coliform Bacteria'
                 for item in variables:
                     item1 = item.replace('mesh2d_', '').replace('2d_', '')
-                    if checkVariables(data, item):
+                    if checks.get(item, False):
                         elements_check = {x for x in result['waq_map_coliform_selector']}
                         if item1 not in elements_check: result['waq_map_coliform_selector'].append(item1)
                 result['waq_map_coliform_selector'] = list(dict.fromkeys(result['waq_map_coliform_selector']))
@@ -960,39 +1057,822 @@ def timeseriesCreator(data_his: xr.Dataset, key: str, timeColumn: str='time') ->
     df = pd.DataFrame(index=index, data=numberFormatter(data_his[temp].data.compute()), columns=columns)
     return df.reset_index()
 
-def unstructuredGridCreator(data_map: xr.Dataset) -> gpd.GeoDataFrame:
+def meshArrays(data_map: xr.Dataset, source: str=None, cache: shared_cache.SharedArrayCache=None) -> dict:
     """
-    Create a GeoDataFrame of unstructured grid.
+    Get decoded mesh arrays (node/face coordinates and 0-based face-node indices, -1 as fill value).
 
     Parameters:
     ----------
     data_map: xr.Dataset
         The dataset received from _map file.
+    source: str
+        The path of the _map file, used to version the shared cache.
+    cache: SharedArrayCache
+        The shared cache, if given the arrays are memory-mapped and shared between workers.
 
     Returns:
     -------
-    gpd.GeoDataFrame
-        The GeoDataFrame of unstructured grid.
+    dict
+        A dictionary containing 'node_x', 'node_y', 'face_nodes', 'face_x' and 'face_y'.
     """
-    # Use dask array to speed up, keep lazy-load
-    node_x, node_y = data_map['mesh2d_node_x'].data, data_map['mesh2d_node_y'].data
-    coords = da.stack([node_x, node_y], axis=1)
-    faces = xr.where(np.isnan(data_map['mesh2d_face_nodes']), 0, data_map['mesh2d_face_nodes']).data.astype(int)-1
-    counts = da.sum(faces != -1, axis=1)
-    # Compute to create polygons
-    coords_np, faces_np, counts_np = coords.compute(), faces.compute(), counts.compute()
-    polygons = [shapely.geometry.Polygon(coords_np[face[:count]]) for face, count in zip(faces_np, counts_np)]
-    # Check coordinate reference system
+    def build():
+        faces = data_map['mesh2d_face_nodes'].values
+        faces = np.where(np.isnan(faces), 0, faces).astype(np.int64) - 1
+        result = {'node_x': data_map['mesh2d_node_x'].values, 'node_y': data_map['mesh2d_node_y'].values,
+            'face_nodes': faces.astype(np.int32)}
+        if {'mesh2d_face_x', 'mesh2d_face_y'}.issubset(data_map.variables.keys()):
+            result['face_x'], result['face_y'] = data_map['mesh2d_face_x'].values, data_map['mesh2d_face_y'].values
+        return result
+    if cache is None or source is None: return build()
+    return cache.get_or_create('mesh', source, build)
+
+def gridNodes(data_map: xr.Dataset, mesh: dict) -> tuple:
+    """
+    Get the node coordinates of the grid and their coordinate reference system,
+    projected models are reprojected to WGS84 (once for all nodes instead of every polygon).
+
+    Parameters:
+    ----------
+    data_map: xr.Dataset
+        The dataset received from _map file.
+    mesh: dict
+        Decoded mesh arrays (see meshArrays).
+
+    Returns:
+    -------
+    tuple
+        The x and y coordinates of the nodes and the coordinate reference system.
+    """
+    node_x, node_y, crs = mesh['node_x'], mesh['node_y'], "EPSG:4326"
     if 'wgs84' in data_map.variables:
-        crs_code = data_map['wgs84'].attrs.get('EPSG_code', 4326)
-        grid = gpd.GeoDataFrame(geometry=polygons, crs=crs_code)
+        crs = data_map['wgs84'].attrs.get('EPSG_code', 4326)
     elif 'projected_coordinate_system' in data_map.variables:
         crs_code = data_map['projected_coordinate_system'].attrs.get('EPSG_code', 4326)
-        # Convert to WGS84 if not already
-        grid = gpd.GeoDataFrame(geometry=polygons, crs=crs_code).to_crs(epsg=4326)
-    else: grid = gpd.GeoDataFrame(geometry=polygons, crs="EPSG:4326")
+        node_x, node_y = mesh_functions.reprojectNodes(node_x, node_y, crs_code)
+    return node_x, node_y, crs
+
+def unstructuredGridCreator(data_map: xr.Dataset, mesh: dict=None) -> gpd.GeoDataFrame:
+    """
+    Create a GeoDataFrame of unstructured grid.
+
+    Parameters:
+    ----------
+    data_map: xr.Dataset
+        The dataset received from _map file.
+    mesh: dict
+        Decoded mesh arrays (see meshArrays), read from data_map if not given.
+
+    Returns:
+    -------
+    gpd.GeoDataFrame
+        The GeoDataFrame of unstructured grid.
+    """
+    if mesh is None: mesh = meshArrays(data_map)
+    node_x, node_y, crs = gridNodes(data_map, mesh)
+    # Build all polygons in bulk from ragged offsets
+    polygons = mesh_functions.polygonBuilder(node_x, node_y, mesh['face_nodes'])
+    return gpd.GeoDataFrame(geometry=polygons, crs=crs)
+
+def gridCurrent(path: str, version: str) -> bool:
+    # The grid artifact exists and was built from this version of the _map file
+    if not os.path.exists(path): return False
+    with np.load(path) as artifact: return str(artifact['version']) == version
+
+def gridWriter(data_map: xr.Dataset, source: str, config_dir: str, mesh: dict=None) -> str:
+    """
+    Persist the grid (already in WGS84) as flat coordinates plus ragged offsets (grid_hyd.npz).
+    The artifact is keyed on the modification time of the _map file and only rebuilt when it changes.
+
+    Parameters:
+    ----------
+    data_map: xr.Dataset
+        The dataset received from _map file.
+    source: str
+        The path of the _map file.
+    config_dir: str
+        The configuration folder of the project (output/config).
+    mesh: dict
+        Decoded mesh arrays (see meshArrays).
+
+    Returns:
+    -------
+    str
+        The path of the grid artifact.
+    """
+    path, version = os.path.normpath(os.path.join(config_dir, 'grid_hyd.npz')), shared_cache.source_version(source)
+    if gridCurrent(path, version): return path
+    print('Creating grid artifact...')
+    grid = unstructuredGridCreator(data_map, mesh)
+    _, coords, (ring_offsets, polygon_offsets) = shapely.to_ragged_array(grid.geometry.values)
+    tmp_path = f"{path}.{uuid4().hex}.tmp.npz"
+    np.savez(tmp_path, coords=coords, ring_offsets=ring_offsets, polygon_offsets=polygon_offsets,
+        crs=np.array(grid.crs.to_string()), version=np.array(version))
+    os.replace(tmp_path, path)
+    return path
+
+def gridReader(path: str) -> gpd.GeoDataFrame:
+    """
+    Read the grid artifact written by gridWriter.
+
+    Parameters:
+    ----------
+    path: str
+        The path of the grid artifact.
+
+    Returns:
+    -------
+    gpd.GeoDataFrame
+        The GeoDataFrame of unstructured grid.
+    """
+    with np.load(path) as artifact:
+        polygons = shapely.from_ragged_array(shapely.GeometryType.POLYGON, artifact['coords'],
+            (artifact['ring_offsets'], artifact['polygon_offsets']))
+        crs = str(artifact['crs'])
+    return gpd.GeoDataFrame(geometry=polygons, crs=crs)
+
+def getGrid(project_name: str, project_cache: dict) -> gpd.GeoDataFrame:
+    """
+    Get the grid of a project, loaded lazily from the grid artifact on first use.
+
+    Parameters:
+    ----------
+    project_name: str
+        The name of the project.
+    project_cache: dict
+        The in-memory cache of the project.
+
+    Returns:
+    -------
+    gpd.GeoDataFrame
+        The GeoDataFrame of unstructured grid, None if not available.
+    """
+    if not project_cache: return None
+    grid = project_cache.get("grid")
+    if grid is not None: return grid
+    config_dir = os.path.normpath(os.path.join(PROJECT_STATIC_ROOT, project_name, "output", "config"))
+    hyd_map, source = project_cache.get("hyd_map"), project_cache.get("hyd_map_path")
+    path = os.path.normpath(os.path.join(config_dir, 'grid_hyd.npz'))
+    # The mesh is only decoded when the artifact has to be (re)built
+    if hyd_map is not None and not gridCurrent(path, shared_cache.source_version(source)):
+        path = gridWriter(hyd_map, source, config_dir, meshArrays(hyd_map, source, sharedCache(project_name)))
+    if not os.path.exists(path): return None
+    grid = gridReader(path)
+    project_cache["grid"] = grid
     return grid
 
+def meshSkeletonContent(grid: gpd.GeoDataFrame, binary: bool=False, nodes: tuple=None) -> bytes:
+    """
+    Serialize the grid for the map, either as GeoJSON or as a compact binary frame.
+
+    Parameters:
+    ----------
+    grid: gpd.GeoDataFrame
+        The GeoDataFrame of unstructured grid.
+    binary: bool
+        Float32 nodes (relative to an origin) plus face-node indices and offsets
+        instead of a GeoJSON FeatureCollection.
+    nodes: tuple
+        The topology of the mesh (node x, node y, face-node indices, see gridNodes and meshArrays),
+        if not given the nodes are deduplicated from the polygon rings (e.g. clusters of a level of detail).
+
+    Returns:
+    -------
+    bytes
+        The serialized mesh.
+    """
+    if binary:
+        if nodes is not None:
+            node_x, node_y, face_nodes = nodes
+            nodes = np.column_stack((np.asarray(node_x, dtype=np.float64), np.asarray(node_y, dtype=np.float64)))
+            face_offsets, face_nodes = mesh_functions.flatFaces(face_nodes)
+        else:
+            _, coords, (ring_offsets, _) = shapely.to_ragged_array(grid.geometry.values)
+            nodes, face_offsets, face_nodes = mesh_functions.compactMesh(coords, ring_offsets)
+        # Float32 keeps sub-metre precision once the coordinates are relative to the origin
+        origin = nodes.min(axis=0) if len(nodes) > 0 else np.zeros(2)
+        return binary_frame.pack({'nodes': (nodes - origin).astype(np.float32), 'face_offsets': face_offsets,
+            'face_nodes': face_nodes}, {'origin': origin.tolist(), 'crs': grid.crs.to_string() if grid.crs else None})
+    # Geometries are serialized in bulk by shapely, features are assembled as text
+    geometries = shapely.to_geojson(grid.geometry.values)
+    features = ','.join(f'{{"type":"Feature","properties":{{"index":{idx}}},"geometry":{geom}}}'
+        for idx, geom in zip(grid.index, geometries))
+    return f'{{"type":"FeatureCollection","features":[{features}]}}'.encode()
+
+def meshLevels(project_name: str, project_cache: dict=None) -> dict:
+    """
+    Get the levels of detail of the grid (see mesh_functions.clusterLevels),
+    built once per grid version and kept in the shared cache.
+
+    Parameters:
+    ----------
+    project_name: str
+        The name of the project.
+    project_cache: dict
+        The in-memory cache of the project, the grid is read from the grid artifact if not given.
+        The grid is only loaded when the levels have to be built.
+
+    Returns:
+    -------
+    dict
+        The arrays of the levels, None if the grid is not available.
+    """
+    grid_path = os.path.normpath(os.path.join(PROJECT_STATIC_ROOT, project_name, "output", "config", 'grid_hyd.npz'))
+    if not os.path.exists(grid_path): return None
+    def build():
+        data = getGrid(project_name, project_cache)
+        if data is None: data = gridReader(grid_path)
+        print('Creating mesh levels of detail...')
+        return mesh_functions.clusterLevels(data.geometry.values, data.crs, MAP_LOD_LEVELS, MAP_LOD_MIN_CLUSTERS, MAP_LOD_PIXELS)
+    return sharedCache(project_name).get_or_create('lod', grid_path, build)
+
+def meshLevel(levels: dict, level=None, resolution=None) -> int:
+    """
+    Get a valid level of detail: the requested level (clipped to the available levels),
+    or the coarsest level for a map resolution (metres per pixel).
+    """
+    if levels is None: return 0
+    # Levels are sorted by resolution, the last one not finer than the map is used
+    if resolution is not None: return max(0, int(np.searchsorted(levels['resolution'], float(resolution), side='right')) - 1)
+    return min(max(0, int(level or 0)), len(levels['clusters']) - 1)
+
+def levelInfo(levels: dict) -> list:
+    # Number of clusters and resolution (metres per pixel from which the level is used) of each level
+    if levels is None: return []
+    return [{'level': i, 'clusters': int(n), 'resolution': float(r)} for i, (n, r) in enumerate(zip(levels['clusters'], levels['resolution']))]
+
+def levelFrame(levels: dict, level: int, values: np.ndarray) -> np.ndarray:
+    """
+    Aggregate the values of the faces over the clusters of a level (area-weighted mean),
+    the values are returned as they are at level 0.
+
+    Parameters:
+    ----------
+    levels: dict
+        The levels of detail (see meshLevels).
+    level: int
+        The level of detail.
+    values: np.ndarray
+        The values of the faces (faces on the last axis).
+
+    Returns:
+    -------
+    np.ndarray
+        The values of the clusters.
+    """
+    if levels is None or level <= 0: return values
+    return mesh_functions.clusterMean(values, levels[f'labels_{level}'], levels['area'], int(levels['clusters'][level]))
+
+def viewIndex(project_name: str, project_cache: dict=None) -> dict:
+    """
+    Get the spatial index (see mesh_functions.pointIndex) of the face centroids and of the cluster centroids
+    of every level of detail, built once per grid version and kept in the shared cache.
+
+    Parameters:
+    ----------
+    project_name: str
+        The name of the project.
+    project_cache: dict
+        The in-memory cache of the project, the grid is read from the grid artifact if not given.
+        The grid is only loaded when the index has to be built.
+
+    Returns:
+    -------
+    dict
+        The arrays of the index of each level ('<array>_<level>'), None if the grid is not available.
+    """
+    grid_path = os.path.normpath(os.path.join(PROJECT_STATIC_ROOT, project_name, "output", "config", 'grid_hyd.npz'))
+    if not os.path.exists(grid_path): return None
+    def build():
+        data = getGrid(project_name, project_cache)
+        if data is None: data = gridReader(grid_path)
+        levels = meshLevels(project_name, project_cache)
+        centres, result = shapely.get_coordinates(shapely.centroid(data.geometry.values)).T, {}
+        for level in range(len(levels['clusters'])):
+            # Clusters are located at the area-weighted centroid of their faces
+            x, y = centres if level == 0 else mesh_functions.clusterMean(centres, levels[f'labels_{level}'],
+                levels['area'], int(levels['clusters'][level]))
+            result.update({f'{key}_{level}': value for key, value in mesh_functions.pointIndex(x, y).items()})
+        return result
+    return sharedCache(project_name).get_or_create('view', grid_path, build)
+
+def viewFaces(project_name: str, project_cache: dict, bbox, level: int=0) -> np.ndarray:
+    """
+    Get the faces (or clusters of a level of detail) whose centroid is inside the map view.
+
+    Parameters:
+    ----------
+    project_name: str
+        The name of the project.
+    project_cache: dict
+        The in-memory cache of the project.
+    bbox: list
+        The map view (west, south, east, north) in WGS84, None for the whole grid.
+    level: int
+        The level of detail.
+
+    Returns:
+    -------
+    np.ndarray
+        The sorted int32 indices of the faces, None if all faces are sent
+        (no view, or most of the faces are inside so the full frame is smaller).
+    """
+    if not bbox: return None
+    index = viewIndex(project_name, project_cache)
+    if index is None: return None
+    level_index = {key: index[f'{key}_{level}'] for key in ('order', 'offsets', 'x', 'y', 'bounds')}
+    faces = mesh_functions.pointQuery(level_index, bbox)
+    return faces.astype(np.int32) if len(faces) < 0.5*len(level_index['x']) else None
+
+def viewFrame(values: np.ndarray, faces: np.ndarray) -> dict:
+    # Values of the faces in the view with their index, or all the values (see viewFaces)
+    if faces is None: return {'values': values}
+    return {'values': values[..., faces], 'index': faces}
+
+def levelGrid(grid: gpd.GeoDataFrame, levels: dict, level: int) -> gpd.GeoDataFrame:
+    """
+    Get the GeoDataFrame of the clusters of a level of detail (the grid itself at level 0).
+
+    Parameters:
+    ----------
+    grid: gpd.GeoDataFrame
+        The GeoDataFrame of unstructured grid.
+    levels: dict
+        The levels of detail (see meshLevels).
+    level: int
+        The level of detail.
+
+    Returns:
+    -------
+    gpd.GeoDataFrame
+        The GeoDataFrame of the clusters, indexed by cluster.
+    """
+    if levels is None or level <= 0: return grid
+    polygons = mesh_functions.clusterPolygons(grid.geometry.values, levels[f'labels_{level}'], int(levels['clusters'][level]))
+    return gpd.GeoDataFrame(geometry=polygons, crs=grid.crs)
+
+def meshSkeleton(project_name: str, project_cache: dict=None, binary: bool=False, level: int=0) -> tuple:
+    """
+    Get the mesh skeleton of the map (see meshSkeletonContent), serialized and gzip-compressed
+    once per grid version and level of detail in output/config, so it can be streamed as it is.
+
+    Parameters:
+    ----------
+    project_name: str
+        The name of the project.
+    project_cache: dict
+        The in-memory cache of the project.
+    binary: bool
+        Get the binary mesh instead of the GeoJSON one.
+    level: int
+        The level of detail (see meshLevels), 0 for the full mesh.
+
+    Returns:
+    -------
+    tuple
+        The path of the compressed skeleton and its ETag, (None, None) if the grid is not available.
+    """
+    config_dir = os.path.normpath(os.path.join(PROJECT_STATIC_ROOT, project_name, "output", "config"))
+    grid_path = os.path.normpath(os.path.join(config_dir, 'grid_hyd.npz'))
+    if not os.path.exists(grid_path): return None, None
+    levels = meshLevels(project_name, project_cache) if level > 0 else None
+    level = meshLevel(levels, level)
+    version, extension = str(os.stat(grid_path).st_mtime_ns), 'bin' if binary else 'geojson'
+    suffix = f'-L{level}' if level > 0 else ''
+    path = os.path.normpath(os.path.join(config_dir, f'mesh_hyd-{version}{suffix}.{extension}.gz'))
+    if not os.path.exists(path):
+        print('Serializing mesh skeleton...')
+        grid = getGrid(project_name, project_cache)
+        if grid is None: grid = gridReader(grid_path)
+        hyd_map, nodes = (project_cache or {}).get("hyd_map"), None
+        if binary and level == 0 and hyd_map is not None:
+            # Nodes and face-node indices of the mesh itself
+            source = project_cache.get("hyd_map_path")
+            mesh = meshArrays(hyd_map, source, sharedCache(project_name))
+            nodes = (*gridNodes(hyd_map, mesh)[:2], mesh['face_nodes'])
+        content = gzip.compress(meshSkeletonContent(levelGrid(grid, levels, level), binary, nodes), compresslevel=6)
+        tmp_path = f"{path}.{uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f: f.write(content)
+        os.replace(tmp_path, path)
+        # Remove skeletons of older grid versions
+        for f in os.listdir(config_dir):
+            if f.startswith('mesh_hyd-') and f.endswith(f'.{extension}.gz') and not f.startswith((f'mesh_hyd-{version}.', f'mesh_hyd-{version}-')):
+                try: os.remove(os.path.normpath(os.path.join(config_dir, f)))
+                except OSError: pass
+    return path, f'"mesh-{extension}-{version}{suffix}"'
+
+def variableRange(data_ds: xr.Dataset, name: str) -> tuple:
+    """
+    Get the global minimum and maximum of a variable from the statistics sidecar,
+    or reduced chunk by chunk (never loaded as a whole) for variables without statistics.
+
+    Parameters:
+    ----------
+    data_ds: xr.Dataset
+        The dataset containing the variable.
+    name: str
+        The name of the variable.
+
+    Returns:
+    -------
+    tuple
+        The minimum and maximum values (NaN if the variable is empty).
+    """
+    stats = datasetStatistics(data_ds).get(name)
+    if stats is not None: return tuple(np.nan if v is None else float(v) for v in (stats['min'], stats['max']))
+    var = data_ds[name]
+    vmin, vmax = da.compute(var.min(skipna=True).data, var.max(skipna=True).data)
+    return float(vmin), float(vmax)
+
+statistics_cache, statistics_lock = {}, threading.Lock()
+
+def statisticsPath(zarr_path: str) -> str:
+    """
+    Get the path of the statistics sidecar of a zarr store: output/config/stats_<HYD|WAQ>_<name>.json
+    """
+    output_dir = os.path.dirname(os.path.normpath(zarr_path))
+    name = os.path.splitext(os.path.basename(os.path.normpath(zarr_path)))[0]
+    return os.path.normpath(os.path.join(os.path.dirname(output_dir), "config", f"stats_{os.path.basename(output_dir)}_{name}.json"))
+
+def datasetStatistics(data: xr.Dataset, compute: bool=True) -> dict:
+    """
+    Get the precomputed statistics (min, max, NaN fraction, constant, per time step and per layer) of the variables of a dataset.
+    The sidecar is written during the zarr conversion, stores converted before are scanned once and the sidecar is written then.
+
+    Parameters:
+    ----------
+    data: xr.Dataset
+        The dataset opened from a zarr store.
+    compute: bool
+        Compute and write the sidecar when it is missing or outdated, otherwise return an empty dictionary.
+
+    Returns:
+    -------
+    dict
+        The statistics by variable name (see zarr_converter.statistics), empty if the dataset has no store.
+    """
+    source = data.encoding.get('source') if data is not None else None
+    if not source or not os.path.isdir(source): return {}
+    version = shared_cache.source_version(source)
+    cached = statistics_cache.get(source)
+    if cached is not None and cached['version'] == version: return cached['variables']
+    with statistics_lock:
+        cached = statistics_cache.get(source)
+        if cached is not None and cached['version'] == version: return cached['variables']
+        path, content = statisticsPath(source), None
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f: content = json.load(f)
+            except (OSError, ValueError): content = None
+        if content is None or content.get('version') != version:
+            if not compute: return {}
+            print(f'Computing statistics: {os.path.basename(source)}')
+            content = zarr_converter.write_statistics(data, path, version)
+        statistics_cache[source] = content
+    return content['variables']
+
+def depthAverage(project_name: str, project_cache: dict, data_ds: xr.Dataset, name: str, build: bool=True) -> xr.DataArray:
+    """
+    Get the depth-averaged values (time, faces) of a 3-D hydrodynamic variable.
+    They are computed once chunk by chunk and persisted as zarr in output/config/depth_average,
+    keyed on the modification time of the _map file.
+
+    Parameters:
+    ----------
+    project_name: str
+        The name of the project.
+    project_cache: dict
+        The in-memory cache of the project.
+    data_ds: xr.Dataset
+        The dataset received from _map file.
+    name: str
+        The name of the 3-D variable (time, faces, layers).
+    build: bool
+        Compute the depth average if it is not persisted yet.
+
+    Returns:
+    -------
+    xr.DataArray
+        The lazy depth-averaged variable, None if it is not persisted and build is False.
+    """
+    version = shared_cache.source_version(project_cache.get('hyd_map_path'))
+    cached = project_cache.get(f"depth_average_{name}")
+    if cached is not None and cached.attrs.get('version') == version: return cached
+    folder = os.path.normpath(os.path.join(PROJECT_STATIC_ROOT, project_name, "output", "config", "depth_average"))
+    path = os.path.normpath(os.path.join(folder, f"{name}@{version}.zarr"))
+    if not os.path.exists(path):
+        if not build: return None
+        print(f'Computing depth average: {name}')
+        os.makedirs(folder, exist_ok=True)
+        var = data_ds[name]
+        average = var.mean(dim=var.dims[2], skipna=True).astype(np.float32)
+        average.attrs, average.encoding = {'version': version}, {}
+        tmp_path = f"{path}.{uuid4().hex}.tmp"
+        average.to_dataset(name=name).to_zarr(tmp_path, mode='w', consolidated=True)
+        # Another worker may have written the same version in the meantime
+        try: os.rename(tmp_path, path)
+        except OSError: shutil.rmtree(tmp_path, ignore_errors=True)
+        for f in os.listdir(folder):
+            if f.startswith(f"{name}@") and f != os.path.basename(path):
+                shutil.rmtree(os.path.normpath(os.path.join(folder, f)), ignore_errors=True)
+    average = xr.open_zarr(path, consolidated=True)[name]
+    project_cache[f"depth_average_{name}"] = average
+    return average
+
+def frameReader(project_name: str, project_cache: dict, data_ds: xr.Dataset, is_hyd: bool, name: str,
+        value_type: str, row_idx: int, time_idx) -> np.ndarray:
+    """
+    Read the values of one layer at one time step (or a range of time steps),
+    only the chunks of these frames are read from the store.
+
+    Parameters:
+    ----------
+    project_name: str
+        The name of the project.
+    project_cache: dict
+        The in-memory cache of the project.
+    data_ds: xr.Dataset
+        The dataset received from _map file (hydrodynamic or water quality).
+    is_hyd: bool
+        Hydrodynamic (time, faces, layers) or water quality (time, layers, faces) variable.
+    name: str
+        The name of the variable.
+    value_type: str
+        'Average' for the depth average, otherwise one layer (or a single layer variable).
+    row_idx: int
+        The index of the layer, None for single layer variables.
+    time_idx: int | slice
+        The index of the time step, or a slice of time steps.
+
+    Returns:
+    -------
+    np.ndarray
+        The float32 values of the faces (time steps, faces for a slice).
+    """
+    if row_idx is None: var = data_ds[name]
+    elif value_type == 'Average':
+        if is_hyd: var = depthAverage(project_name, project_cache, data_ds, name)
+        else: var = data_ds[f"{name.split('_')[0]}_2d_{name.split('_')[1]}"]
+    else: var = data_ds[name][:, :, row_idx] if is_hyd else data_ds[name][:, row_idx, :]
+    if var.ndim > 1: var = var[time_idx]
+    return np.asarray(var.values, dtype=np.float32)
+
+def thermoclineFaces(project_name: str, project_cache: dict, is_hyd: bool, name: str) -> np.ndarray:
+    """
+    Get the faces of the thermocline grid (faces with values in at least one layer),
+    reduced chunk by chunk once per variable and kept in the shared cache.
+
+    Parameters:
+    ----------
+    project_name: str
+        The name of the project.
+    project_cache: dict
+        The in-memory cache of the project.
+    is_hyd: bool
+        Hydrodynamic (time, faces, layers) or water quality (time, layers, faces) variable.
+    name: str
+        The name of the 3-D variable.
+
+    Returns:
+    -------
+    np.ndarray
+        The indices of the faces, memory-mapped.
+    """
+    dataset_type = "hyd" if is_hyd else "waq"
+    data_ds, source = project_cache.get(f"{dataset_type}_map"), project_cache.get(f"{dataset_type}_map_path")
+    def build() -> dict:
+        var = data_ds[name]
+        face_dim = var.dims[1] if is_hyd else var.dims[2]
+        valid = ~var.isnull().all(dim=[d for d in var.dims if d != face_dim])
+        return {'faces': np.flatnonzero(np.asarray(valid.values)).astype(np.int64)}
+    return sharedCache(project_name).get_or_create(f'thermocline_faces_{dataset_type}', source, build, tag=name)['faces']
+
+def thermoclineProfile(data_ds: xr.Dataset, name: str, is_hyd: bool, face: int) -> np.ndarray:
+    """
+    Get the values of all layers and time steps at one face, only this face is read.
+
+    Parameters:
+    ----------
+    data_ds: xr.Dataset
+        The dataset received from _map file (hydrodynamic or water quality).
+    name: str
+        The name of the 3-D variable.
+    is_hyd: bool
+        Hydrodynamic (time, faces, layers) or water quality (time, layers, faces) variable.
+    face: int
+        The index of the face in the mesh (see thermoclineFaces).
+
+    Returns:
+    -------
+    np.ndarray
+        The values (time steps, layers).
+    """
+    var = data_ds[name]
+    return np.asarray(var.isel({var.dims[1] if is_hyd else var.dims[2]: int(face)}).values)
+
+def thermoclineArrays(project_name: str, project_cache: dict, selection: dict) -> np.ndarray:
+    """
+    Get the thermocline profile of a selection from the shared array cache (built once for all workers).
+
+    Parameters:
+    ----------
+    project_name: str
+        The name of the project.
+    project_cache: dict
+        The in-memory cache of the project.
+    selection: dict
+        The selected profile: key ('thermocline_hyd' or 'thermocline_waq'), name of the variable and idx of the face.
+
+    Returns:
+    -------
+    np.ndarray
+        The values (time steps, layers), memory-mapped.
+    """
+    is_hyd = selection['key'] == 'thermocline_hyd'
+    dataset_type = "hyd" if is_hyd else "waq"
+    data_ds, source = project_cache.get(f"{dataset_type}_map"), project_cache.get(f"{dataset_type}_map_path")
+    def build() -> dict:
+        # idx is the index of the face in the thermocline grid
+        face = thermoclineFaces(project_name, project_cache, is_hyd, selection['name'])[int(selection['idx'])]
+        return {'values': thermoclineProfile(data_ds, selection['name'], is_hyd, face)}
+    tag = json.dumps(selection, sort_keys=True)
+    return sharedCache(project_name).get_or_create('thermocline', source, build, tag=tag)['values']
+
+def meshIndex(project_name: str, project_cache: dict) -> dict:
+    """
+    Get the spatial index of the grid used by transects: an STRtree of the face polygons and a cKDTree of the nodes
+    projected to UTM 32N (as interpolation_Z) with their bed level. The projected nodes are kept in the shared cache
+    (once per _map file), the trees are built once per worker.
+
+    Parameters:
+    ----------
+    project_name: str
+        The name of the project.
+    project_cache: dict
+        The in-memory cache of the project.
+
+    Returns:
+    -------
+    dict
+        The grid, the node arrays ('x', 'y', 'z'), the tree of the faces ('face_tree') and of the nodes ('node_tree').
+    """
+    hyd_map, source = project_cache.get("hyd_map"), project_cache.get("hyd_map_path")
+    grid = getGrid(project_name, project_cache)
+    if hyd_map is None or grid is None: raise ValueError("Grid is not available.")
+    def build() -> dict:
+        mesh = meshArrays(hyd_map, source, sharedCache(project_name))
+        # Nodes of projected models are in their own system (see unstructuredGridCreator)
+        crs = grid.crs
+        if 'wgs84' not in hyd_map.variables and 'projected_coordinate_system' in hyd_map.variables:
+            crs = hyd_map['projected_coordinate_system'].attrs.get('EPSG_code', 4326)
+        x, y = mesh_functions.reprojectNodes(mesh['node_x'], mesh['node_y'], crs, 32632)
+        return {'x': x, 'y': y, 'z': np.asarray(hyd_map['mesh2d_node_z'].values, dtype=float)}
+    nodes = sharedCache(project_name).get_or_create('nodes', source, build)
+    # Same trees as long as the grid and the mapped nodes don't change
+    index = project_cache.get("mesh_index")
+    if index is None or index['grid'] is not grid or index['nodes'] is not nodes:
+        index = project_cache["mesh_index"] = {'grid': grid, 'nodes': nodes, 'face_tree': shapely.STRtree(grid.geometry.values),
+            'node_tree': cKDTree(np.column_stack((nodes['x'], nodes['y'])))}
+    return index
+
+def transectArrays(project_name: str, project_cache: dict, selection: dict) -> dict:
+    """
+    Get the faces crossed by a transect and the bed level of its points from the shared array cache (built once for all workers).
+
+    Parameters:
+    ----------
+    project_name: str
+        The name of the project.
+    project_cache: dict
+        The in-memory cache of the project.
+    selection: dict
+        The transect: points ([distance, y, x]) and depth_values of the layers.
+
+    Returns:
+    -------
+    dict
+        The index of the face (-1 outside the grid) and the depth of each point, the depth values of the layers
+        and the number of rows of the frame.
+    """
+    source = project_cache.get("hyd_map_path")
+    def build() -> dict:
+        index, points_arr = meshIndex(project_name, project_cache), np.array(selection['points'], dtype=float)
+        x_coords, y_coords = points_arr[:, 2], points_arr[:, 1]
+        # Bed level: inverse distance weighting of the nearest nodes (as interpolation_Z)
+        x_utm, y_utm = mesh_functions.reprojectNodes(x_coords, y_coords, index['grid'].crs, 32632)
+        dists, idx = index['node_tree'].query(np.column_stack((x_utm, y_utm)), k=2)
+        weight = 1 / (dists + 1e-10)**2
+        depth = numberFormatter(np.sum(weight * index['nodes']['z'][idx], axis=1)/np.sum(weight, axis=1))
+        # Face of each point
+        faces = mesh_functions.locatePoints(index['face_tree'], x_coords, y_coords)
+        if np.all(faces < 0): raise ValueError("The transect is outside the grid.")
+        depth_values = np.array(selection['depth_values'], dtype=float)
+        max_layer = float(max(depth_values, key=abs))
+        n_rows = math.ceil(abs(max_layer)/10)*10+1 if max_layer < 0 else -(math.ceil(abs(max_layer)/10)*10+1)
+        return {'index': faces, 'depth': np.asarray(depth, dtype=float),
+            'depth_values': depth_values, 'n_rows': np.array([n_rows], dtype=np.int64)}
+    tag = json.dumps(selection, sort_keys=True)
+    return sharedCache(project_name).get_or_create('transect', source, build, tag=tag)
+
+def transectTag(selection: dict, name: str) -> str:
+    # Key of the rendered frames of a transect: the transect and the variable
+    return json.dumps({**selection, 'name': name}, sort_keys=True)
+
+def transectSeries(project_name: str, project_cache: dict, selection: dict, is_hyd: bool, name: str,
+        progress=None, cancelled=None, build: bool=True) -> dict:
+    """
+    Render all the time steps of a transect (see meshProcess) into one float32 array, kept in the shared cache.
+    Only the values of the crossed faces are read, TRANSECT_CHUNK time steps at a time.
+
+    Parameters:
+    ----------
+    project_name: str
+        The name of the project.
+    project_cache: dict
+        The in-memory cache of the project.
+    selection: dict
+        The transect: points ([distance, y, x]) and depth_values of the layers.
+    is_hyd: bool
+        True if HYD, False if WAQ.
+    name: str
+        The name of the variable.
+    progress: Callable
+        Called with (rendered time steps, total time steps) after each chunk.
+    cancelled: Callable
+        Returns True when the rendering must stop (e.g. another transect was selected).
+    build: bool
+        Render the frames if they are not in the cache yet.
+
+    Returns:
+    -------
+    dict
+        The frames (time steps, rows, points) and the min and max of each frame,
+        None if they are not rendered (build is False, no time step or the rendering was cancelled).
+    """
+    dataset_type = "hyd" if is_hyd else "waq"
+    data_ds, source = project_cache.get(f"{dataset_type}_map"), project_cache.get(f"{dataset_type}_map_path")
+    cache, entry, tag = sharedCache(project_name), f"transect_frames_{dataset_type}", transectTag(selection, name)
+    arrays = cache.get(entry, source, tag)
+    if arrays is not None or not build: return arrays
+    transect = transectArrays(project_name, project_cache, selection)
+    plan = transectPlan(is_hyd, transect)
+    # The plan gathers from the crossed faces only
+    faces, local = np.unique(plan['faces'], return_inverse=True)
+    plan, var = {**plan, 'faces': local.reshape(-1)}, data_ds[name]
+    var = var.isel({var.dims[1] if is_hyd else var.dims[2]: faces})
+    n_steps = var.shape[0]
+    if n_steps == 0: return None # No frame to render, an entry without frames is never published
+    # Frames are written to a memory-mapped file of the entry, only one chunk is held in memory
+    pending, frames, vmin, vmax = cache.create(entry, source, tag), None, np.full(n_steps, np.nan), np.full(n_steps, np.nan)
+    try:
+        for start in range(0, n_steps, TRANSECT_CHUNK):
+            if cancelled and cancelled(): break
+            for i, values in enumerate(np.asarray(var[start:start + TRANSECT_CHUNK].values)):
+                frame = meshProcess(is_hyd, values if is_hyd else values.T, transect, plan)
+                if frames is None: frames = pending.open('frames', (n_steps,) + frame.shape, np.float32)
+                frames[start + i] = frame
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore', RuntimeWarning) # All-NaN frames
+                    vmin[start + i], vmax[start + i] = np.nanmin(frame), np.nanmax(frame)
+            if progress: progress(min(n_steps, start + TRANSECT_CHUNK), n_steps)
+        if cancelled and cancelled():
+            pending.discard()
+            return None
+        frames = None
+        pending.save('vmin', vmin)
+        pending.save('vmax', vmax)
+    except BaseException:
+        frames = None
+        pending.discard()
+        raise
+    return pending.commit()
+
+def vectorFrames(data_map: xr.Dataset, value_type: str, row_idx: int, steps) -> dict:
+    """
+    Read the velocity components of one layer (or the depth average) for one time step or a range of time steps,
+    the three variables are read in one pass.
+
+    Parameters:
+    ----------
+    data_map: xr.Dataset
+        The dataset received from _map file.
+    value_type: str
+        'Average' or one specific layer.
+    row_idx: int
+        The index of the interested layer.
+    steps: int | slice
+        The time step, or a slice of time steps.
+
+    Returns:
+    -------
+    dict
+        The float32 u, v and magnitude (faces, or time steps by faces for a slice), NaN on dry faces.
+    """
+    names = ['mesh2d_ucxa', 'mesh2d_ucya', 'mesh2d_ucmaga'] if value_type == 'Average' else ['mesh2d_ucx', 'mesh2d_ucy', 'mesh2d_ucmag']
+    arrays = [data_map[name].isel(time=steps) for name in names]
+    if value_type != 'Average': arrays = [arr[..., row_idx] for arr in arrays]
+    values = dask.compute(*[arr.data for arr in arrays])
+    return {key: np.asarray(value, dtype=np.float32) for key, value in zip(['u', 'v', 'magnitude'], values)}
+
 def interpolation_Z(grid_net: gpd.GeoDataFrame, x_coords: np.ndarray, y_coords: np.ndarray,
         z_values: np.ndarray, n_neighbors: int=2, geo_type: str='polygon') -> np.ndarray:
     """
@@ -1029,6 +1909,33 @@ def interpolation_Z(grid_net: gpd.GeoDataFrame, x_coords: np.ndarray, y_coords:
     value = np.sum(weight * z_values[idx], axis=1)/np.sum(weight, axis=1)
     return numberFormatter(value)
 
+def emptyLayers(data_map: xr.Dataset, names: list) -> np.ndarray:
+    """
+    Find the layers where at least one of the variables is all NaN.
+    Read from the statistics sidecar when available, otherwise all variables are reduced in a single pass over the store.
+
+    Parameters:
+    ----------
+    data_map: xr.Dataset
+        The dataset received from _map file.
+    names: list
+        The names of the variables (time, faces, layers).
+
+    Returns:
+    -------
+    np.ndarray
+        A boolean mask by layer index.
+    """
+    stats = datasetStatistics(data_map, compute=False)
+    if all(name in stats and 'layer_nan' in stats[name] for name in names):
+        return np.any([np.asarray(stats[name]['layer_nan'], dtype=np.float64) >= 1 for name in names], axis=0)
+    tasks = []
+    for name in names:
+        var = data_map[name]
+        layer_dim = next(d for d in var.dims if d in zarr_converter.LAYER_DIMS)
+        tasks.append(var.isnull().all(dim=[d for d in var.dims if d != layer_dim]).data)
+    return np.any(dask.compute(*tasks), axis=0)
+
 def layerCounter(data_map: xr.Dataset, type: str='hyd') -> dict:
     """
     Check how many layers are available.
@@ -1050,20 +1957,14 @@ def layerCounter(data_map: xr.Dataset, type: str='hyd') -> dict:
         z_layer = [round(x, 2) for x in data_map['mesh2d_layer_z'].values]
         # Add depth-average if available
         if {'mesh2d_ucxa', 'mesh2d_ucya'}.issubset(data_map.variables.keys()): layers['-1'] = 'Average'
+        empty = emptyLayers(data_map, ['mesh2d_ucx', 'mesh2d_ucy', 'mesh2d_ucmag'])
         # Iterate from bottom to surface
-        ucx = data_map['mesh2d_ucx'].data
-        ucy = data_map['mesh2d_ucy'].data
-        ucm = data_map['mesh2d_ucmag'].data
         for i in reversed(range(len(z_layer))):
-            # Use dask to speed up, keep lazy-load
             note, counter = '', len(z_layer)-i-1
             if counter == 0: note = ' (surface)'
             elif counter == len(z_layer)-1: note = ' (bottom)'
-            ucx_i = ucx[:, :, i].compute()
-            ucy_i = ucy[:, :, i].compute()
-            ucm_i = ucm[:, :, i].compute()
-            # Check if all values are nan
-            if (np.isnan(ucx_i).all() or np.isnan(ucy_i).all() or np.isnan(ucm_i).all()): continue
+            # Skip layers where one of the velocity variables is all NaN
+            if empty[i]: continue
             layers[str(counter)] = f'Depth: {z_layer[i]} m{note}'
     else:
         z_layer = np.round([100*x for x in data_map['mesh2d_layer_dlwq'].data.compute()], 0)
@@ -1072,7 +1973,53 @@ def layerCounter(data_map: xr.Dataset, type: str='hyd') -> dict:
             layers[str(len(z_layer)-i-1)] = f'Sigma: {z_layer[i]} %'
     return layers
 
-def vectorComputer(data_map: xr.Dataset, value_type: str, row_idx: int, step: int=-1) -> dict:
+def vectorCoordinates(project_name: str, project_cache: dict) -> tuple:
+    """
+    Get the coordinates of the vectors (mesh2d_face_x/y), read once per _map file and kept in the shared cache.
+
+    Parameters:
+    ----------
+    project_name: str
+        The name of the project.
+    project_cache: dict
+        The in-memory cache of the project.
+
+    Returns:
+    -------
+    tuple
+        The x and y coordinates of all faces.
+    """
+    mesh = meshArrays(project_cache.get("hyd_map"), project_cache.get("hyd_map_path"), sharedCache(project_name))
+    return mesh['face_x'], mesh['face_y']
+
+def vectorFaces(project_name: str, project_cache: dict, bbox=None, spacing=None) -> np.ndarray:
+    """
+    Get the faces to draw vectors on: the faces in the map view (see viewFaces),
+    thinned to at most one vector per cell of spacing (see mesh_functions.thinPoints).
+
+    Parameters:
+    ----------
+    project_name: str
+        The name of the project.
+    project_cache: dict
+        The in-memory cache of the project.
+    bbox: list
+        The map view (west, south, east, north), None for the whole grid.
+    spacing: float
+        The smallest distance between two vectors (in the unit of the face coordinates), None to keep all faces.
+
+    Returns:
+    -------
+    np.ndarray
+        The sorted int32 indices of the faces, None for all faces.
+    """
+    faces = viewFaces(project_name, project_cache, bbox) if bbox else None
+    if not spacing or float(spacing) <= 0: return faces
+    x, y = vectorCoordinates(project_name, project_cache)
+    return mesh_functions.thinPoints(x, y, float(spacing), faces).astype(np.int32)
+
+def vectorComputer(data_map: xr.Dataset, value_type: str, row_idx: int, step: int=-1, as_arrays: bool=False,
+        faces: np.ndarray=None) -> dict:
     """
     Compute vector in each layer and average value (if possible)
 
@@ -1086,37 +2033,99 @@ def vectorComputer(data_map: xr.Dataset, value_type: str, row_idx: int, step: in
         The index of the interested layer.
     step: int
         The index of the interested time step.
+    as_arrays: bool
+        Keep the values as numpy arrays (for binary responses) instead of lists.
+    faces: np.ndarray
+        Only compute the vectors of these faces (see vectorFaces), all faces if not given.
 
     Returns:
     -------
     dict
-        A dictionary containing time, coordinates, and values of the vector.
+        The time, then the index of the faces with a vector (dry faces are skipped) and their u, v and magnitude.
+        The coordinates of the faces are sent once (see vectorCoordinates).
     """
-    if value_type == 'Average':
-        # Average velocity in each layer
-        ucx = data_map['mesh2d_ucxa'].isel(time=step).values
-        ucy = data_map['mesh2d_ucya'].isel(time=step).values
-        ucm = data_map['mesh2d_ucmaga'].isel(time=step).values
-    else:
-        # Velocity for specific layer
-        ucx = data_map['mesh2d_ucx'].isel(time=step).values[:, row_idx]
-        ucy = data_map['mesh2d_ucy'].isel(time=step).values[:, row_idx]
-        ucm = data_map['mesh2d_ucmag'].isel(time=step).values[:, row_idx]
-    # Get indices of non-nan values
-    col_idx = np.where(~np.isnan(ucx) & ~np.isnan(ucy) & ~np.isnan(ucm))
-    # Coordinates (filtered)
-    x_coords = data_map['mesh2d_face_x'].values[col_idx]
-    y_coords = data_map['mesh2d_face_y'].values[col_idx]
-    # Values (filtered)
-    ucx_valid = np.round(ucx[col_idx].astype(np.float64), 5)
-    ucy_valid = np.round(ucy[col_idx].astype(np.float64), 5)
-    ucm_valid = np.round(ucm[col_idx].astype(np.float64), 2)
+    frame = vectorFrames(data_map, value_type, row_idx, step)
+    ucx, ucy, ucm = frame['u'], frame['v'], frame['magnitude']
+    index = np.arange(len(ucx)) if faces is None else np.asarray(faces)
+    index = index[np.isfinite(ucx[index]) & np.isfinite(ucy[index]) & np.isfinite(ucm[index])].astype(np.int32)
     result = {"time": pd.to_datetime(data_map['time'].values[step]).strftime('%Y-%m-%d %H:%M:%S'),
-        "coordinates": np.column_stack((x_coords, y_coords)).tolist(),
-        "values": np.column_stack((ucx_valid, ucy_valid, ucm_valid)).tolist()
-    }
+        "index": index, "u": ucx[index], "v": ucy[index], "magnitude": ucm[index]}
+    if as_arrays: return result
+    result.update({"index": index.tolist(), "u": np.round(ucx[index].astype(np.float64), 5).tolist(),
+        "v": np.round(ucy[index].astype(np.float64), 5).tolist(), "magnitude": np.round(ucm[index].astype(np.float64), 2).tolist()})
     return result
 
+def faceLocator(project_name: str, project_cache: dict) -> tuple:
+    """
+    Get the point location index of the faces (see mesh_functions.faceLocator): the arrays are built once
+    per grid version and kept in the shared cache, the tree of the face centres once per worker.
+
+    Parameters:
+    ----------
+    project_name: str
+        The name of the project.
+    project_cache: dict
+        The in-memory cache of the project.
+
+    Returns:
+    -------
+    tuple
+        The point location arrays and the cKDTree of the face centres.
+    """
+    grid = getGrid(project_name, project_cache)
+    if grid is None: raise ValueError("Grid is not available.")
+    grid_path = os.path.normpath(os.path.join(PROJECT_STATIC_ROOT, project_name, "output", "config", 'grid_hyd.npz'))
+    def build():
+        print('Creating face locator...')
+        return mesh_functions.faceLocator(grid.geometry.values, grid.crs)
+    arrays = sharedCache(project_name).get_or_create('locator', grid_path, build)
+    # Same mapped arrays as long as the grid doesn't change
+    cached = project_cache.get("face_locator")
+    if cached is None or cached[0] is not arrays:
+        cached = project_cache["face_locator"] = (arrays, cKDTree(np.column_stack((arrays['x'], arrays['y']))))
+    return cached
+
+def vectorStreamlines(project_name: str, project_cache: dict, value_type: str, row_idx: int, step: int=-1,
+        as_arrays: bool=False) -> dict:
+    """
+    Get the streamlines of the velocity of one layer (or the depth average) at one time step
+    (see mesh_functions.traceStreamlines), traced once per time step and layer and kept in the shared cache
+    (the most recently used time steps and layers only).
+
+    Parameters:
+    ----------
+    project_name: str
+        The name of the project.
+    project_cache: dict
+        The in-memory cache of the project.
+    value_type: str
+        'Average' or one specific layer.
+    row_idx: int
+        The index of the interested layer.
+    step: int
+        The index of the interested time step.
+    as_arrays: bool
+        Keep the lines as numpy arrays (for binary responses) instead of lists.
+
+    Returns:
+    -------
+    dict
+        The time, the points of the lines (x, y), the start of each line (offsets) and their mean speed.
+    """
+    data_map, source = project_cache.get("hyd_map"), project_cache.get("hyd_map_path")
+    step = int(step) % data_map.sizes['time']
+    layer = 'average' if value_type == 'Average' else int(row_idx)
+    def build():
+        locator, tree = faceLocator(project_name, project_cache)
+        frame = vectorFrames(data_map, value_type, row_idx, step)
+        return mesh_functions.traceStreamlines(locator, tree, frame['u'], frame['v'], STREAMLINE_SEEDS, STREAMLINE_STEPS)
+    lines = sharedCache(project_name).get_or_create('streamlines', source, build,
+        tag=f'{layer}-{step}-{STREAMLINE_SEEDS}-{STREAMLINE_STEPS}', max_tagged=STREAMLINE_CACHE_STEPS)
+    result = {"time": pd.to_datetime(data_map['time'].values[step]).strftime('%Y-%m-%d %H:%M:%S')}
+    if as_arrays: return {**result, **lines}
+    return {**result, 'x': np.round(lines['x'].astype(np.float64), 6).tolist(), 'y': np.round(lines['y'].astype(np.float64), 6).tolist(),
+        'offsets': lines['offsets'].tolist(), 'speed': np.round(lines['speed'].astype(np.float64), 2).tolist()}
+
 def fileWriter(template_path: str, params: dict) -> str:
     """
     Write to file with predefined parameters
@@ -1209,7 +2218,36 @@ def contentWriter(project_name: str, filename: str, data: list, content: str, un
         status, message = 'error', f"Error: {str(e)}"
     return status, message
 
-def postProcess(directory: str) -> dict:
+def ncToZarr(src: str, output_dir: str, progress=None) -> str:
+    """
+    Convert a NetCDF output to zarr, chunked for the way it is read:
+    _map files frame by frame, _his files as time series (see zarr_converter.chunk_plan).
+
+    Parameters:
+    ----------
+    src: str
+        The path of the NetCDF file (_map.nc or _his.nc).
+    output_dir: str
+        The output folder (output/HYD or output/WAQ).
+    progress: Callable
+        Called with (file name, variable name, written variables, total variables).
+
+    Returns:
+    -------
+    str
+        The path of the zarr store.
+    """
+    name, is_map = os.path.basename(src).replace('.nc', '.zarr'), src.endswith('_map.nc')
+    zarr_path = os.path.normpath(os.path.join(output_dir, name))
+    options = {'codec': ZARR_CODEC, 'clevel': ZARR_CLEVEL, 'downcast': ZARR_DOWNCAST, 'workers': ZARR_WORKERS,
+        'progress': (lambda var, done, total: progress(name, var, done, total)) if progress else None}
+    zarr_converter.convert(src, zarr_path, 'frame' if is_map else 'series', **options)
+    # Statistics are computed once here, the endpoints read them instead of scanning the store
+    with xr.open_zarr(zarr_path, consolidated=True) as ds:
+        zarr_converter.write_statistics(ds, statisticsPath(zarr_path), shared_cache.source_version(zarr_path))
+    return zarr_path
+
+def postProcess(directory: str, progress=None) -> dict:
     """
     Moving folders generated by FlowFM
 
@@ -1217,6 +2255,8 @@ def postProcess(directory: str) -> dict:
     ----------
     directory: str
         The directory of the project
+    progress: Callable
+        Conversion progress callback (see ncToZarr)
 
     Returns
     -------
@@ -1254,13 +2294,7 @@ def postProcess(directory: str) -> dict:
             # shutil.copy2(src, output_HYD_path)
 
             # Using .zarr format
-            if f.endswith('.nc'):
-                zarr_path = os.path.normpath(os.path.join(output_HYD_path, f.replace('.nc', '.zarr')))
-                tmp_path = zarr_path + "_tmp"
-                if os.path.exists(tmp_path): shutil.rmtree(tmp_path, onerror=remove_readonly)
-                with xr.open_dataset(src, chunks='auto') as ds:
-                    ds.to_zarr(tmp_path, mode='w', consolidated=True, compute=True)
-                os.rename(tmp_path, zarr_path)
+            if f.endswith('.nc'): ncToZarr(src, output_HYD_path, progress)
             else: shutil.copy2(src, output_HYD_path)
             safe_remove(src)
         # Clean DFM_OUTPUT folder
@@ -1268,51 +2302,87 @@ def postProcess(directory: str) -> dict:
         return {'status': 'ok', 'message': 'Simulation completed successfully'}
     except Exception as e: return {'status': 'error', 'message': str(e)}
 
-def meshProcess(is_hyd: bool, arr: np.ndarray, cache: dict) -> np.ndarray:
+def transectPlan(is_hyd: bool, cache: dict) -> dict:
     """
-    Optimized mesh processing using vectorization and interp1d interpolation.
+    Frame-independent parts of the transect rendering (see meshProcess): where the values of each face and layer go
+    in the frame, the nearest-fill indices of the empty cells and the mask of the cells below the bed.
 
     Parameters
     ----------
     is_hyd: bool
         True if HYD, False if WAQ.
-    arr: np.ndarray
-        The array to be processed.
     cache: dict
-        Cache containing 'df', 'depth_values', 'n_rows'.
+        Arrays of the transect (see transectArrays): 'index', 'depth', 'depth_values', 'n_rows'.
 
     Returns
     -------
-    np.ndarray
-        The smoothed values.
+    dict
+        The frame shape, the cells with a value ('cells', flat indices) and their source ('faces', 'layers'),
+        the nearest-fill flat indices ('fill'), the cells below the bed ('below'), the points outside the grid ('outside')
+        and the last row kept ('max_row').
     """
-    cache_copy = cache.copy()
-    data = cache_copy["df"]
-    df = pd.DataFrame(data=data["data"], columns=data["columns"], index=data["index"])
-    df_depth = np.array(df["depth"].values, dtype=float)
-    depth_values = np.array(cache_copy["depth_values"], dtype=float)
-    depth_rounded, n_rows = abs(np.round(depth_values, 0)), cache_copy["n_rows"]
+    df_index, df_depth = np.asarray(cache["index"]), np.asarray(cache["depth"], dtype=float)
+    depth_values = np.asarray(cache["depth_values"], dtype=float)
+    depth_rounded, n_rows = abs(np.round(depth_values, 0)), int(cache["n_rows"][0])
     if is_hyd: index_map = {int(v): len(depth_rounded)-i-1 for i, v in enumerate(depth_rounded)}
     else: index_map = {int(v): i for i, v in enumerate(depth_rounded)}
-    # Pre-allocate frame
-    frame = np.full((len(df), abs(n_rows)), np.nan, float)
-    values_filtered = arr[df.index.values, :]
     depth_int = depth_rounded.astype(int)
     valid_depth = np.unique(depth_int[depth_int < abs(n_rows)])
-    col_idx = np.array([index_map[d] for d in valid_depth])
-    mask = df_depth[:, None] <= -valid_depth[None, :]
-    vals = values_filtered[:, col_idx]
-    frame[:, valid_depth] = np.where(mask, vals, frame[:, valid_depth])
-    # Interpolate and fill missing values row-wise
-    mask = ~np.isnan(frame)
-    _, (ix, iy) = distance_transform_edt(~mask, return_indices=True)
-    frame_filled = gaussian_filter(frame[ix, iy], sigma=(1.2, 0.6))
-    frame = np.clip(frame_filled, 0, None)
+    col_idx = np.array([index_map[d] for d in valid_depth], dtype=np.int64)
+    # Layers above the bed of each point inside the grid
+    rows, k = np.nonzero((df_depth[:, None] <= -valid_depth[None, :]) & (df_index[:, None] >= 0))
+    shape = (len(df_index), abs(n_rows))
+    filled = np.zeros(shape, dtype=bool)
+    filled[rows, valid_depth[k]] = True
+    _, (ix, iy) = distance_transform_edt(~filled, return_indices=True)
     mask_valid = -np.arange(abs(n_rows))[None, :] >= df_depth[:, None]
-    max_row = np.max(np.where(mask_valid.T)[0])
-    frame[~mask_valid] = np.nan
-    smoothed_transpose = frame.T[:max_row + 2, :]
-    return smoothed_transpose
+    # Flat indices, cheaper to gather than pairs of indices
+    return {'shape': shape, 'cells': np.ravel_multi_index((rows, valid_depth[k]), shape), 'faces': df_index[rows], 'layers': col_idx[k],
+        'fill': np.ravel_multi_index((ix, iy), shape), 'below': np.flatnonzero(~mask_valid), 'outside': np.flatnonzero(df_index < 0),
+        'max_row': int(np.max(np.where(mask_valid.T)[0]))}
+
+def getTransectPlan(project_cache: dict, is_hyd: bool, cache: dict) -> dict:
+    # Plan of the current transect (see transectPlan), kept in memory as long as the transect arrays are the same
+    key = f"transect_plan_{'hyd' if is_hyd else 'waq'}"
+    plan = project_cache.get(key)
+    if plan is None or plan['transect'] is not cache: plan = project_cache[key] = {**transectPlan(is_hyd, cache), 'transect': cache}
+    return plan
+
+def meshProcess(is_hyd: bool, arr: np.ndarray, cache: dict, plan: dict=None) -> np.ndarray:
+    """
+    Render one frame of a transect: the values of the faces are gathered in the frame,
+    the empty cells take the value of the nearest cell, then the frame is smoothed once.
+
+    Parameters
+    ----------
+    is_hyd: bool
+        True if HYD, False if WAQ.
+    arr: np.ndarray
+        The array to be processed.
+    cache: dict
+        Arrays of the transect (see transectArrays): 'index', 'depth', 'depth_values', 'n_rows'.
+    plan: dict
+        The frame-independent parts (see transectPlan), computed from cache if not given.
+
+    Returns
+    -------
+    np.ndarray
+        The smoothed values.
+    """
+    if plan is None: plan = transectPlan(is_hyd, cache)
+    frame, shape = np.full(plan['shape'], np.nan, float), plan['shape']
+    values = arr[plan['faces'], plan['layers']]
+    frame.flat[plan['cells']] = values
+    fill = plan['fill']
+    # Missing values (e.g. dry faces) change the cells to fill, only then the indices are computed again
+    if np.isnan(values).any():
+        _, (ix, iy) = distance_transform_edt(np.isnan(frame), return_indices=True)
+        fill = np.ravel_multi_index((ix, iy), shape)
+    frame = np.clip(gaussian_filter(frame.ravel()[fill], sigma=(1.2, 0.6)), 0, None)
+    frame.flat[plan['below']] = np.nan
+    # Points outside the grid have no value
+    frame[plan['outside'], :] = np.nan
+    return frame.T[:plan['max_row'] + 2, :]
 
 def seconds_datetime(seconds: int) -> tuple:
     days = seconds // 86400
@@ -0,0 +1,460 @@
+import shapely, pyproj
+import numpy as np
+
+def reprojectNodes(node_x: np.ndarray, node_y: np.ndarray, crs_from, crs_to=4326) -> tuple:
+    """
+    Reproject node coordinates once (instead of every polygon).
+
+    Parameters:
+    ----------
+    node_x: np.ndarray
+        The x coordinates of the nodes.
+    node_y: np.ndarray
+        The y coordinates of the nodes.
+    crs_from:
+        The coordinate reference system of the nodes.
+    crs_to:
+        The target coordinate reference system, default is WGS84.
+
+    Returns:
+    -------
+    tuple
+        The reprojected x and y coordinates.
+    """
+    transformer = pyproj.Transformer.from_crs(crs_from, crs_to, always_xy=True)
+    x, y = transformer.transform(np.asarray(node_x, dtype=np.float64), np.asarray(node_y, dtype=np.float64))
+    return np.asarray(x), np.asarray(y)
+
+def polygonBuilder(node_x: np.ndarray, node_y: np.ndarray, face_nodes: np.ndarray) -> np.ndarray:
+    """
+    Build all face polygons at once with shapely 2.x ragged array constructors.
+
+    Parameters:
+    ----------
+    node_x: np.ndarray
+        The x coordinates of the nodes.
+    node_y: np.ndarray
+        The y coordinates of the nodes.
+    face_nodes: np.ndarray
+        The 0-based node indices of each face, padded with -1 at the end.
+
+    Returns:
+    -------
+    np.ndarray
+        The array of shapely polygons, one per face.
+    """
+    faces = np.asarray(face_nodes)
+    n_faces, max_nodes = faces.shape
+    counts = np.sum(faces != -1, axis=1)
+    # Close the rings by repeating the first node after the last valid node
+    closed = np.full((n_faces, max_nodes + 1), -1, dtype=np.int64)
+    closed[:, :max_nodes] = faces
+    closed[np.arange(n_faces), counts] = faces[:, 0]
+    node_idx = closed[closed != -1]
+    coords = np.column_stack((np.asarray(node_x, dtype=np.float64)[node_idx], np.asarray(node_y, dtype=np.float64)[node_idx]))
+    ring_offsets = np.concatenate(([0], np.cumsum(counts + 1))).astype(np.int64)
+    polygon_offsets = np.arange(n_faces + 1, dtype=np.int64)
+    return shapely.from_ragged_array(shapely.GeometryType.POLYGON, coords, (ring_offsets, polygon_offsets))
+
+def flatFaces(face_nodes: np.ndarray) -> tuple:
+    """
+    Flatten the face-node indices of the mesh (padded with -1) into offsets and indices.
+
+    Parameters:
+    ----------
+    face_nodes: np.ndarray
+        The 0-based node indices of each face, padded with -1 at the end.
+
+    Returns:
+    -------
+    tuple
+        The face offsets (n_faces + 1) and the flat face-node indices.
+    """
+    faces = np.asarray(face_nodes)
+    counts = np.sum(faces != -1, axis=1)
+    face_offsets = np.concatenate(([0], np.cumsum(counts)))
+    return face_offsets.astype(np.uint32), faces[faces != -1].astype(np.uint32)
+
+def compactMesh(coords: np.ndarray, ring_offsets: np.ndarray) -> tuple:
+    """
+    Turn closed polygon rings (one ring per face) back into deduplicated nodes and face-node indices.
+
+    Parameters:
+    ----------
+    coords: np.ndarray
+        The (n, 2) coordinates of all rings, each ring closed by repeating its first node.
+    ring_offsets: np.ndarray
+        The offsets of the rings in coords.
+
+    Returns:
+    -------
+    tuple
+        The unique (m, 2) node coordinates, the face offsets (n_faces + 1) and the flat face-node indices.
+    """
+    ring_offsets = np.asarray(ring_offsets, dtype=np.int64)
+    # Drop the closing node of every ring
+    keep = np.ones(len(coords), dtype=bool)
+    keep[ring_offsets[1:] - 1] = False
+    nodes, inverse = np.unique(np.asarray(coords)[keep], axis=0, return_inverse=True)
+    face_offsets = np.concatenate(([0], np.cumsum(np.diff(ring_offsets) - 1)))
+    return nodes, face_offsets.astype(np.uint32), inverse.reshape(-1).astype(np.uint32)
+
+def _mercator(crs):
+    # Vectorized coordinate transform from the grid CRS to web mercator (metres of the map tiles)
+    transformer = pyproj.Transformer.from_crs(crs or 4326, 3857, always_xy=True)
+    return lambda xy: np.column_stack(transformer.transform(xy[:, 0], xy[:, 1]))
+
+def faceClusters(x: np.ndarray, y: np.ndarray, origin: np.ndarray, cell_size: float) -> tuple:
+    """
+    Group faces by the cell of a regular grid that contains their centre.
+
+    Parameters:
+    ----------
+    x: np.ndarray
+        The x coordinates of the face centres.
+    y: np.ndarray
+        The y coordinates of the face centres.
+    origin: np.ndarray
+        The lower left corner of the grid of cells.
+    cell_size: float
+        The size of the cells.
+
+    Returns:
+    -------
+    tuple
+        The cluster of each face (int32, 0 to n_clusters - 1) and the number of clusters.
+    """
+    ix = np.floor((np.asarray(x) - origin[0]) / cell_size).astype(np.int64)
+    iy = np.floor((np.asarray(y) - origin[1]) / cell_size).astype(np.int64)
+    cells, labels = np.unique(ix * (int(iy.max()) + 1 if len(iy) > 0 else 1) + iy, return_inverse=True)
+    return labels.reshape(-1).astype(np.int32), len(cells)
+
+def clusterLevels(polygons: np.ndarray, crs=None, max_levels: int=6, min_clusters: int=2000, pixels: float=4) -> dict:
+    """
+    Build a level-of-detail hierarchy of the faces: level 0 is the mesh itself,
+    each next level groups the faces in cells (in web mercator metres) at least twice as large.
+    Levels stop once they have less than min_clusters clusters.
+
+    Parameters:
+    ----------
+    polygons: np.ndarray
+        The face polygons.
+    crs:
+        The coordinate reference system of the polygons, WGS84 if not given.
+    max_levels: int
+        The largest number of coarse levels.
+    min_clusters: int
+        No coarser level is built below this number of clusters.
+    pixels: float
+        Size on screen (pixels) of the cells of a level when it is used, gives the resolution of each level.
+
+    Returns:
+    -------
+    dict
+        'area' (float32 weight of each face), then 'cell_size', 'clusters' and 'resolution' (metres per pixel
+        from which the level is used) per level, and 'labels_<level>' (cluster of each face) for the coarse levels.
+    """
+    metric = shapely.transform(polygons, _mercator(crs))
+    centres = shapely.get_coordinates(shapely.centroid(metric))
+    area = shapely.area(metric)
+    n_faces = len(polygons)
+    origin = centres.min(axis=0) if n_faces > 0 else np.zeros(2)
+    # Typical face size of the mesh
+    base = float(np.sqrt(np.median(area))) if n_faces > 0 else 1.0
+    sizes, counts, result, factor = [base], [n_faces], {}, 2
+    while len(sizes) <= max_levels and counts[-1] > min_clusters and factor <= 2**20:
+        size, factor = base*factor, factor*2
+        labels, n_clusters = faceClusters(centres[:, 0], centres[:, 1], origin, size)
+        # Skip cell sizes that hardly merge any faces (e.g. mesh refinement)
+        if n_clusters > 0.6*counts[-1]: continue
+        result[f'labels_{len(sizes)}'] = labels
+        sizes.append(size); counts.append(n_clusters)
+    sizes = np.asarray(sizes, dtype=np.float64)
+    result.update({'area': area.astype(np.float32), 'cell_size': sizes,
+        'clusters': np.asarray(counts, dtype=np.int64), 'resolution': sizes / pixels})
+    return result
+
+def clusterPolygons(polygons: np.ndarray, labels: np.ndarray, n_clusters: int) -> np.ndarray:
+    """
+    Polygons of the clusters of a level (see clusterLevels): the faces of each cluster are merged.
+    Only the outer ring of the largest part is kept (one ring per cluster, as for faces),
+    so islands smaller than a cluster are filled.
+
+    Parameters:
+    ----------
+    polygons: np.ndarray
+        The face polygons.
+    labels: np.ndarray
+        The cluster of each face.
+    n_clusters: int
+        The number of clusters.
+
+    Returns:
+    -------
+    np.ndarray
+        The cluster polygons.
+    """
+    polygons, labels = np.asarray(polygons), np.asarray(labels)
+    order, sizes = np.argsort(labels, kind='stable'), np.bincount(labels, minlength=n_clusters)
+    starts, merged = np.cumsum(sizes) - sizes, np.empty(n_clusters, dtype=object)
+    # Faces share their nodes (a coverage), the clusters with the same number of faces are merged at once
+    for size in np.unique(sizes[sizes > 0]):
+        clusters = np.flatnonzero(sizes == size)
+        faces = polygons[order[starts[clusters][:, None] + np.arange(size)]]
+        try: merged[clusters] = shapely.coverage_union_all(faces, axis=1)
+        except shapely.errors.GEOSException: merged[clusters] = shapely.union_all(faces, axis=1) # Faces not matching exactly
+    parts, index = shapely.get_parts(merged, return_index=True)
+    ranked = np.lexsort((-shapely.area(parts), index))
+    _, first = np.unique(index[ranked], return_index=True)
+    rings = shapely.polygons(shapely.get_exterior_ring(parts[ranked[first]]))
+    # Drop the nodes left in the middle of straight edges
+    return shapely.simplify(rings, 0)
+
+def clusterMean(values: np.ndarray, labels: np.ndarray, weights: np.ndarray, n_clusters: int) -> np.ndarray:
+    """
+    Weighted mean of the face values over each cluster, NaN faces are ignored.
+
+    Parameters:
+    ----------
+    values: np.ndarray
+        The values of the faces (faces on the last axis, e.g. time steps by faces).
+    labels: np.ndarray
+        The cluster of each face.
+    weights: np.ndarray
+        The weight (area) of each face.
+    n_clusters: int
+        The number of clusters.
+
+    Returns:
+    -------
+    np.ndarray
+        The float32 values of the clusters (clusters on the last axis), NaN for clusters without value.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    flat = values.reshape(-1, values.shape[-1])
+    valid = np.isfinite(flat)
+    w = np.where(valid, np.asarray(weights, dtype=np.float64), 0)
+    # One bincount for all rows: cluster ids of row i are shifted by i*n_clusters
+    bins = (np.arange(flat.shape[0], dtype=np.int64)*n_clusters)[:, None] + np.asarray(labels, dtype=np.int64)
+    size = flat.shape[0]*n_clusters
+    totals = np.bincount(bins.ravel(), weights=(np.where(valid, flat, 0)*w).ravel(), minlength=size)
+    counts = np.bincount(bins.ravel(), weights=w.ravel(), minlength=size)
+    with np.errstate(invalid='ignore', divide='ignore'): mean = np.where(counts > 0, totals / counts, np.nan)
+    return mean.reshape(values.shape[:-1] + (n_clusters,)).astype(np.float32)
+
+def pointIndex(x: np.ndarray, y: np.ndarray, per_cell: int=16) -> dict:
+    """
+    Bucket index of points (e.g. face centroids): the points are sorted by the cell of a regular grid
+    (about per_cell points per cell), the points of a cell are contiguous.
+
+    Parameters:
+    ----------
+    x: np.ndarray
+        The x coordinates of the points.
+    y: np.ndarray
+        The y coordinates of the points.
+    per_cell: int
+        The average number of points per cell.
+
+    Returns:
+    -------
+    dict
+        'order' (points sorted by cell), 'offsets' (start of each cell in order, n_cells + 1),
+        'x' and 'y' (float64 coordinates) and 'bounds' (xmin, ymin, cell width, cell height, cells per side).
+    """
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    side = max(1, int(np.sqrt(len(x) / per_cell)))
+    x0, y0 = (x.min(), y.min()) if len(x) > 0 else (0.0, 0.0)
+    dx = (x.max() - x0) / side if len(x) > 0 and x.max() > x0 else 1.0
+    dy = (y.max() - y0) / side if len(y) > 0 and y.max() > y0 else 1.0
+    cell = np.clip(((y - y0) // dy).astype(np.int64), 0, side - 1)*side + np.clip(((x - x0) // dx).astype(np.int64), 0, side - 1)
+    order = np.argsort(cell, kind='stable')
+    offsets = np.searchsorted(cell[order], np.arange(side*side + 1))
+    return {'order': order.astype(np.int32), 'offsets': offsets.astype(np.int64), 'x': x, 'y': y,
+        'bounds': np.array([x0, y0, dx, dy, side], dtype=np.float64)}
+
+def pointQuery(index: dict, bbox) -> np.ndarray:
+    """
+    Get the points inside a bounding box (see pointIndex).
+
+    Parameters:
+    ----------
+    index: dict
+        The bucket index of the points.
+    bbox:
+        The bounding box (xmin, ymin, xmax, ymax), edges included.
+
+    Returns:
+    -------
+    np.ndarray
+        The sorted indices of the points inside the bounding box.
+    """
+    xmin, ymin, xmax, ymax = [float(v) for v in bbox]
+    x0, y0, dx, dy, side = index['bounds']
+    side = int(side)
+    ix0, ix1 = [int(np.clip((v - x0) // dx, 0, side - 1)) for v in (xmin, xmax)]
+    iy0, iy1 = [int(np.clip((v - y0) // dy, 0, side - 1)) for v in (ymin, ymax)]
+    if xmin > xmax or ymin > ymax: return np.empty(0, dtype=np.int32)
+    # The cells of one row of the grid are contiguous in the index
+    offsets, order = index['offsets'], index['order']
+    candidates = np.concatenate([order[offsets[iy*side + ix0]:offsets[iy*side + ix1 + 1]] for iy in range(iy0, iy1 + 1)])
+    x, y = index['x'][candidates], index['y'][candidates]
+    return np.sort(candidates[(x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)])
+
+def thinPoints(x: np.ndarray, y: np.ndarray, spacing: float, points: np.ndarray=None) -> np.ndarray:
+    """
+    Keep at most one point per cell of a regular grid (the point closest to the centre of the cell),
+    e.g. to draw one vector arrow every few pixels. The choice only depends on the positions, so it is stable between frames.
+
+    Parameters:
+    ----------
+    x: np.ndarray
+        The x coordinates of all points.
+    y: np.ndarray
+        The y coordinates of all points.
+    spacing: float
+        The size of the cells, in the unit of the coordinates.
+    points: np.ndarray
+        The candidate points (e.g. the points in the map view), all points if not given.
+
+    Returns:
+    -------
+    np.ndarray
+        The sorted indices of the kept points.
+    """
+    points = np.arange(len(x)) if points is None else np.asarray(points)
+    if len(points) == 0: return points
+    px, py = np.asarray(x, dtype=np.float64)[points] / spacing, np.asarray(y, dtype=np.float64)[points] / spacing
+    ix, iy = np.floor(px), np.floor(py)
+    distance = (px - ix - 0.5)**2 + (py - iy - 0.5)**2
+    cell = (ix - ix.min()).astype(np.int64)*(int(iy.max() - iy.min()) + 1) + (iy - iy.min()).astype(np.int64)
+    # Closest point first in each cell
+    ranked = np.lexsort((distance, cell))
+    _, first = np.unique(cell[ranked], return_index=True)
+    return np.sort(points[ranked[first]])
+
+# Radius of the web mercator sphere (EPSG:3857)
+MERCATOR_RADIUS = 6378137.0
+
+def faceLocator(polygons: np.ndarray, crs=None) -> dict:
+    """
+    Point location arrays of the faces, in web mercator metres: a point is in the face with the nearest centre,
+    unless it is farther than the radius of this face (the point is then outside the mesh).
+
+    Parameters:
+    ----------
+    polygons: np.ndarray
+        The face polygons.
+    crs:
+        The coordinate reference system of the polygons, WGS84 if not given.
+
+    Returns:
+    -------
+    dict
+        'x' and 'y' (centres), 'radius' (farthest node from the centre), 'area'
+        and 'scale' (web mercator metres per metre on the ground, at the centre).
+    """
+    metric = shapely.transform(polygons, _mercator(crs))
+    centres = shapely.get_coordinates(shapely.centroid(metric))
+    coords, index = shapely.get_coordinates(metric, return_index=True)
+    radius = np.zeros(len(polygons), dtype=np.float64)
+    np.maximum.at(radius, index, np.hypot(*(coords - centres[index]).T))
+    latitude = 2*np.arctan(np.exp(centres[:, 1] / MERCATOR_RADIUS)) - np.pi/2
+    return {'x': centres[:, 0], 'y': centres[:, 1], 'radius': radius, 'area': shapely.area(metric),
+        'scale': 1 / np.cos(latitude)}
+
+def traceStreamlines(locator: dict, tree, u: np.ndarray, v: np.ndarray, n_seeds: int=2000, n_steps: int=40) -> dict:
+    """
+    Trace streamlines of the velocity of one time step: particles start at the centre of faces spread over the wet part
+    of the mesh (see thinPoints) and are advected all together with the midpoint scheme, the velocity being constant
+    in each face. A particle stops when it leaves the mesh or reaches a dry face.
+    The time step is chosen so that the fast particles (95th percentile) travel about 1.5 times the distance between seeds.
+
+    Parameters:
+    ----------
+    locator: dict
+        The point location arrays of the faces (see faceLocator).
+    tree: cKDTree
+        The tree of the face centres.
+    u: np.ndarray
+        The eastward velocity of the faces (m/s), NaN on dry faces.
+    v: np.ndarray
+        The northward velocity of the faces (m/s), NaN on dry faces.
+    n_seeds: int
+        The number of particles over the whole mesh (approximately).
+    n_steps: int
+        The number of time steps, lines have at most n_steps + 1 points.
+
+    Returns:
+    -------
+    dict
+        The lines as float32 'x' and 'y' (WGS84) of all points, 'offsets' (start of each line, n_lines + 1)
+        and the float32 mean 'speed' (m/s) of each line.
+    """
+    u, v = np.asarray(u, dtype=np.float64), np.asarray(v, dtype=np.float64)
+    wet = np.isfinite(u) & np.isfinite(v)
+    # Velocity in web mercator metres per second
+    vx, vy, speed = u*locator['scale'], v*locator['scale'], np.hypot(u, v)
+    spacing = float(np.sqrt(np.sum(locator['area'][wet]) / max(1, n_seeds))) if wet.any() else 0.0
+    fast = float(np.percentile(np.hypot(vx[wet], vy[wet]), 95)) if wet.any() else 0.0
+    if spacing <= 0 or fast <= 0:
+        return {'x': np.empty(0, dtype=np.float32), 'y': np.empty(0, dtype=np.float32),
+            'offsets': np.zeros(1, dtype=np.int32), 'speed': np.empty(0, dtype=np.float32)}
+    dt = 1.5*spacing / (n_steps*fast)
+    seeds = thinPoints(locator['x'], locator['y'], spacing, np.flatnonzero(wet))
+    def locate(points: np.ndarray) -> np.ndarray:
+        # Face of each point, -1 outside the mesh or on a dry face
+        distance, face = tree.query(points)
+        return np.where((distance <= locator['radius'][face]) & wet[face], face, -1)
+    points = np.full((len(seeds), n_steps + 1, 2), np.nan)
+    speeds = np.full((len(seeds), n_steps + 1), np.nan)
+    points[:, 0] = np.column_stack((locator['x'][seeds], locator['y'][seeds]))
+    speeds[:, 0], alive, face = speed[seeds], np.arange(len(seeds)), seeds
+    for i in range(n_steps):
+        start = points[alive, i]
+        middle = start + 0.5*dt*np.column_stack((vx[face], vy[face]))
+        face = locate(middle)
+        alive, start, face = alive[face >= 0], start[face >= 0], face[face >= 0]
+        end = start + dt*np.column_stack((vx[face], vy[face]))
+        face = locate(end)
+        alive, end, face = alive[face >= 0], end[face >= 0], face[face >= 0]
+        if len(alive) == 0: break
+        points[alive, i + 1], speeds[alive, i + 1] = end, speed[face]
+    # Points of a line are contiguous from its start, lines with one point are dropped
+    lengths = np.isfinite(points[:, :, 0]).sum(axis=1)
+    keep = lengths > 1
+    mask = np.isfinite(points[keep, :, 0])
+    x, y = points[keep][mask].T
+    with np.errstate(invalid='ignore'): mean_speed = np.nanmean(speeds[keep], axis=1) if keep.any() else np.empty(0)
+    longitude = np.degrees(x / MERCATOR_RADIUS)
+    latitude = np.degrees(2*np.arctan(np.exp(y / MERCATOR_RADIUS)) - np.pi/2)
+    return {'x': longitude.astype(np.float32), 'y': latitude.astype(np.float32),
+        'offsets': np.concatenate(([0], np.cumsum(lengths[keep]))).astype(np.int32), 'speed': mean_speed.astype(np.float32)}
+
+def locatePoints(tree: shapely.STRtree, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    Find the face that contains each point, with an STRtree of the face polygons.
+    A point on an edge gets the face with the smallest index, a point outside the mesh gets -1.
+
+    Parameters:
+    ----------
+    tree: shapely.STRtree
+        The tree of the face polygons.
+    x: np.ndarray
+        The x coordinates of the points.
+    y: np.ndarray
+        The y coordinates of the points.
+
+    Returns:
+    -------
+    np.ndarray
+        The int64 index of the face of each point, -1 outside the mesh.
+    """
+    points = shapely.points(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+    face = np.full(len(points), -1, dtype=np.int64)
+    # Smallest face of each point, pairs are (point, face)
+    pairs = tree.query(points, predicate='intersects')
+    ranked = np.lexsort((pairs[1], pairs[0]))
+    first = ranked[np.unique(pairs[0][ranked], return_index=True)[1]]
+    face[pairs[0][first]] = pairs[1][first]
+    return face
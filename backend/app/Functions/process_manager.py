@@ -1,9 +1,8 @@
-import os, json, re, math, asyncio, traceback, msgpack, datetime, zipfile, shutil
-from fastapi import APIRouter, Request, File, UploadFile, Form, Depends
-from Functions import functions
-from shapely.geometry import mapping
-from fastapi.responses import JSONResponse
-from config import PROJECT_STATIC_ROOT, STATIC_DIR_BACKEND
+import os, json, re, gzip, asyncio, traceback, msgpack, datetime, zipfile, shutil, hashlib
+from fastapi import APIRouter, Request, File, UploadFile, Form, Depends, Query, WebSocket, WebSocketDisconnect
+from Functions import functions, binary_frame, zarr_converter
+from fastapi.responses import JSONResponse, FileResponse, Response, StreamingResponse
+from config import PROJECT_STATIC_ROOT, STATIC_DIR_BACKEND, FRAME_BATCH_MAX_BYTES, STREAM_WINDOW, STREAM_MAX_RATE, TRANSECT_JOB_TTL
 import xarray as xr, pandas as pd, numpy as np, geopandas as gpd
 
 router = APIRouter()
@@ -44,17 +43,14 @@ async def process_internal(query: str, key: str, redis, project_cache, project_n
         data = json.loads(temp.to_json(orient='split', date_format='iso', indent=3))
     elif key == 'static':
         # Create static data for map
-        grid, hyd_map = project_cache.get("grid"), project_cache.get("hyd_map")
+        grid, hyd_map = await asyncio.to_thread(functions.getGrid, project_name, project_cache), project_cache.get("hyd_map")
         x = hyd_map['mesh2d_node_x'].data.compute()
         y = hyd_map['mesh2d_node_y'].data.compute()
         z = hyd_map['mesh2d_node_z'].data.compute()
         if 'depth' in query: values = functions.interpolation_Z(grid, x, y, z)
-        # Convert GeoDataFrame to expected format
+        # Meshes are served separately by /mesh_skeleton
         fnm = functions.numberFormatter
-        features = [{ "type": "Feature", "properties": {"index": idx}, "geometry": mapping(row['geometry'])} 
-                    for idx, row in grid.iterrows()]
-        data = { 'meshes': { 'type': 'FeatureCollection', 'features': features },
-            'values': values.tolist(), 'min_max': [fnm(np.nanmin(values)).tolist(), fnm(np.nanmax(values)).tolist()]
+        data = { 'values': functions.jsonSafe(values), 'min_max': [functions.jsonSafe(fnm(np.nanmin(values))), functions.jsonSafe(fnm(np.nanmax(values)))]
         }
     else:
         # Create time series data
@@ -80,6 +76,65 @@ async def process_data(request: Request, user=Depends(functions.basic_auth)):
         traceback.print_exc()
         return JSONResponse({'status': 'error', 'message': f"Error: {e}"})
 
+def accepts_gzip(accept_encoding: str) -> bool:
+    # The client accepts gzip content (Accept-Encoding: gzip or *, not with q=0)
+    for item in (accept_encoding or '').lower().split(','):
+        coding, _, params = item.strip().partition(';')
+        if coding.strip() in ('gzip', '*'):
+            q = params.strip()
+            return not (q.startswith('q=') and q[2:].strip() in ('0', '0.0', '0.00', '0.000'))
+    return False
+
+# Serve the pre-serialized GeoJSON mesh skeleton
+@router.get("/mesh_skeleton")
+async def mesh_skeleton(request: Request, projectName: str, fmt: str=Query('geojson', alias='format'), level: int=0,
+        user=Depends(functions.basic_auth)):
+    try:
+        project_name, _ = functions.project_definer(projectName, user)
+        project_cache, binary = request.app.state.project_cache.get(project_name), fmt == 'binary'
+        path, etag = await asyncio.to_thread(functions.meshSkeleton, project_name, project_cache, binary, level)
+        if path is None: return JSONResponse({"status": "error", "message": "Grid data not found."}, status_code=404)
+        compressed = accepts_gzip(request.headers.get('accept-encoding'))
+        if not compressed: etag = f'{etag[:-1]}-identity"' # Other representation of the same skeleton
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache', 'Vary': 'Accept-Encoding'}
+        if request.headers.get('if-none-match') == etag: return Response(status_code=304, headers=headers)
+        media_type = binary_frame.MEDIA_TYPE if binary else 'application/geo+json'
+        if not compressed:
+            # Decompressed while streaming for clients without gzip support
+            def chunks():
+                with gzip.open(path, 'rb') as f:
+                    while chunk := f.read(1024*1024): yield chunk
+            return StreamingResponse(chunks(), media_type=media_type, headers=headers)
+        # Content is already compressed, GZipMiddleware leaves it untouched
+        headers['Content-Encoding'] = 'gzip'
+        return FileResponse(path, media_type=media_type, headers=headers)
+    except Exception as e:
+        print('/mesh_skeleton:\n==============')
+        traceback.print_exc()
+        return JSONResponse({'status': 'error', 'message': f"Error: {e}"}, status_code=500)
+
+async def dynamic_selection(redis, project_cache, project_name: str, key: str, temp: list) -> tuple:
+    # Variable and layer of a dynamic map query ("<waq variable>|<layer>|...", empty variable for hydrodynamics)
+    is_hyd = temp[0] == '' # hydrodynamic or waq
+    dataset_type = "hyd" if is_hyd else "waq"
+    data_ds = project_cache.get("hyd_map") if is_hyd else project_cache.get("waq_map")
+    time_column = 'time' if is_hyd else 'nTimesDlwq'
+    name = functions.variablesNames.get(key, key) if is_hyd else temp[0]
+    if not 'single' in key:
+        layer_reverse_raw = await redis.hget(project_name, f"layer_reverse_{dataset_type}")
+        layer_reverse = msgpack.unpackb(layer_reverse_raw, raw=False)
+        value_type, n_layers = layer_reverse[temp[1]], len(layer_reverse)
+        row_idx = n_layers - int(temp[1]) - 2
+        if not is_hyd: row_idx = int(temp[1])
+    else: value_type, row_idx = 'single', None
+    if value_type == 'Average' and is_hyd:
+        # The depth average is computed once and persisted, the lock only avoids building it twice
+        average = await asyncio.to_thread(functions.depthAverage, project_name, project_cache, data_ds, name, False)
+        if average is None:
+            async with redis.lock(f"{project_name}:depth_average:{name}", timeout=600, blocking_timeout=590):
+                await asyncio.to_thread(functions.depthAverage, project_name, project_cache, data_ds, name)
+    return is_hyd, data_ds, time_column, name, value_type, row_idx
+
 # Load general dynamic data
 @router.post("/load_general_dynamic")
 async def load_general_dynamic(request: Request, user=Depends(functions.basic_auth)):
@@ -88,62 +143,40 @@ async def load_general_dynamic(request: Request, user=Depends(functions.basic_au
         body = await request.json()
         redis, query, key = request.app.state.redis, body.get('query'), body.get('key')
         project_name, _ = functions.project_definer(body.get('projectName'), user)
-        project_cache = request.app.state.project_cache.setdefault(project_name)
+        project_cache, binary = request.app.state.project_cache.setdefault(project_name), body.get('format') == 'binary'
         if not project_cache: return JSONResponse({"status": "error", "message": "Project is not available in memory"})
         hyd_his, hyd_map = project_cache.get("hyd_his"), project_cache.get("hyd_map")
         waq_his, waq_map = project_cache.get("waq_his"), project_cache.get("waq_map")
         if not any([hyd_his, hyd_map, waq_his, waq_map]): return JSONResponse({"status": "error", "message": "Project not initialized."})        
         temp = query.split('|')
-        is_hyd = temp[0] == '' # hydrodynamic or waq
-        # Split cache data by hydrodynamic or waq
-        dataset_type = "hyd" if is_hyd else "waq"
-        dynamic_cache_key = f"{project_name}:general_cache:{dataset_type}"
-        data_ds = hyd_map if is_hyd else waq_map
-        time_column = 'time' if is_hyd else 'nTimesDlwq'
-        name = functions.variablesNames.get(key, key) if is_hyd else temp[0]
-        values = data_ds[name].values
-        # Load dynamic cache from Redis
-        raw_cache = await redis.get(dynamic_cache_key)
-        if not raw_cache:
-            layer_reverse_raw = await redis.hget(project_name, f"layer_reverse_{dataset_type}")
-            layer_reverse = msgpack.unpackb(layer_reverse_raw, raw=False)
-            dynamic_cache = {"layer_reverse": layer_reverse, "layers": {}}
-        else: dynamic_cache = msgpack.unpackb(raw_cache, raw=False)
-        layer_reverse = dynamic_cache["layer_reverse"]
-        # Process data
-        if not 'single' in key: 
-            value_type, n_layers = layer_reverse[temp[1]], len(layer_reverse)
-            row_idx = n_layers - int(temp[1]) - 2
-            if not is_hyd: row_idx = int(temp[1])
-            lock = redis.lock(f"{project_name}:{value_type}", timeout=10)
-            async with lock:
-                layer_info = dynamic_cache['layers'].get(value_type)
-                if not layer_info:
-                    if value_type == 'Average':
-                        arr = np.nanmean(values, axis=2) if is_hyd else data_ds[f"{name.split('_')[0]}_2d_{name.split('_')[1]}"].values
-                    else: arr = values[:, :, row_idx] if is_hyd else values[:, row_idx, :]
-                    # Save layer atomic to Redis hash
-                    dynamic_cache['layers'][value_type] = {'data': functions.encode_array(arr), 'shape': arr.shape}
-                    await redis.set(dynamic_cache_key, msgpack.packb(dynamic_cache, use_bin_type=True), ex=600)
-                else: arr = functions.decode_array(layer_info["data"], layer_info["shape"])
-        else: arr = values
+        is_hyd, data_ds, time_column, name, value_type, row_idx = await dynamic_selection(
+            redis, project_cache, project_name, key, temp)
+        time_idx = -1 if temp[2] == 'load' else int(temp[2])
+        # Level of detail: given by the client, or chosen from the map resolution (metres per pixel) on the first load
+        level, resolution = body.get('level', 0), body.get('resolution') if temp[2] == 'load' else None
+        levels = await asyncio.to_thread(functions.meshLevels, project_name, project_cache) if level or temp[2] == 'load' else None
+        level = functions.meshLevel(levels, level, resolution)
+        def reader(step: int) -> np.ndarray:
+            frame = functions.frameReader(project_name, project_cache, data_ds, is_hyd, name, value_type, row_idx, step)
+            return functions.levelFrame(levels, level, frame)
+        if time_idx < 0: frame = await asyncio.to_thread(reader, time_idx)
+        else: # Playback: the next frames are read ahead
+            session = (user, project_name, 'general', name, value_type, row_idx, level, id(data_ds))
+            frame = await asyncio.to_thread(request.app.state.frame_prefetcher.get, session, time_idx,
+                reader, data_ds.sizes[time_column])
+        # Map view: only the faces inside the bounding box are sent, with their index
+        faces = await asyncio.to_thread(functions.viewFaces, project_name, project_cache, body.get('bbox'), level) if body.get('bbox') else None
+        fmt, data = functions.numberFormatter, functions.viewFrame(frame, faces)
+        if not binary: data = {key: functions.encode_array(fmt(value)) if key == 'values' else value.tolist() for key, value in data.items()}
         if temp[2] == 'load': # Initiate skeleton polygon for the first load
-            await redis.delete(dynamic_cache_key)
-            grid = project_cache.get("grid")
+            grid = await asyncio.to_thread(functions.getGrid, project_name, project_cache)
             if grid is None: return JSONResponse({"status": "error", "message": "Grid data not found in cache."})
-            # Construct GeoJSON features
-            features = [{"type": "Feature", "properties": {"index": idx}, "geometry": mapping(row['geometry'])}
-                        for idx, row in grid.iterrows()]
-            arr_np, fmt = np.array(arr), functions.numberFormatter
-            new_arr = arr_np[-1, :] if arr_np.ndim == 2 else arr_np
-            data = { 'meshes':  {'type': 'FeatureCollection', 'features': features},
-                'values': functions.encode_array(fmt(new_arr)), 'min_max': [fmt(np.nanmin(values)).tolist(), fmt(np.nanmax(values)).tolist()],
-                'timestamps': [pd.to_datetime(t).strftime('%Y-%m-%d %H:%M:%S') for t in data_ds[time_column].data]
-            }
-        else: # Update value of polygons
-            arr_np, fmt = np.array(arr), functions.numberFormatter
-            new_arr = arr_np[int(temp[2]), :] if arr_np.ndim == 2 else arr_np
-            data = {'values': functions.encode_array(fmt(new_arr))}
+            # Meshes are served separately by /mesh_skeleton
+            vmin, vmax = await asyncio.to_thread(functions.variableRange, data_ds, name)
+            data['min_max'] = [functions.jsonSafe(fmt(vmin)), functions.jsonSafe(fmt(vmax))]
+            data['timestamps'] = [pd.to_datetime(t).strftime('%Y-%m-%d %H:%M:%S') for t in data_ds[time_column].data]
+            data['level'], data['levels'] = level, functions.levelInfo(levels)
+        if binary: return binary_frame.response(data)
         return JSONResponse({'status': 'ok', 'content': data})
     except Exception as e:
         print('/load_general_dynamic:\n==============')
@@ -155,44 +188,231 @@ async def load_general_dynamic(request: Request, user=Depends(functions.basic_au
 async def load_vector_dynamic(request: Request, user=Depends(functions.basic_auth)):
     try:
         body = await request.json()
-        query, key = body.get('query'), body.get('key')
+        query, key, binary = body.get('query'), body.get('key'), body.get('format') == 'binary'
         project_name, _ = functions.project_definer(body.get('projectName'), user)
-        redis, vector_cache_key = request.app.state.redis, f"{project_name}:vector_cache"
+        redis = request.app.state.redis
         project_cache = request.app.state.project_cache.setdefault(project_name)
         if not project_cache: return JSONResponse({"status": "error", "message": "Project is not available in memory"})  
         layer_reverse_raw = await redis.hget(project_name, "layer_reverse_hyd")
         layer_reverse = msgpack.unpackb(layer_reverse_raw, raw=False)
         value_type, row_idx = layer_reverse[key], len(layer_reverse) - int(key) - 2
         data_ds, fnm = project_cache.get("hyd_map"), functions.numberFormatter
-        raw_cache = await redis.get(vector_cache_key)
-        if raw_cache: vector_cache = msgpack.unpackb(raw_cache, raw=False)
-        else: vector_cache = {"layers": {}}
-        if not value_type in vector_cache['layers']:
-            layer_dict = functions.vectorComputer(data_ds, value_type, row_idx)
-            lock = redis.lock(f"{project_name}:vector:{value_type}", timeout=10)
-            async with lock:
-                vector_cache['layers'][value_type] = layer_dict
-                await redis.set(vector_cache_key, msgpack.packb(vector_cache, use_bin_type=True), ex=600)
-        else: layer_dict = vector_cache['layers'][value_type]
+        # Arrows (only the faces in the map view, thinned to their spacing) or streamlines of the whole mesh
+        bbox, spacing, streamlines = body.get('bbox'), body.get('spacing'), body.get('mode') == 'streamlines'
+        faces = await asyncio.to_thread(functions.vectorFaces, project_name, project_cache, bbox, spacing) \
+            if (bbox or spacing) and not streamlines else None
+        def reader(step: int) -> dict:
+            if streamlines: return functions.vectorStreamlines(project_name, project_cache, value_type, row_idx, step, binary)
+            return functions.vectorComputer(data_ds, value_type, row_idx, step, as_arrays=binary, faces=faces)
         if query == 'load': # Initiate skeleton polygon for the first load
-            await redis.delete(vector_cache_key)
+            data = await asyncio.to_thread(reader, -1)
+            # Coordinates of the faces, sent once: frames only carry the index of the faces
+            if not streamlines:
+                face_x, face_y = await asyncio.to_thread(functions.vectorCoordinates, project_name, project_cache)
+                data['face_x'], data['face_y'] = (face_x, face_y) if binary else (face_x.tolist(), face_y.tolist())
             # Get global vmin and vmax
-            data = layer_dict
-            if value_type == 'Average':
-                vmin = fnm(np.nanmin(data_ds['mesh2d_ucmaga'])).tolist()
-                vmax = fnm(np.nanmax(data_ds['mesh2d_ucmaga'])).tolist()
-            else:
-                vmin = fnm(np.nanmin(data_ds['mesh2d_ucmag'])).tolist()
-                vmax = fnm(np.nanmax(data_ds['mesh2d_ucmag'])).tolist()
+            magnitude = 'mesh2d_ucmaga' if value_type == 'Average' else 'mesh2d_ucmag'
+            vmin, vmax = await asyncio.to_thread(functions.variableRange, data_ds, magnitude)
+            vmin, vmax = functions.jsonSafe(fnm(vmin)), functions.jsonSafe(fnm(vmax))
             data['timestamps'] = [pd.to_datetime(t).strftime('%Y-%m-%d %H:%M:%S') for t in data_ds['time'].data]
             data['min_max'] = [vmin, vmax]
-        else: data = functions.vectorComputer(data_ds, value_type, row_idx, int(query))
+        else:
+            # Playback: the next frames are read ahead
+            selection = 'streamlines' if streamlines else None if faces is None else (tuple(bbox or ()), spacing)
+            session = (user, project_name, 'vector', value_type, row_idx, binary, selection, id(data_ds))
+            data = await asyncio.to_thread(request.app.state.frame_prefetcher.get, session, int(query),
+                reader, data_ds.sizes['time'])
+        if binary: return binary_frame.response(data)
         return JSONResponse({'content': data, 'status': 'ok'})
     except Exception as e:
         print('/load_vector_dynamic:\n==============')
         traceback.print_exc()
         return JSONResponse({'status': 'error', 'message': f"Error: {e}"})
 
+# Load a range of dynamic frames in one binary response
+@router.post("/load_dynamic_frames")
+async def load_dynamic_frames(request: Request, user=Depends(functions.basic_auth)):
+    try:
+        body = await request.json()
+        redis, query, key = request.app.state.redis, body.get('query'), body.get('key')
+        project_name, _ = functions.project_definer(body.get('projectName'), user)
+        project_cache, is_vector = request.app.state.project_cache.setdefault(project_name), body.get('vector', False)
+        if not project_cache: return JSONResponse({"status": "error", "message": "Project is not available in memory"})
+        if is_vector: # Vector layers: key is the layer, query is not used
+            layer_reverse = msgpack.unpackb(await redis.hget(project_name, "layer_reverse_hyd"), raw=False)
+            value_type, row_idx = layer_reverse[key], len(layer_reverse) - int(key) - 2
+            data_ds, time_column = project_cache.get("hyd_map"), 'time'
+        else:
+            is_hyd, data_ds, time_column, name, value_type, row_idx = await dynamic_selection(
+                redis, project_cache, project_name, key, query.split('|'))
+        if data_ds is None: return JSONResponse({"status": "error", "message": "Project not initialized."})
+        # Level of detail of the dynamic map (vectors are not aggregated)
+        level = 0 if is_vector else body.get('level', 0)
+        levels = await asyncio.to_thread(functions.meshLevels, project_name, project_cache) if level else None
+        level = functions.meshLevel(levels, level)
+        # Time steps: start (included), stop (excluded) and stride
+        n_steps = data_ds.sizes[time_column]
+        steps = slice(int(body.get('start', 0)), int(body.get('stop', n_steps)), max(1, int(body.get('stride', 1))))
+        indices = list(range(*steps.indices(n_steps)))
+        if len(indices) == 0: return JSONResponse({"status": "error", "message": "No time step in the range."})
+        # Face count from the variable itself (WAQ outputs may have no face coordinates)
+        var = data_ds['mesh2d_ucx'] if is_vector else data_ds[name]
+        n_faces = int(levels['clusters'][level]) if level else \
+            next((size for dim, size in var.sizes.items() if dim in zarr_converter.FACE_DIMS), var.shape[-1])
+        nbytes = len(indices) * n_faces * 4 * (3 if is_vector else 1)
+        if nbytes > FRAME_BATCH_MAX_BYTES:
+            return JSONResponse({"status": "error", "message": f"Too many frames requested ({len(indices)}), use a larger stride or a shorter range."})
+        if is_vector: data = await asyncio.to_thread(functions.vectorFrames, data_ds, value_type, row_idx, steps)
+        else:
+            values = await asyncio.to_thread(functions.frameReader, project_name, project_cache,
+                data_ds, is_hyd, name, value_type, row_idx, steps)
+            # Static variables have one frame, repeated for every requested step
+            if values.ndim == 1: values = np.repeat(values[None, :], len(indices), axis=0)
+            data = {'values': await asyncio.to_thread(functions.levelFrame, levels, level, values)}
+        # Map view: only the faces inside the bounding box (and the thinned arrows of vectors), with their index
+        bbox, spacing = body.get('bbox'), body.get('spacing') if is_vector else None
+        if is_vector: faces = await asyncio.to_thread(functions.vectorFaces, project_name, project_cache, bbox, spacing) if bbox or spacing else None
+        else: faces = await asyncio.to_thread(functions.viewFaces, project_name, project_cache, bbox, level) if bbox else None
+        if faces is not None: data = {**{key: value[..., faces] for key, value in data.items()}, 'index': faces}
+        data['steps'], data['level'] = indices, level
+        data['timestamps'] = [pd.to_datetime(t).strftime('%Y-%m-%d %H:%M:%S') for t in data_ds[time_column].data[steps]]
+        return binary_frame.response(data)
+    except Exception as e:
+        print('/load_dynamic_frames:\n==============')
+        traceback.print_exc()
+        return JSONResponse({'status': 'error', 'message': f"Error: {e}"})
+
+async def stream_source(app, user: str, message: dict) -> dict:
+    # Reader of the frames of a subscription, same slicing as /load_general_dynamic, /load_vector_dynamic and /select_thermocline
+    kind, key, query, bbox = message.get('kind', 'general'), message.get('key'), message.get('query') or '', message.get('bbox')
+    project_name, _ = functions.project_definer(message.get('projectName'), user)
+    project_cache, redis = app.state.project_cache.get(project_name), app.state.redis
+    if not project_cache: raise ValueError("Project is not available in memory")
+    if kind == 'vector':
+        layer_reverse = msgpack.unpackb(await redis.hget(project_name, "layer_reverse_hyd"), raw=False)
+        value_type, row_idx = layer_reverse[key], len(layer_reverse) - int(key) - 2
+        data_ds, time_column = project_cache.get("hyd_map"), 'time'
+        spacing, streamlines = message.get('spacing'), message.get('mode') == 'streamlines'
+        faces = await asyncio.to_thread(functions.vectorFaces, project_name, project_cache, bbox, spacing) \
+            if (bbox or spacing) and not streamlines else None
+        def read(step: int) -> dict:
+            if streamlines: return functions.vectorStreamlines(project_name, project_cache, value_type, row_idx, step, True)
+            return functions.vectorComputer(data_ds, value_type, row_idx, step, as_arrays=True, faces=faces)
+        selection = 'streamlines' if streamlines else None if faces is None else (tuple(bbox or ()), spacing)
+        session = (user, project_name, 'vector', value_type, row_idx, True, selection, id(data_ds))
+        view = None
+    elif kind == 'thermocline':
+        is_hyd = key == 'thermocline_hyd'
+        data_ds, time_column = project_cache.get("hyd_map" if is_hyd else "waq_map"), 'time' if is_hyd else 'nTimesDlwq'
+        selection = {"key": key, "name": functions.variablesNames.get(query, query), "idx": int(message.get('idx'))}
+        profile = await asyncio.to_thread(functions.thermoclineArrays, project_name, project_cache, selection)
+        def read(step: int) -> dict: return {'values': profile[step, :].astype(np.float32)}
+        session, view = None, None # Already in memory
+    else:
+        is_hyd, data_ds, time_column, name, value_type, row_idx = await dynamic_selection(
+            redis, project_cache, project_name, key, query.split('|'))
+        level = message.get('level', 0)
+        levels = await asyncio.to_thread(functions.meshLevels, project_name, project_cache) if level else None
+        level = functions.meshLevel(levels, level)
+        def read(step: int) -> dict:
+            frame = functions.frameReader(project_name, project_cache, data_ds, is_hyd, name, value_type, row_idx, step)
+            return {'values': functions.levelFrame(levels, level, frame)}
+        session = (user, project_name, 'stream', name, value_type, row_idx, level, id(data_ds))
+        # The full frames are read ahead, the map view is applied when they are sent
+        faces = await asyncio.to_thread(functions.viewFaces, project_name, project_cache, bbox, level) if bbox else None
+        def view(content: dict) -> dict: return functions.viewFrame(content['values'], faces)
+    if data_ds is None: raise ValueError("Project not initialized.")
+    n_steps, prefetcher = data_ds.sizes[time_column], app.state.frame_prefetcher
+    def reader(step: int) -> dict:
+        content = prefetcher.get(session, step, read, n_steps) if session else read(step)
+        return view(content) if view else content
+    timestamps = [pd.to_datetime(t).strftime('%Y-%m-%d %H:%M:%S') for t in data_ds[time_column].data]
+    return {'kind': kind, 'reader': reader, 'n_steps': n_steps, 'timestamps': timestamps}
+
+# Token authenticating the next frame stream of the user
+@router.post("/stream_token")
+async def stream_token(request: Request, user=Depends(functions.basic_auth)):
+    try:
+        token = await functions.streamToken(request.app.state.redis, user)
+        return JSONResponse({'status': 'ok', 'content': token})
+    except Exception as e:
+        print('/stream_token:\n==============')
+        traceback.print_exc()
+        return JSONResponse({'status': 'error', 'message': f"Error: {e}"})
+
+# Stream the frames of a dynamic map, vector or thermocline view
+@router.websocket("/stream_frames")
+async def stream_frames(websocket: WebSocket, token: str=None):
+    """
+    Client messages (JSON):
+        {"action": "subscribe", "projectName", "kind": "general"|"vector"|"thermocline", "key", "query", "idx", "start", "rate", "play", "level", "bbox", "spacing", "mode"}
+        {"action": "play"} | {"action": "pause"} | {"action": "seek", "step"} | {"action": "rate", "rate"} | {"action": "ack"}
+        {"action": "view", "bbox", "spacing"}: new map view (west, south, east, north), only the faces inside are sent
+        (vectors: one arrow per spacing at most, streamlines with "mode": "streamlines" cover the whole mesh)
+    Server messages: binary frames (see binary_frame) with step, timestamp and kind in the header,
+    JSON for the subscription ({"status": "ok", "n_steps", "timestamps"}) and errors.
+    At most STREAM_WINDOW frames are sent before the client acknowledges them (backpressure).
+    The handshake is authenticated with a token from /stream_token (?token=...) or Basic credentials.
+    """
+    user = await functions.websocket_auth(websocket.app.state.redis, token, websocket.headers.get('authorization'))
+    if user is None: return await websocket.close(code=1008)
+    await websocket.accept()
+    state = {'stream': None, 'step': 0, 'playing': False, 'once': False, 'rate': 1.0, 'credits': STREAM_WINDOW}
+    wake, loop = asyncio.Event(), asyncio.get_running_loop()
+    async def sender():
+        while True:
+            await wake.wait()
+            wake.clear()
+            while state['stream'] and (state['playing'] or state['once']) and state['credits'] > 0:
+                stream, step, started = state['stream'], state['step'], loop.time()
+                try: content = await asyncio.to_thread(stream['reader'], step)
+                except Exception as e:
+                    print('/stream_frames:\n==============')
+                    traceback.print_exc()
+                    state.update(playing=False, once=False)
+                    await websocket.send_json({'status': 'error', 'message': f"Error: {e}"})
+                    break
+                if stream is not state['stream'] or step != state['step']: continue # Subscription changed or seek
+                frame = binary_frame.encode({**content, 'step': step, 'timestamp': stream['timestamps'][step], 'kind': stream['kind']})
+                await websocket.send_bytes(frame)
+                state['credits'], state['once'] = state['credits'] - 1, False
+                if state['playing']:
+                    state['step'] = (step + 1) % stream['n_steps']
+                    await asyncio.sleep(max(0, 1/state['rate'] - (loop.time() - started)))
+    async def safe_sender():
+        try: await sender()
+        except (WebSocketDisconnect, RuntimeError): pass # Closed by the client while sending
+    task = asyncio.create_task(safe_sender())
+    try:
+        while True:
+            message = await websocket.receive_json()
+            action = message.get('action')
+            try:
+                if action == 'subscribe':
+                    stream = await stream_source(websocket.app, user, message)
+                    state.update(stream=stream, step=int(message.get('start', 0)) % stream['n_steps'],
+                        playing=bool(message.get('play', True)), once=True, credits=STREAM_WINDOW, subscription=message)
+                    await websocket.send_json({'status': 'ok', 'n_steps': stream['n_steps'], 'timestamps': stream['timestamps']})
+                elif action == 'view' and state['stream']:
+                    # Same subscription and position, the current frame is sent again for the new view
+                    subscription = {**state['subscription'], 'bbox': message.get('bbox'), 'spacing': message.get('spacing')}
+                    state.update(stream=await stream_source(websocket.app, user, subscription), subscription=subscription, once=True)
+                elif action == 'play': state['playing'] = True
+                elif action == 'pause': state['playing'] = False
+                elif action == 'seek' and state['stream']:
+                    state.update(step=int(message.get('step', 0)) % state['stream']['n_steps'], once=True)
+                elif action == 'rate': state['rate'] = min(STREAM_MAX_RATE, max(0.1, float(message.get('rate', 1))))
+                elif action == 'ack': state['credits'] = min(STREAM_WINDOW, state['credits'] + 1)
+                if 'rate' in message and action != 'rate': state['rate'] = min(STREAM_MAX_RATE, max(0.1, float(message['rate'])))
+                wake.set()
+            except Exception as e:
+                print('/stream_frames:\n==============')
+                traceback.print_exc()
+                await websocket.send_json({'status': 'error', 'message': f"Error: {e}"})
+    except WebSocketDisconnect: pass
+    finally:
+        task.cancel()
+
 # Select meshes based on ids
 @router.post("/select_meshes")
 async def select_meshes(request: Request, user=Depends(functions.basic_auth)):    
@@ -200,65 +420,131 @@ async def select_meshes(request: Request, user=Depends(functions.basic_auth)):
         body = await request.json()
         key, query, idx = body.get('key'), body.get('query'), body.get('idx')
         project_name, _ = functions.project_definer(body.get('projectName'), user)
-        redis, points = request.app.state.redis, body.get('points')
+        redis, points, binary = request.app.state.redis, body.get('points'), body.get('format') == 'binary'
         project_cache = request.app.state.project_cache.setdefault(project_name)
         if not project_cache: return JSONResponse({"status": "error", "message": "Project is not available in memory"})
         hyd_map, waq_map = project_cache.get("hyd_map"), project_cache.get("waq_map")
-        lock = redis.lock(f"{project_name}:select_meshes", timeout=20)
         is_hyd = key == 'hyd'
         dataset_type = "hyd" if is_hyd else "waq"
-        mesh_cache_key = f"{project_name}:mesh_cache:{dataset_type}"
-        async with lock:
-            if '_waq_multi_dynamic' in query: query = 'mesh2d_' + query[:-len('_waq_multi_dynamic')]
-            data_ds = hyd_map if is_hyd else waq_map
-            name = functions.variablesNames.get(query, query)
-            values, fnm = data_ds[name].values, functions.numberFormatter
-            # Initiate data for the first load
-            if idx == 'load':
-                # Initialize mesh cache in Redis if not exists
-                await redis.delete(mesh_cache_key)
+        if '_waq_multi_dynamic' in query: query = 'mesh2d_' + query[:-len('_waq_multi_dynamic')]
+        data_ds = hyd_map if is_hyd else waq_map
+        name, fnm = functions.variablesNames.get(query, query), functions.numberFormatter
+        # Initiate data for the first load
+        if idx == 'load':
+            lock = redis.lock(f"{project_name}:select_meshes", timeout=20)
+            async with lock:
                 layer_reverse_raw = await redis.hget(project_name, f"layer_reverse_{dataset_type}")
                 layer_reverse = msgpack.unpackb(layer_reverse_raw, raw=False)
                 depth_values = [float(v.split(' ')[1]) for k, v in layer_reverse.items() if int(k) >= 0]
-                max_layer = float(max(np.array(depth_values), key=abs))
-                n_rows = math.ceil(abs(max_layer)/10)*10+1 if max_layer < 0 else -(math.ceil(abs(max_layer)/10)*10+1)
-                mesh_cache = { "depth_values": depth_values, "n_rows": n_rows, "df": None}
-                await redis.set(mesh_cache_key, msgpack.packb(mesh_cache, use_bin_type=True), ex=600)
+                # Only the selection is kept in Redis, the arrays of the transect are in the shared cache
+                selection = {"points": points, "depth_values": depth_values}
+                await redis.hset(project_name, f"transect_{dataset_type}:{user}", msgpack.packb(selection, use_bin_type=True))
                 time_column = 'time' if is_hyd else 'nTimesDlwq'
                 time_stamps = pd.to_datetime(data_ds[time_column]).strftime('%Y-%m-%d %H:%M:%S').tolist()
-                arr = values[0,:,:] if is_hyd else values[0,:,:].T
-                # Create GeoDataFrame for interpolation
-                grid, points_arr = project_cache.get("grid"), np.array(points)
-                x_coords, y_coords = points_arr[:, 2], points_arr[:, 1]
-                gdf = gpd.GeoDataFrame(geometry=gpd.points_from_xy(x_coords, y_coords), crs=grid.crs)
-                gdf['depth'] = functions.interpolation_Z(gdf, hyd_map['mesh2d_node_x'].values, 
-                    hyd_map['mesh2d_node_y'].values, hyd_map['mesh2d_node_z'].values)
-                # Find polygons that the points are in
-                gdf_filtered = gpd.sjoin(gdf, grid, how="left", predicate="intersects")
-                gdf_filtered.set_index('index_right', inplace=True)
-                df_serialized = gdf_filtered.drop(columns=['geometry'])
-                mesh_cache["df"] = df_serialized.to_dict(orient='split')
+                transect = await asyncio.to_thread(functions.transectArrays, project_name, project_cache, selection)
+                plan = await asyncio.to_thread(functions.getTransectPlan, project_cache, is_hyd, transect)
+                values = data_ds[name][0].values
+                arr = values if is_hyd else values.T
                 # Compute frame in thread to avoid blocking
-                frame = await asyncio.to_thread(functions.meshProcess, is_hyd, arr, mesh_cache)
-                vmin, vmax = fnm(np.nanmin(frame)).tolist(), fnm(np.nanmax(frame)).tolist()
-                depths_idx = np.arange(0, frame.shape[0]) if mesh_cache["n_rows"] > 0 else np.arange(0, -frame.shape[0], -1)
-                data = {"timestamps": time_stamps, "distance": np.round(points_arr[:, 0], 0).tolist(),
-                        "values": fnm(frame).tolist(), "depths": depths_idx.tolist(), "local_minmax": [vmin, vmax]}
-                await redis.set(mesh_cache_key, msgpack.packb(mesh_cache, use_bin_type=True), ex=600)
-            else: # Load next frame
-                raw_cache = await redis.get(mesh_cache_key)
-                if raw_cache is None: return JSONResponse({"status": 'error', "message": "Mesh cache is not initialized."})
-                mesh_cache = msgpack.unpackb(raw_cache, raw=False)
-                arr = values[int(idx),:,:] if is_hyd else values[int(idx),:,:].T
-                frame = await asyncio.to_thread(functions.meshProcess, is_hyd, arr, mesh_cache)
-                vmin, vmax = fnm(np.nanmin(frame)).tolist(), fnm(np.nanmax(frame)).tolist()
-                data = {"values": fnm(frame).tolist(), "local_minmax": [vmin, vmax]}
+                frame = await asyncio.to_thread(functions.meshProcess, is_hyd, arr, transect, plan)
+                # All the time steps are rendered in the background (see /transect_progress)
+                await transect_job(request.app, project_name, project_cache, selection, is_hyd, name, user)
+            vmin, vmax = functions.jsonSafe(fnm(np.nanmin(frame))), functions.jsonSafe(fnm(np.nanmax(frame)))
+            depths_idx = np.arange(0, frame.shape[0]) if int(transect["n_rows"][0]) > 0 else np.arange(0, -frame.shape[0], -1)
+            data = {"timestamps": time_stamps, "distance": np.round(np.array(points)[:, 0], 0).tolist(),
+                    "values": frame.astype(np.float32) if binary else functions.jsonSafe(fnm(frame)), "depths": depths_idx.tolist(), "local_minmax": [vmin, vmax]}
+        else: # Load next frame, from the rendered time steps once they are ready (no lock needed)
+            raw_selection = await redis.hget(project_name, f"transect_{dataset_type}:{user}")
+            if raw_selection is None: return JSONResponse({"status": 'error', "message": "Mesh cache is not initialized."})
+            selection = msgpack.unpackb(raw_selection, raw=False)
+            series = await asyncio.to_thread(functions.transectSeries, project_name, project_cache, selection, is_hyd, name, build=False)
+            if series is not None and 'frames' in series and int(idx) < len(series['frames']):
+                frame, vmin, vmax = series['frames'][int(idx)], series['vmin'][int(idx)], series['vmax'][int(idx)]
+            else:
+                transect = await asyncio.to_thread(functions.transectArrays, project_name, project_cache, selection)
+                plan = await asyncio.to_thread(functions.getTransectPlan, project_cache, is_hyd, transect)
+                values = data_ds[name][int(idx)].values
+                arr = values if is_hyd else values.T
+                frame = await asyncio.to_thread(functions.meshProcess, is_hyd, arr, transect, plan)
+                vmin, vmax = np.nanmin(frame), np.nanmax(frame)
+            vmin, vmax = functions.jsonSafe(fnm(vmin)), functions.jsonSafe(fnm(vmax))
+            data = {"values": frame.astype(np.float32) if binary else functions.jsonSafe(fnm(frame.astype(np.float64))), "local_minmax": [vmin, vmax]}
+        if binary: return binary_frame.response(data)
         return JSONResponse({'content': data, 'status': 'ok'})
     except Exception as e:
         print('/select_meshes:\n==============')
         traceback.print_exc()
         return JSONResponse({'status': 'error', 'message': f"Error: {e}"})
 
+# Background jobs of the workers (a reference is kept until they are done)
+background_jobs = set()
+
+def transect_job_field(is_hyd: bool, user: str) -> str:
+    # Redis field of the transect job of a user (one job per user and dataset type)
+    return f"transect_job_{'hyd' if is_hyd else 'waq'}:{user}"
+
+async def transect_job(app, project_name: str, project_cache: dict, selection: dict, is_hyd: bool, name: str, user: str):
+    # Start rendering all the time steps of a transect, the job and its progress are kept in Redis:
+    # a job stops as soon as another transect of the user replaces it (in any worker).
+    # The worker refreshes an expiring key while the job runs, so the job of a worker that died is seen as failed.
+    redis, loop = app.state.redis, asyncio.get_running_loop()
+    field = transect_job_field(is_hyd, user)
+    alive = f"{project_name}:{field}:alive"
+    tag = hashlib.sha1(functions.transectTag(selection, name).encode('utf-8')).hexdigest()
+    data_ds = project_cache.get("hyd_map" if is_hyd else "waq_map")
+    total = int(data_ds['time' if is_hyd else 'nTimesDlwq'].size)
+    async def report(status: str, done: int):
+        await redis.hset(project_name, field, msgpack.packb({'tag': tag, 'status': status, 'done': done, 'total': total}))
+    def progress(done: int, _):
+        asyncio.run_coroutine_threadsafe(report('running', done), loop).result()
+    async def replaced() -> bool:
+        raw = await redis.hget(project_name, field)
+        return raw is None or msgpack.unpackb(raw, raw=False).get('tag') != tag
+    def cancelled() -> bool:
+        return asyncio.run_coroutine_threadsafe(replaced(), loop).result()
+    async def heartbeat():
+        while True:
+            await redis.set(alive, tag, ex=TRANSECT_JOB_TTL)
+            await asyncio.sleep(TRANSECT_JOB_TTL/3)
+    async def run():
+        beat = asyncio.create_task(heartbeat())
+        try:
+            series = await asyncio.to_thread(functions.transectSeries, project_name, project_cache, selection,
+                is_hyd, name, progress, cancelled)
+            if series is not None: await report('done', total)
+            elif not await replaced(): await report('failed', 0) # Not cancelled, the entry could not be written
+        except Exception:
+            print('transect_job:\n==============')
+            traceback.print_exc()
+            if not await replaced(): await report('failed', 0)
+        finally: beat.cancel()
+    await redis.set(alive, tag, ex=TRANSECT_JOB_TTL)
+    await report('running', 0)
+    task = asyncio.create_task(run())
+    background_jobs.add(task)
+    task.add_done_callback(background_jobs.discard)
+
+# Progress of the background rendering of a transect (server-sent events), until it is done
+@router.get("/transect_progress")
+async def transect_progress(request: Request, projectName: str, key: str='hyd', user=Depends(functions.basic_auth)):
+    try:
+        project_name, _ = functions.project_definer(projectName, user)
+        redis, field = request.app.state.redis, transect_job_field(key == 'hyd', user)
+        async def events():
+            while not await request.is_disconnected():
+                raw = await redis.hget(project_name, field)
+                job = msgpack.unpackb(raw, raw=False) if raw else {'status': 'none', 'done': 0, 'total': 0}
+                # A running job whose worker stopped refreshing it has failed
+                if job.get('status') == 'running' and not await redis.exists(f"{project_name}:{field}:alive"): job['status'] = 'failed'
+                yield f"data: {json.dumps({k: job.get(k) for k in ('status', 'done', 'total')})}\n\n"
+                if job.get('status') != 'running': break
+                await asyncio.sleep(0.5)
+        return StreamingResponse(events(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+    except Exception as e:
+        print('/transect_progress:\n==============')
+        traceback.print_exc()
+        return JSONResponse({'status': 'error', 'message': f"Error: {e}"})
+
 # Working with thermocline plots
 @router.post("/select_thermocline")
 async def select_thermocline(request: Request, user=Depends(functions.basic_auth)):
@@ -266,24 +552,23 @@ async def select_thermocline(request: Request, user=Depends(functions.basic_auth
         body = await request.json()
         key, query, typ, idx = body.get('key'), body.get('query'), body.get('type'), body.get('idx')
         project_name, _ = functions.project_definer(body.get('projectName'), user)
-        redis, thermo_cache_key = request.app.state.redis, f"{project_name}:thermocline_cache"
+        binary = body.get('format') == 'binary' and typ != 'thermocline_grid' # The grid stays GeoJSON
+        redis = request.app.state.redis
         project_cache = request.app.state.project_cache.setdefault(project_name)
         hyd_map, waq_map = project_cache.get("hyd_map"), project_cache.get("waq_map")
         lock = redis.lock(f"{project_name}:thermocline", timeout=30, blocking_timeout=25)
         async with lock:
             is_hyd = key == 'thermocline_hyd'
             data_ds = hyd_map if is_hyd else waq_map
-            col_idx = 2 if is_hyd else 1
             name = functions.variablesNames.get(query, query)
             # Initiate data for the first load
             if typ == 'thermocline_grid':
-                temp_grid, arr = project_cache.get("grid"), data_ds[name].values
+                temp_grid = await asyncio.to_thread(functions.getGrid, project_name, project_cache)
                 # Remove polygons having all NaN in all layers
-                mask_all_nan = np.isnan(arr).all(axis=(0, col_idx))               
-                removed_indices = np.where(mask_all_nan)[0]
-                grid = temp_grid.drop(index=removed_indices).reset_index()
+                faces = await asyncio.to_thread(functions.thermoclineFaces, project_name, project_cache, is_hyd, name)
+                grid = temp_grid.take(faces).reset_index()
                 data = json.loads(grid.to_json())
-                await redis.delete(thermo_cache_key)
+                await redis.hdel(project_name, "thermocline_selection")
             elif typ == 'thermocline_init':
                 time_column = 'time' if is_hyd else 'nTimesDlwq'
                 time_stamps = pd.to_datetime(data_ds[time_column]).strftime('%Y-%m-%d %H:%M:%S').tolist()
@@ -294,22 +579,23 @@ async def select_thermocline(request: Request, user=Depends(functions.basic_auth
                 layers_values = [float(v.split(' ')[1]) for k, v in layer_reverse.items() if int(k) >= 0]
                 max_values = int(abs(np.min(layers_values)))
                 new_depth = [x + max_values for x in layers_values]
-                arr, idx = data_ds[name].values, int(idx)
-                # Remove polygons having Nan in all layers
-                mask_all_nan = np.isnan(arr).all(axis=(0, col_idx))
-                arr_filtered = arr[:, ~mask_all_nan, :] if is_hyd else arr[:, :, ~mask_all_nan]
-                data_selected = arr_filtered[:, idx, :] if is_hyd else arr_filtered[:, :, idx]
-                # Save filtered 3D → cache
-                await redis.set(thermo_cache_key, json.dumps(data_selected.tolist()))
-                values = [None if np.isnan(x) else functions.numberFormatter(x).tolist() for x in data_selected[0,:]]
+                # Only the selection is kept in Redis, the profile is in the shared cache
+                selection = {"key": key, "name": name, "idx": int(idx)}
+                data_selected = await asyncio.to_thread(functions.thermoclineArrays, project_name, project_cache, selection)
+                await redis.hset(project_name, "thermocline_selection", msgpack.packb(selection, use_bin_type=True))
+                if binary: values = data_selected[0,:].astype(np.float32)
+                else: values = functions.jsonSafe(functions.numberFormatter(data_selected[0,:]))
                 # Get the first frame for the first timestamp
                 data = { "timestamps": time_stamps, "depths": new_depth, "values": values }
             elif typ == 'thermocline_update':
-                raw_cache = await redis.get(thermo_cache_key)
-                if not raw_cache:
+                raw_selection = await redis.hget(project_name, "thermocline_selection")
+                if not raw_selection:
                     return JSONResponse({"status": "error", "message": "Thermocline cache not initialized."})
-                data_selected = np.array(json.loads(raw_cache))
-                data = [None if np.isnan(x) else functions.numberFormatter(x).tolist() for x in data_selected[int(idx),:]]
+                selection = msgpack.unpackb(raw_selection, raw=False)
+                data_selected = await asyncio.to_thread(functions.thermoclineArrays, project_name, project_cache, selection)
+                if binary: data = {"values": data_selected[int(idx),:].astype(np.float32)}
+                else: data = functions.jsonSafe(functions.numberFormatter(data_selected[int(idx),:]))
+            if binary: return binary_frame.response(data)
             return JSONResponse({"status": 'ok', "content": data})
     except Exception as e:
         print('/select_thermocline:\n==============')
@@ -13,6 +13,13 @@ async def auth_check(user=Depends(functions.basic_auth)):
     output = 'ok' if user == 'admin' else 'error'
     return {"user": user, "output": output}
 
+# Dataset cache statistics of this worker
+@router.post("/cache_stats")
+async def cache_stats(request: Request, user=Depends(functions.basic_auth)):
+    if user != 'admin': return JSONResponse({"status": "error", "message": "Not authorized"})
+    content = {**request.app.state.dataset_manager.stats(), "prefetch": request.app.state.frame_prefetcher.stats()}
+    return JSONResponse({"status": "ok", "content": content})
+
 # Remove folder configuration
 @router.post("/reset_config")
 async def reset_config(request: Request, user=Depends(functions.basic_auth)):
@@ -27,6 +34,7 @@ async def reset_config(request: Request, user=Depends(functions.basic_auth)):
             if not os.path.exists(folder): return JSONResponse({"message": "Project folder doesn't exist."})
             config_dir = os.path.normpath(os.path.join(folder, "output", "config"))
             if not os.path.exists(config_dir): return JSONResponse({"message": "Configuration folder doesn't exist."})
+            functions.sharedCache(project_name).clear()
             shutil.rmtree(config_dir, onerror=functions.remove_readonly)
             # Delete config in Redis
             await redis.hdel(project_name, "config", "layer_reverse_hyd", "layer_reverse_waq")
@@ -274,9 +282,11 @@ async def setup_database(request: Request, user=Depends(functions.basic_auth)):
             layer_reverse_hyd, layer_reverse_waq, layer_reverse_waq_depth = {}, {}, {}
             if hyd_map is not None:
                 print('Creating grid and layers for hydrodynamic simulation...')
-                # Grid/layers generation
-                grid = functions.unstructuredGridCreator(hyd_map)
-                project_cache['grid'] = grid
+                # Grid is persisted once per _map file and loaded lazily, mesh arrays are shared between workers
+                source = project_cache.get('hyd_map_path')
+                mesh = functions.meshArrays(hyd_map, source, functions.sharedCache(project_name))
+                await asyncio.to_thread(functions.gridWriter, hyd_map, source, config_dir, mesh)
+                project_cache.pop('grid', None)
                 # Get number of layers
                 layer_path = os.path.normpath(os.path.join(config_dir, 'layers_hyd.json'))
                 if not os.path.exists(layer_path):
@@ -516,6 +526,7 @@ async def delete_project(request: Request, user=Depends(functions.basic_auth)):
             extend_task = asyncio.create_task(functions.auto_extend(lock))
             if not os.path.exists(project_folder): 
                 return JSONResponse({"status": 'error', "message": f"Project '{project_name}' does not exist."})
+            functions.sharedCache(project_name).clear()
             shutil.rmtree(project_folder, onerror=functions.remove_readonly)
             if hasattr(request.app.state, "project_cache"): request.app.state.project_cache.pop(project_name, None)
             return JSONResponse({"status": "ok", "message": f"Project '{name}' was deleted successfully."})
@@ -44,7 +44,8 @@ async def check_sim_status_hyd(request: Request, user=Depends(functions.basic_au
         return JSONResponse({"status": "failed", "progress": info["progress"],
             "message": info.get("message", 'Simulation failed')})
     if info["status"] == "reorganizing":
-        return JSONResponse({"status": "reorganizing", "progress": 100, "message": 'Reorganizing outputs. Please wait...'})
+        return JSONResponse({"status": "reorganizing", "progress": info.get("progress", 100),
+            "message": info.get("message", 'Reorganizing outputs. Please wait...')})
     complete = f'HYD simulation completed: {info["progress"]}% [Time used: {info["time_used"]} → Time left: {info["time_left"]}]'
     return JSONResponse({"status": info["status"], "progress": info["progress"], "message": complete})
     
@@ -121,8 +122,11 @@ async def start_sim_hyd(request: Request, user=Depends(functions.basic_auth)):
                 processes[project_name]["status"] = "reorganizing"
                 processes[project_name]["message"] = "Reorganizing outputs. Please wait..."
                 processes[project_name]["progress"] = 100.0
+                def report(file_name, var_name, done, total):
+                    processes[project_name]["progress"] = round(100*done/total, 1)
+                    processes[project_name]["message"] = f"Reorganizing outputs: {file_name} - {var_name} ({done}/{total})"
                 try:
-                    post_result = functions.postProcess(path)
+                    post_result = functions.postProcess(path, report)
                     if post_result["status"] != "ok":
                         processes[project_name]["status"] = "error"
                         processes[project_name]["message"] = post_result["message"]
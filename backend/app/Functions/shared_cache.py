@@ -0,0 +1,176 @@
+import os, json, shutil, hashlib, threading
+import numpy as np
+from uuid import uuid4
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+# One cache object per directory and process
+_registry: Dict[str, "SharedArrayCache"] = {}
+_registry_lock = threading.Lock()
+
+def source_version(source: str) -> str:
+    """Version tag of a source file/folder, based on its modification time."""
+    if not source or not os.path.exists(source): return '0'
+    return str(os.stat(source).st_mtime_ns)
+
+class SharedArrayCache:
+    """
+    Arrays stored as *.npy files and opened with memory mapping, so every
+    worker process maps the same pages of the OS page cache instead of
+    keeping its own copy. Entries are versioned by the mtime of their source.
+    Entries built from parameters (tagged) keep the most recently used ones of each name.
+    """
+    def __init__(self, directory: str, max_mapped: int=0, max_tagged: int=1):
+        self.directory = directory
+        # Mapped entries, ordered from least to most recently used (0 = unlimited)
+        self._mapped: "OrderedDict[str, Dict[str, np.ndarray]]" = OrderedDict()
+        self.max_mapped = int(max_mapped or 0)
+        # Tagged entries kept on disk per name and source version
+        self.max_tagged = max(1, int(max_tagged or 1))
+        self._lock = threading.Lock()
+
+    def _entry_dir(self, name: str, version: str) -> str:
+        return os.path.normpath(os.path.join(self.directory, f"{name}@{version}"))
+
+    def _version(self, source: str, tag: str) -> str:
+        # Entries built from parameters (e.g. a user selection) are also keyed on a hash of these parameters
+        version = source_version(source)
+        return f"{version}-{hashlib.sha1(tag.encode('utf-8')).hexdigest()[:16]}" if tag else version
+
+    @staticmethod
+    def _source_part(entry: str) -> str:
+        # Source version of an entry folder (name@version[-tag])
+        return os.path.basename(entry).split('@', 1)[-1].split('-', 1)[0]
+
+    def _cleanup(self, name: str, keep: str, max_tagged: int=0):
+        # Remove older versions of an entry and the least recently used tagged entries
+        # of the same version (may fail on Windows if still mapped)
+        max_tagged = max(1, int(max_tagged or self.max_tagged))
+        if not os.path.exists(self.directory): return
+        source, tagged = self._source_part(keep), []
+        for entry in os.listdir(self.directory):
+            path = os.path.normpath(os.path.join(self.directory, entry))
+            if not entry.startswith(f"{name}@") or path == keep: continue
+            if '-' in entry.split('@', 1)[1] and self._source_part(entry) == source:
+                try: tagged.append((os.stat(path).st_mtime_ns, path))
+                except OSError: pass
+            else: shutil.rmtree(path, ignore_errors=True)
+        for _, path in sorted(tagged, reverse=True)[max_tagged - 1:]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def get(self, name: str, source: str, tag: str='') -> Optional[Dict[str, np.ndarray]]:
+        # Get memory-mapped arrays, None if the entry doesn't exist or is outdated
+        entry = self._entry_dir(name, self._version(source, tag))
+        with self._lock:
+            if entry in self._mapped:
+                self._mapped.move_to_end(entry)
+                return self._mapped[entry]
+        meta_path = os.path.normpath(os.path.join(entry, 'meta.json'))
+        if not os.path.exists(meta_path): return None
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            # Mark the entry as recently used for the cleanup of tagged entries
+            os.utime(entry)
+            arrays = {key: np.load(os.path.normpath(os.path.join(entry, f"{key}.npy")), mmap_mode='r')
+                for key in meta['arrays']}
+        except Exception as e:
+            print(f"Shared cache is corrupted: {entry} - {str(e)}")
+            return None
+        with self._lock:
+            # Entries of older source versions are not mapped anymore
+            source = self._source_part(entry)
+            for key in [k for k in self._mapped if os.path.basename(k).startswith(f"{name}@")
+                and self._source_part(k) != source]: self._mapped.pop(key)
+            self._mapped[entry] = arrays
+            # Arrays still used by a caller stay valid, only the reference of the cache is dropped
+            while self.max_mapped > 0 and len(self._mapped) > self.max_mapped: self._mapped.popitem(last=False)
+        return arrays
+
+    def put(self, name: str, arrays: Dict[str, np.ndarray], source: str, tag: str='',
+            max_tagged: int=0) -> Dict[str, np.ndarray]:
+        # Write arrays atomically, then return them memory-mapped
+        pending = self.create(name, source, tag, max_tagged)
+        try:
+            for key, arr in arrays.items(): pending.save(key, arr)
+        except OSError:
+            pending.discard()
+            return arrays
+        result = pending.commit()
+        return result if result is not None else arrays
+
+    def create(self, name: str, source: str, tag: str='', max_tagged: int=0) -> "PendingEntry":
+        # Entry written array by array (e.g. large arrays filled in chunks), published by its commit
+        # max_tagged overrides the number of tagged entries kept for this name (0 = cache default)
+        return PendingEntry(self, name, source, tag, max_tagged)
+
+    def get_or_create(self, name: str, source: str, builder: Callable[[], Dict[str, np.ndarray]],
+            tag: str='', max_tagged: int=0) -> Dict[str, np.ndarray]:
+        # Get arrays from the cache or build and store them
+        arrays = self.get(name, source, tag)
+        if arrays is None: arrays = self.put(name, builder(), source, tag, max_tagged)
+        return arrays
+
+    def clear(self):
+        # Forget mapped arrays of this process
+        with self._lock: self._mapped.clear()
+
+class PendingEntry:
+    """
+    Entry of a SharedArrayCache being written in a temporary folder. Arrays are saved
+    whole or opened as writable memory maps and filled in place, so an array larger than
+    the memory of the worker can be built. Readers only see the entry after commit.
+    """
+    def __init__(self, cache: SharedArrayCache, name: str, source: str, tag: str='', max_tagged: int=0):
+        self.cache, self.name, self.source, self.tag, self.max_tagged = cache, name, source, tag, max_tagged
+        self.version = cache._version(source, tag)
+        self.entry = cache._entry_dir(name, self.version)
+        self.tmp = cache._entry_dir(f"{name}.tmp-{uuid4().hex}", self.version)
+        self._arrays: Dict[str, Optional[np.memmap]] = {}
+        os.makedirs(self.tmp, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.normpath(os.path.join(self.tmp, f"{key}.npy"))
+
+    def save(self, key: str, arr: np.ndarray):
+        # Write a whole array
+        np.save(self._path(key), np.ascontiguousarray(arr))
+        self._arrays[key] = None
+
+    def open(self, key: str, shape: tuple, dtype) -> np.memmap:
+        # Writable memory-mapped array, filled by the caller before commit
+        arr = np.lib.format.open_memmap(self._path(key), mode='w+', dtype=dtype, shape=shape)
+        self._arrays[key] = arr
+        return arr
+
+    def _release(self):
+        # Flush the opened arrays and drop their maps (callers drop their references too, renaming needs it on Windows)
+        for arr in self._arrays.values():
+            if arr is not None: arr.flush()
+        self._arrays = dict.fromkeys(self._arrays)
+
+    def commit(self) -> Optional[Dict[str, np.ndarray]]:
+        # Publish the entry atomically, then return its arrays memory-mapped
+        try:
+            self._release()
+            # Meta file is written last, it marks the entry as complete
+            with open(os.path.normpath(os.path.join(self.tmp, 'meta.json')), 'w', encoding='utf-8') as f:
+                json.dump({'arrays': list(self._arrays.keys()), 'version': self.version}, f)
+            os.rename(self.tmp, self.entry)
+        except OSError:
+            # Another worker has already written the same entry
+            shutil.rmtree(self.tmp, ignore_errors=True)
+        self.cache._cleanup(self.name, self.entry, self.max_tagged)
+        return self.cache.get(self.name, self.source, self.tag)
+
+    def discard(self):
+        # Drop the entry (e.g. cancelled rendering)
+        self._arrays = dict.fromkeys(self._arrays)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+def get_cache(directory: str, max_mapped: int=0, max_tagged: int=1) -> SharedArrayCache:
+    """Get the shared cache of a directory, one instance per process."""
+    directory = os.path.normpath(directory)
+    with _registry_lock:
+        if directory not in _registry: _registry[directory] = SharedArrayCache(directory, max_mapped, max_tagged)
+        return _registry[directory]
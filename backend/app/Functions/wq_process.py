@@ -1,6 +1,6 @@
 import os, subprocess, re, shutil, json
 import asyncio, traceback, threading, time
-import pandas as pd, numpy as np, xarray as xr
+import pandas as pd, numpy as np
 from fastapi import APIRouter, Request, Depends, Query
 from config import PROJECT_STATIC_ROOT, DELFT_PATH
 from fastapi.responses import JSONResponse
@@ -163,7 +163,8 @@ async def check_sim_status_waq(request: Request, user=Depends(functions.basic_au
         return JSONResponse({"status": "failed", "progress": info["progress"],
             "message": info.get("message", 'Simulation failed')})
     if info["status"] == "reorganizing":
-        return JSONResponse({"status": "reorganizing", "progress": 100, "message": 'Reorganizing outputs. Please wait...'})
+        return JSONResponse({"status": "reorganizing", "progress": info.get("progress", 100),
+            "message": info.get("message", 'Reorganizing outputs. Please wait...')})
     return JSONResponse({"status": info["status"], "progress": info["progress"],
         "message": f"WAQ simulation completed: {info['progress']}%"})
 
@@ -324,6 +325,9 @@ async def run_waq_simulation(project_name, waq_name):
                     if not os.path.exists(output_dir): os.makedirs(output_dir)
                     output_WAQ_dir = os.path.normpath(os.path.join(output_dir, 'WAQ'))
                     if not os.path.exists(output_WAQ_dir): os.makedirs(output_WAQ_dir)
+                    def report(file_name, var_name, done, total):
+                        processes[project_name]["progress"] = round(100*done/total, 1)
+                        processes[project_name]["message"] = f"Reorganizing outputs: {file_name} - {var_name} ({done}/{total})"
                     for suffix in ["_his.nc", "_map.nc", ".json"]:
                         new_name = f"{file_name}{suffix}"
                         src = os.path.normpath(os.path.join(output_folder, new_name))
@@ -333,15 +337,8 @@ async def run_waq_simulation(project_name, waq_name):
                             # shutil.copy2(src, dst)
                             
                             # Using .zarr format
-                            zarr_path = os.path.normpath(os.path.join(output_WAQ_dir, new_name.replace('.nc', '.zarr')))
-                            if suffix != ".json":
-                                tmp_path = zarr_path + "_tmp"
-                                if os.path.exists(tmp_path): shutil.rmtree(tmp_path, onerror=functions.remove_readonly)
-                                with xr.open_dataset(src, chunks='auto') as ds:
-                                    ds.to_zarr(tmp_path, mode='w', consolidated=True, compute=True)
-                                if os.path.exists(zarr_path): shutil.rmtree(zarr_path, onerror=functions.remove_readonly)
-                                os.rename(tmp_path, zarr_path)                      
-                            else: shutil.copy2(src, zarr_path)
+                            if suffix != ".json": functions.ncToZarr(src, output_WAQ_dir, report)
+                            else: shutil.copy2(src, os.path.normpath(os.path.join(output_WAQ_dir, new_name)))
                             functions.safe_remove(src)
                     # Delete folder
                     if os.path.exists(wq_folder): shutil.rmtree(wq_folder, onerror=functions.remove_readonly)
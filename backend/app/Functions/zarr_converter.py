@@ -0,0 +1,194 @@
+import os, shutil, stat, json, warnings, zarr
+import numpy as np, xarray as xr, dask
+from numcodecs import Blosc
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Optional
+
+# Dimension names of the FlowFM (UGRID) and DELWAQ outputs
+TIME_DIMS = ('time', 'nTimesDlwq')
+FACE_DIMS = ('mesh2d_nFaces', 'nSegmentsPerLayerDlwq', 'nFlowElem', 'stations', 'source_sink')
+LAYER_DIMS = ('mesh2d_nLayers', 'mesh2d_nInterfaces', 'nLayersDlwq', 'laydim', 'wdim')
+# Target size of one chunk (uncompressed)
+CHUNK_BYTES = 8*1024**2
+# Blosc compressors of the zarr stores
+CODECS = ('zstd', 'lz4', 'none')
+
+def _remove_readonly(func, path, _):
+    os.chmod(path, stat.S_IWRITE)
+    func(path)
+
+def chunk_plan(var: xr.Variable, layout: str='frame', chunk_bytes: int=CHUNK_BYTES) -> Dict[str, int]:
+    """
+    Chunk sizes of a variable for the zarr store.
+
+    'frame': one time step per chunk, faces (or stations) split into large blocks and all layers together,
+        so reading one frame of the map touches as few chunks as possible.
+    'series': all time steps (up to the chunk size) together, faces split into small blocks,
+        so reading the series of one face/station is one chunk fetch.
+    Other dimensions are never split.
+    """
+    sizes, itemsize = dict(var.sizes), max(1, var.dtype.itemsize)
+    plan = {dim: size for dim, size in sizes.items()}
+    time_dims = [d for d in sizes if d in TIME_DIMS]
+    face_dims = [d for d in sizes if d in FACE_DIMS]
+    if layout == 'frame':
+        for dim in time_dims: plan[dim] = 1
+    else:
+        # Keep the full series when it fits in one chunk
+        fixed = itemsize * int(np.prod([sizes[d] for d in sizes if d not in face_dims], dtype=np.int64))
+        for dim in time_dims:
+            other = fixed // max(1, sizes[dim])
+            plan[dim] = int(min(sizes[dim], max(1, chunk_bytes // max(1, other))))
+    # Split faces so one chunk is about chunk_bytes
+    for dim in face_dims:
+        other = itemsize * int(np.prod([plan[d] for d in plan if d != dim], dtype=np.int64))
+        plan[dim] = int(min(sizes[dim], max(1, chunk_bytes // max(1, other))))
+    return {dim: max(1, size) for dim, size in plan.items()}
+
+def compressor(codec: str='zstd', clevel: int=3) -> Optional[Blosc]:
+    """Blosc compressor with byte shuffle, None to store the chunks uncompressed."""
+    if codec not in CODECS: raise ValueError(f"Unknown zarr codec: {codec}, expected one of {CODECS}")
+    if codec == 'none': return None
+    return Blosc(cname=codec, clevel=int(clevel), shuffle=Blosc.SHUFFLE)
+
+def _prepare(var: xr.Variable, downcast: bool) -> xr.Variable:
+    # Display variables (float64 with a time dimension) are stored as float32
+    # Variables without time dimension (mesh, coordinates) are never downcast
+    if not (downcast and var.dtype == np.float64 and any(d in TIME_DIMS for d in var.dims)): return var
+    encoding = dict(var.encoding)
+    encoding.pop('dtype', None)
+    var = var.astype(np.float32)
+    var.encoding = encoding
+    return var
+
+def convert(src: str, dst: str, layout: str='frame', chunk_bytes: int=CHUNK_BYTES, codec: str='zstd',
+        clevel: int=3, downcast: bool=True, workers: int=4,
+        progress: Optional[Callable[[str, int, int], None]]=None) -> str:
+    """
+    Convert a NetCDF file to a zarr store with explicit chunking (see chunk_plan).
+    The metadata is written first, then the variables are written in parallel (one variable per task).
+    The store is written next to the destination then renamed, so readers never see a partial store.
+
+    Parameters:
+    ----------
+    src: str
+        The path of the NetCDF file.
+    dst: str
+        The path of the zarr store.
+    layout: str
+        'frame' for map files (read frame by frame), 'series' for history files (read as time series).
+    chunk_bytes: int
+        Target size of one chunk.
+    codec: str
+        Blosc codec ('zstd', 'lz4') with shuffle, or 'none'.
+    clevel: int
+        Compression level.
+    downcast: bool
+        Store float64 variables with a time dimension as float32.
+    workers: int
+        Number of variables written at the same time.
+    progress: Callable
+        Called with (variable name, written variables, total variables) after each variable.
+
+    Returns:
+    -------
+    str
+        The path of the zarr store.
+    """
+    tmp_path = dst + "_tmp"
+    if os.path.exists(tmp_path): shutil.rmtree(tmp_path, onerror=_remove_readonly)
+    comp = compressor(codec, clevel)
+    with xr.open_dataset(src, chunks={}) as ds:
+        ds, encoding, lazy = ds.copy(), {}, []
+        for name, var in list(ds.variables.items()):
+            # Chunks inherited from NetCDF would conflict with the new ones
+            for key in ('chunks', 'chunksizes', 'preferred_chunks', 'contiguous', 'compressor',
+                'zlib', 'complevel', 'shuffle', 'fletcher32'): var.encoding.pop(key, None)
+            if var.ndim == 0 or name in ds.indexes: continue # Index coordinates stay in one chunk
+            plan = chunk_plan(var, layout, chunk_bytes)
+            var = _prepare(var, downcast).chunk(plan)
+            encoding[name] = {'chunks': tuple(plan[d] for d in var.dims), 'compressor': comp}
+            if name in ds.data_vars: ds[name] = var
+            else: ds = ds.assign_coords({name: var})
+            lazy.append(name)
+        # Create the arrays and write the small in-memory variables, lazy ones are written below
+        ds.to_zarr(tmp_path, mode='w', consolidated=False, compute=False, encoding=encoding)
+        def write(name: str) -> str:
+            var = ds.variables[name]
+            region = {dim: slice(None) for dim in var.dims}
+            xr.Dataset({name: var}).to_zarr(tmp_path, region=region, consolidated=False,
+                compute=False).compute(scheduler='synchronous')
+            return name
+        done = 0
+        with ThreadPoolExecutor(max_workers=max(1, int(workers))) as executor:
+            for future in as_completed([executor.submit(write, name) for name in lazy]):
+                name, done = future.result(), done + 1
+                if progress: progress(name, done, len(lazy))
+    zarr.consolidate_metadata(tmp_path)
+    if os.path.exists(dst): shutil.rmtree(dst, onerror=_remove_readonly)
+    os.rename(tmp_path, dst)
+    return dst
+
+def _json_list(arr) -> list:
+    arr = np.asarray(arr, dtype=np.float64)
+    return np.where(np.isfinite(arr), arr, None).tolist()
+
+def statistics(ds: xr.Dataset) -> dict:
+    """
+    Statistics of every numeric variable, computed in one pass over the chunks:
+    global min, max, NaN fraction and constant-ness, min/max per time step and per layer,
+    and the NaN fraction per layer.
+    """
+    names, tasks = [], []
+    for name, var in ds.variables.items():
+        if name in ds.indexes or var.dtype.kind not in 'fiu' or var.size == 0: continue
+        arr = ds[name].variable
+        time_dim = next((d for d in arr.dims if d in TIME_DIMS), None)
+        layer_dim = next((d for d in arr.dims if d in LAYER_DIMS), None)
+        task = {'min': arr.min(), 'max': arr.max(), 'nan': arr.isnull().sum()}
+        if time_dim and arr.ndim > 1:
+            others = [d for d in arr.dims if d != time_dim]
+            task['time_min'], task['time_max'] = arr.min(dim=others), arr.max(dim=others)
+        if layer_dim and arr.ndim > 1:
+            others = [d for d in arr.dims if d != layer_dim]
+            task['layer_min'], task['layer_max'] = arr.min(dim=others), arr.max(dim=others)
+            task['layer_nan'] = arr.isnull().mean(dim=others)
+        names.append((name, int(arr.size)))
+        tasks.append({key: value.data for key, value in task.items()})
+    results = dask.compute(*tasks) if tasks else []
+    output = {}
+    for (name, size), result in zip(names, results):
+        vmin, vmax, n_nan = float(result['min']), float(result['max']), int(result['nan'])
+        stats = {'min': _json_list(vmin), 'max': _json_list(vmax), 'nan_fraction': n_nan/size,
+            'constant': bool(n_nan == size or vmin == vmax)}
+        for key in ('time_min', 'time_max', 'layer_min', 'layer_max', 'layer_nan'):
+            if key in result: stats[key] = _json_list(result[key])
+        output[name] = stats
+    return output
+
+def write_statistics(ds: xr.Dataset, path: str, version: str) -> dict:
+    """
+    Compute the statistics of a dataset (see statistics) and write them as a JSON sidecar.
+
+    Parameters:
+    ----------
+    ds: xr.Dataset
+        The dataset, opened from the zarr store.
+    path: str
+        The path of the sidecar.
+    version: str
+        The version of the zarr store, the sidecar is only valid for this version.
+
+    Returns:
+    -------
+    dict
+        The content of the sidecar.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning) # All-NaN slices
+        content = {'version': version, 'variables': statistics(ds)}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(content, f)
+    os.replace(tmp_path, path)
+    return content
@@ -1,6 +1,6 @@
-import os, socket
+import os, socket, asyncio
 from contextlib import asynccontextmanager
-from Functions import dataset_manager
+from Functions import dataset_manager, frame_prefetcher
 from dotenv import load_dotenv
 from redis.asyncio import Redis
 
@@ -23,6 +23,42 @@ else:
     STATIC_DIR_FRONTEND = "/app/frontend/static"
     DELFT_PATH = os.path.normpath(os.path.join(PROJECT_DES, "x64"))
     REDIS_URL = "redis://redis:6379/0"
+# Dataset cache limits per worker (0 = unlimited)
+DATASET_CACHE_MAX_ENTRIES = int(os.getenv("DATASET_CACHE_MAX_ENTRIES", "8"))
+DATASET_CACHE_MAX_BYTES = int(os.getenv("DATASET_CACHE_MAX_BYTES", str(2*1024**3)))
+# Shared array cache: entries kept memory-mapped per worker and project (least recently used first out, 0 = unlimited)
+SHARED_CACHE_MAX_MAPPED = int(os.getenv("SHARED_CACHE_MAX_MAPPED", "64"))
+# Entries built from a selection (tagged) kept per name, e.g. transects of several users
+SHARED_CACHE_MAX_TAGGED = int(os.getenv("SHARED_CACHE_MAX_TAGGED", "8"))
+# Zarr conversion: Blosc codec (zstd, lz4 or none), level, parallel variables and float64 -> float32 for display variables
+ZARR_CODEC = os.getenv("ZARR_CODEC", "zstd")
+ZARR_CLEVEL = int(os.getenv("ZARR_CLEVEL", "3"))
+ZARR_WORKERS = int(os.getenv("ZARR_WORKERS", str(min(4, os.cpu_count() or 1))))
+ZARR_DOWNCAST = os.getenv("ZARR_DOWNCAST", "1") == "1"
+# Map animations: frames read ahead per client stream (0 = disabled), idle time before the buffer is dropped, reader threads
+FRAME_PREFETCH_DEPTH = int(os.getenv("FRAME_PREFETCH_DEPTH", "8"))
+FRAME_PREFETCH_IDLE = float(os.getenv("FRAME_PREFETCH_IDLE", "60"))
+FRAME_PREFETCH_WORKERS = int(os.getenv("FRAME_PREFETCH_WORKERS", "2"))
+# Largest response of /load_dynamic_frames (uncompressed float32 frames)
+FRAME_BATCH_MAX_BYTES = int(os.getenv("FRAME_BATCH_MAX_BYTES", str(256*1024**2)))
+# Frame streaming (WebSocket): frames sent ahead of the client acknowledgements, highest playback rate (frames/s)
+STREAM_WINDOW = int(os.getenv("STREAM_WINDOW", "4"))
+STREAM_MAX_RATE = float(os.getenv("STREAM_MAX_RATE", "30"))
+# Lifetime (s) of the single-use token authenticating a frame stream
+STREAM_TOKEN_TTL = int(os.getenv("STREAM_TOKEN_TTL", "30"))
+# Map levels of detail: coarse levels of the mesh, smallest number of clusters, screen size (pixels) of a cluster
+MAP_LOD_LEVELS = int(os.getenv("MAP_LOD_LEVELS", "6"))
+MAP_LOD_MIN_CLUSTERS = int(os.getenv("MAP_LOD_MIN_CLUSTERS", "2000"))
+MAP_LOD_PIXELS = float(os.getenv("MAP_LOD_PIXELS", "4"))
+# Vector streamlines: seeds over the whole domain, points per line
+STREAMLINE_SEEDS = int(os.getenv("STREAMLINE_SEEDS", "2000"))
+STREAMLINE_STEPS = int(os.getenv("STREAMLINE_STEPS", "40"))
+# Streamlines of the most recently used time steps (and layers) kept in the shared cache
+STREAMLINE_CACHE_STEPS = int(os.getenv("STREAMLINE_CACHE_STEPS", "64"))
+# Transects: time steps read at once when all the frames are rendered in the background
+TRANSECT_CHUNK = int(os.getenv("TRANSECT_CHUNK", "16"))
+# Transects: a running job is considered failed when its worker has not refreshed it for this time (seconds)
+TRANSECT_JOB_TTL = int(os.getenv("TRANSECT_JOB_TTL", "30"))
 
 
 # ============== Redis Client ================
@@ -41,8 +77,23 @@ def check_redis_running(host="localhost", port=6379, timeout=1):
 @asynccontextmanager
 async def lifespan(app):
     # Dataset
-    app.state.dataset_manager = dataset_manager.DatasetManager()
     app.state.env, app.state.project_cache = env_mode, {}
+    def drop_project_cache(path, ds):
+        # Drop projects that still pin the evicted dataset (and the grid built from it)
+        for name, cache in list(app.state.project_cache.items()):
+            if cache and any(v is ds for v in cache.values()):
+                print(f"Dropping project cache: {name}")
+                app.state.project_cache.pop(name, None)
+    app.state.dataset_manager = dataset_manager.DatasetManager(DATASET_CACHE_MAX_ENTRIES,
+        DATASET_CACHE_MAX_BYTES, on_evict=drop_project_cache)
+    # Read-ahead of map animation frames, idle buffers are dropped periodically
+    app.state.frame_prefetcher = frame_prefetcher.FramePrefetcher(FRAME_PREFETCH_DEPTH,
+        FRAME_PREFETCH_IDLE, workers=FRAME_PREFETCH_WORKERS)
+    async def sweep_prefetcher():
+        while True:
+            await asyncio.sleep(max(1, FRAME_PREFETCH_IDLE/2))
+            app.state.frame_prefetcher.sweep()
+    sweep_task = asyncio.create_task(sweep_prefetcher())
     # Redis
     try:
         app.state.redis = Redis.from_url(REDIS_URL, decode_responses=False)
@@ -50,6 +101,8 @@ async def lifespan(app):
         print(f"Failed to initialize Redis: {e}")
         app.state.redis = None
     yield
+    sweep_task.cancel()
+    app.state.frame_prefetcher.close()
     try:
         app.state.dataset_manager.close()
         if app.state.redis:
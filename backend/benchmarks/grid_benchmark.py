@@ -0,0 +1,50 @@
+"""
+Benchmark: unstructured grid polygon construction.
+
+Compares the former per-face Python loop with the vectorized builder
+(shapely 2.x ragged arrays) on a synthetic mesh.
+
+Usage: python backend/benchmarks/grid_benchmark.py [n_faces]
+"""
+import os, sys, time
+import numpy as np, shapely
+
+app_dir = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+if app_dir not in sys.path: sys.path.insert(0, app_dir)
+from Functions import mesh_functions
+
+def synthetic_mesh(n_faces: int) -> tuple:
+    # Quad mesh with every 5th face turned into a triangle, -1 as fill value
+    nx = int(np.sqrt(n_faces))
+    ny = max(1, n_faces // nx)
+    xs, ys = np.meshgrid(np.arange(nx + 1) * 50.0, np.arange(ny + 1) * 50.0)
+    j, i = np.divmod(np.arange(nx * ny), nx)
+    n0 = j * (nx + 1) + i
+    faces = np.column_stack((n0, n0 + 1, n0 + nx + 2, n0 + nx + 1))
+    faces[::5, 3] = -1
+    return xs.ravel(), ys.ravel(), faces
+
+def loop_builder(node_x, node_y, faces):
+    # Former implementation: one Polygon per face
+    coords = np.column_stack((node_x, node_y))
+    counts = np.sum(faces != -1, axis=1)
+    return [shapely.geometry.Polygon(coords[face[:count]]) for face, count in zip(faces, counts)]
+
+def timeit(func, *args, repeat: int=3) -> tuple:
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+if __name__ == "__main__":
+    n_faces = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    node_x, node_y, faces = synthetic_mesh(n_faces)
+    t_loop, loop_polygons = timeit(loop_builder, node_x, node_y, faces)
+    t_vec, vec_polygons = timeit(mesh_functions.polygonBuilder, node_x, node_y, faces)
+    same = bool(np.all(shapely.equals(np.array(loop_polygons, dtype=object), vec_polygons)))
+    print(f"Faces: {len(faces)}")
+    print(f"Loop builder:       {t_loop:.3f} s")
+    print(f"Vectorized builder: {t_vec:.3f} s (x{t_loop / t_vec:.1f})")
+    print(f"Identical geometry: {same}")
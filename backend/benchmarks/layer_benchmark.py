@@ -0,0 +1,54 @@
+"""
+Benchmark: empty velocity layers (layerCounter).
+
+Scans the layers of a synthetic _map store (chunked frame by frame like the converted outputs,
+no statistics sidecar) with the former loop (three variables computed separately for every layer)
+and with emptyLayers (one reduction of the three variables), then compares the layers found.
+
+Usage: python backend/benchmarks/layer_benchmark.py [n_faces] [n_steps] [n_layers]
+(needs the development environment of the backend: .env with PROJECT_DES and allowed_users.json)
+"""
+import os, sys, time, tempfile
+import numpy as np, xarray as xr
+
+app_dir = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+if app_dir not in sys.path: sys.path.insert(0, app_dir)
+from Functions import functions
+
+def synthetic_map(path: str, n_faces: int, n_steps: int, n_layers: int) -> xr.Dataset:
+    # Velocities (time, faces, layers), the deepest layers are dry (all NaN) for one of the variables
+    rng, dims = np.random.default_rng(0), ('time', 'mesh2d_nFaces', 'mesh2d_nLayers')
+    data = {}
+    for k, name in enumerate(['mesh2d_ucx', 'mesh2d_ucy', 'mesh2d_ucmag']):
+        values = rng.random((n_steps, n_faces, n_layers), dtype=np.float32)
+        values[:, :, :k + 1] = np.nan
+        data[name] = (dims, values)
+    ds = xr.Dataset(data, coords={'time': np.arange(n_steps)})
+    ds.chunk({'time': 1, 'mesh2d_nFaces': -1, 'mesh2d_nLayers': -1}).to_zarr(path, consolidated=True)
+    return xr.open_zarr(path, consolidated=True)
+
+def former_empty_layers(data_map: xr.Dataset, n_layers: int) -> np.ndarray:
+    # Former implementation: every layer of every variable computed separately
+    ucx, ucy, ucm = data_map['mesh2d_ucx'].data, data_map['mesh2d_ucy'].data, data_map['mesh2d_ucmag'].data
+    empty = np.zeros(n_layers, dtype=bool)
+    for i in reversed(range(n_layers)):
+        ucx_i, ucy_i, ucm_i = ucx[:, :, i].compute(), ucy[:, :, i].compute(), ucm[:, :, i].compute()
+        empty[i] = np.isnan(ucx_i).all() or np.isnan(ucy_i).all() or np.isnan(ucm_i).all()
+    return empty
+
+if __name__ == "__main__":
+    n_faces = int(sys.argv[1]) if len(sys.argv) > 1 else 22500
+    n_steps = int(sys.argv[2]) if len(sys.argv) > 2 else 48
+    n_layers = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    with tempfile.TemporaryDirectory() as folder:
+        data_map = synthetic_map(os.path.join(folder, 'FlowFM_map.zarr'), n_faces, n_steps, n_layers)
+        start = time.perf_counter()
+        former = former_empty_layers(data_map, n_layers)
+        t_former = time.perf_counter() - start
+        start = time.perf_counter()
+        new = functions.emptyLayers(data_map, ['mesh2d_ucx', 'mesh2d_ucy', 'mesh2d_ucmag'])
+        t_new = time.perf_counter() - start
+    print(f"Faces: {n_faces}, time steps: {n_steps}, layers: {n_layers}")
+    print(f"Former layer loop: {t_former:.3f} s")
+    print(f"emptyLayers:       {t_new:.3f} s (x{t_former / t_new:.1f})")
+    print(f"Identical layers:  {bool(np.array_equal(former, new))}")
@@ -0,0 +1,58 @@
+"""
+Benchmark: numberFormatter.
+
+Compares the former object-dtype formatter ("%.2e" per small value) with the
+vectorized NumPy version on a random array with small values, zeros and NaN.
+
+Usage: python backend/benchmarks/number_formatter_benchmark.py [n_values]
+(needs the development environment of the backend: .env with PROJECT_DES and allowed_users.json)
+"""
+import os, sys, time
+import numpy as np
+
+app_dir = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+if app_dir not in sys.path: sys.path.insert(0, app_dir)
+from Functions import functions
+
+def object_formatter(arr, decimals: int=2):
+    # Former implementation: object array, small numbers formatted one by one
+    arr = np.asarray(arr, dtype=float)
+    result = np.empty(arr.shape, dtype=object)
+    finite_mask = np.isfinite(arr)
+    abs_arr = np.abs(arr)
+    large_mask = finite_mask & (abs_arr >= 1)
+    result[large_mask] = np.round(arr[large_mask], decimals)
+    small_mask = finite_mask & (abs_arr < 1) & (arr != 0)
+    fmt = f"%.{decimals}e"
+    result[small_mask] = [float(fmt % v) for v in arr[small_mask]]
+    result[finite_mask & (arr == 0)] = 0.0
+    result[~finite_mask] = None
+    return np.reshape(result, arr.shape)
+
+def synthetic_values(n_values: int) -> np.ndarray:
+    # Mix of magnitudes (1e-6 to 1e3), 5% zeros and 5% NaN
+    rng = np.random.default_rng(0)
+    values = rng.standard_normal(n_values) * 10.0 ** rng.integers(-6, 4, n_values)
+    values[rng.random(n_values) < 0.05] = 0.0
+    values[rng.random(n_values) < 0.05] = np.nan
+    return values
+
+def timeit(func, *args, repeat: int=3) -> tuple:
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+if __name__ == "__main__":
+    n_values = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    values = synthetic_values(n_values)
+    t_obj, obj_result = timeit(object_formatter, values)
+    t_vec, vec_result = timeit(functions.numberFormatter, values)
+    expected = np.array(obj_result, dtype=np.float64)
+    close = np.isclose(vec_result, expected, rtol=1e-12, atol=0, equal_nan=True)
+    print(f"Values: {n_values}")
+    print(f"Object formatter:     {t_obj:.3f} s")
+    print(f"Vectorized formatter: {t_vec:.3f} s (x{t_obj / t_vec:.1f})")
+    print(f"Matching values:      {close.mean() * 100:.4f} %")
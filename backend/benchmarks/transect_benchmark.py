@@ -0,0 +1,83 @@
+"""
+Benchmark: transect playback (meshProcess).
+
+Plays the frames of a synthetic transect with the former meshProcess (index map, depth masks
+and nearest-fill indices computed for every frame) and with the plan computed once per transect
+(transectPlan), then compares the frames.
+
+Usage: python backend/benchmarks/transect_benchmark.py [n_frames] [n_points] [n_layers]
+(needs the development environment of the backend: .env with PROJECT_DES and allowed_users.json)
+"""
+import os, sys, time, math
+import numpy as np
+from scipy.ndimage import distance_transform_edt, gaussian_filter
+
+app_dir = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+if app_dir not in sys.path: sys.path.insert(0, app_dir)
+from Functions import functions
+
+def former_mesh_process(is_hyd: bool, arr: np.ndarray, cache: dict) -> np.ndarray:
+    # Former implementation: everything is computed again for every frame
+    df_index, df_depth = np.asarray(cache["index"]), np.asarray(cache["depth"], dtype=float)
+    depth_values = np.asarray(cache["depth_values"], dtype=float)
+    depth_rounded, n_rows = abs(np.round(depth_values, 0)), int(cache["n_rows"][0])
+    if is_hyd: index_map = {int(v): len(depth_rounded)-i-1 for i, v in enumerate(depth_rounded)}
+    else: index_map = {int(v): i for i, v in enumerate(depth_rounded)}
+    frame = np.full((len(df_index), abs(n_rows)), np.nan, float)
+    values_filtered = arr[df_index, :]
+    depth_int = depth_rounded.astype(int)
+    valid_depth = np.unique(depth_int[depth_int < abs(n_rows)])
+    col_idx = np.array([index_map[d] for d in valid_depth])
+    mask = df_depth[:, None] <= -valid_depth[None, :]
+    vals = values_filtered[:, col_idx]
+    frame[:, valid_depth] = np.where(mask, vals, frame[:, valid_depth])
+    mask = ~np.isnan(frame)
+    _, (ix, iy) = distance_transform_edt(~mask, return_indices=True)
+    frame_filled = gaussian_filter(frame[ix, iy], sigma=(1.2, 0.6))
+    frame = np.clip(frame_filled, 0, None)
+    mask_valid = -np.arange(abs(n_rows))[None, :] >= df_depth[:, None]
+    max_row = np.max(np.where(mask_valid.T)[0])
+    frame[~mask_valid] = np.nan
+    return frame.T[:max_row + 2, :]
+
+def synthetic_transect(n_points: int, n_layers: int, n_faces: int) -> dict:
+    # Layers every metre, bed between 5 m and the deepest layer, a few points on the same face
+    rng = np.random.default_rng(0)
+    depth_values = -np.arange(1, n_layers + 1, dtype=float)
+    n_rows = -(math.ceil(n_layers/10)*10 + 1)
+    index = np.sort(rng.integers(0, n_faces, n_points))
+    depth = -np.round(5 + (n_layers - 5)*np.abs(np.sin(np.linspace(0, 3, n_points))), 2)
+    return {'index': index, 'depth': depth, 'depth_values': depth_values, 'n_rows': np.array([n_rows])}
+
+def synthetic_frames(n_faces: int, n_layers: int, n_distinct: int=20) -> list:
+    # Frames of the playback (reused in turn), one in ten has dry faces (NaN)
+    rng = np.random.default_rng(1)
+    base, frames = rng.random((n_faces, n_layers))*20, []
+    for step in range(n_distinct):
+        frame = base + np.sin(step/10)
+        if step % 10 == 9: frame[rng.random(n_faces) < 0.05] = np.nan
+        frames.append(frame)
+    return frames
+
+def play(render, frames: list, n_frames: int) -> tuple:
+    start, result = time.perf_counter(), []
+    for step in range(n_frames): result.append(render(frames[step % len(frames)]))
+    return time.perf_counter() - start, result
+
+if __name__ == "__main__":
+    n_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    n_points = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    n_layers = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    n_faces = 20000
+    transect, frames = synthetic_transect(n_points, n_layers, n_faces), synthetic_frames(n_faces, n_layers)
+    t_former, former = play(lambda arr: former_mesh_process(True, arr, transect), frames, n_frames)
+    start = time.perf_counter()
+    plan = functions.transectPlan(True, transect)
+    t_plan = time.perf_counter() - start
+    t_new, new = play(lambda arr: functions.meshProcess(True, arr, transect, plan), frames, n_frames)
+    same = all(a.shape == b.shape and np.allclose(a, b, equal_nan=True) for a, b in zip(former, new))
+    print(f"Frames: {n_frames}, points: {n_points}, layers: {n_layers}")
+    print(f"Former meshProcess: {t_former:.3f} s ({1000*t_former/n_frames:.2f} ms/frame)")
+    print(f"Transect plan:      {t_plan*1000:.2f} ms (once)")
+    print(f"Planned frames:     {t_new:.3f} s ({1000*t_new/n_frames:.2f} ms/frame, x{t_former / t_new:.1f})")
+    print(f"Identical frames:   {same}")
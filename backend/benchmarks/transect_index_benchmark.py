@@ -0,0 +1,82 @@
+"""
+Benchmark: transect faces and bed levels (transectArrays).
+
+Looks up the faces and bed levels of the points of a synthetic transect on a synthetic WGS84 mesh
+with the former lookup (interpolation_Z reprojecting every point and rebuilding the node tree, then gpd.sjoin)
+and with the per-grid index of meshIndex (projected nodes, STRtree of the faces and cKDTree of the nodes),
+timed on the first call (index built) and once the index exists, then compares the results.
+
+Usage: python backend/benchmarks/transect_index_benchmark.py [n_faces] [n_points]
+(needs the development environment of the backend: .env with PROJECT_DES and allowed_users.json)
+"""
+import os, sys, time
+import numpy as np, geopandas as gpd, shapely
+from scipy.spatial import cKDTree
+
+app_dir = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+if app_dir not in sys.path: sys.path.insert(0, app_dir)
+from Functions import functions, mesh_functions
+
+def synthetic_mesh(n_faces: int) -> tuple:
+    # Quad mesh of about 50 m cells near Rotterdam (WGS84), with its node bed levels
+    nx = int(np.sqrt(n_faces))
+    ny = max(1, n_faces // nx)
+    xs, ys = np.meshgrid(4.0 + np.arange(nx + 1) * 7e-4, 51.9 + np.arange(ny + 1) * 4.5e-4)
+    j, i = np.divmod(np.arange(nx * ny), nx)
+    n0 = j * (nx + 1) + i
+    faces = np.column_stack((n0, n0 + 1, n0 + nx + 2, n0 + nx + 1))
+    node_x, node_y = xs.ravel(), ys.ravel()
+    node_z = -5 - 15 * np.abs(np.sin(node_x * 40) * np.cos(node_y * 30))
+    grid = gpd.GeoDataFrame(geometry=mesh_functions.polygonBuilder(node_x, node_y, faces), crs='EPSG:4326')
+    return grid, node_x, node_y, node_z
+
+def synthetic_transect(grid: gpd.GeoDataFrame, n_points: int) -> tuple:
+    # Diagonal line across the mesh, its end outside
+    west, south, east, north = grid.total_bounds
+    t = np.linspace(0.02, 1.1, n_points)
+    return west + t * (east - west), south + t * (north - south) * 0.95
+
+def former_lookup(grid: gpd.GeoDataFrame, node_x, node_y, node_z, x, y) -> tuple:
+    # Former implementation: nodes reprojected and tree rebuilt for every transect, spatial join of the points
+    gdf = gpd.GeoDataFrame(geometry=gpd.points_from_xy(x, y), crs=grid.crs)
+    gdf['depth'] = functions.interpolation_Z(gdf, node_x, node_y, node_z)
+    joined = gpd.sjoin(gdf, grid, how="left", predicate="intersects")
+    return joined['index_right'].to_numpy(dtype=float), joined['depth'].to_numpy(dtype=float)
+
+def build_index(grid: gpd.GeoDataFrame, node_x, node_y, node_z) -> dict:
+    # Same index as meshIndex: projected nodes (shared cache) and the trees of the worker
+    nx, ny = mesh_functions.reprojectNodes(node_x, node_y, grid.crs, 32632)
+    return {'z': node_z, 'face_tree': shapely.STRtree(grid.geometry.values), 'node_tree': cKDTree(np.column_stack((nx, ny)))}
+
+def index_lookup(grid: gpd.GeoDataFrame, index: dict, x, y) -> tuple:
+    # Same lookups as transectArrays
+    x_utm, y_utm = mesh_functions.reprojectNodes(x, y, grid.crs, 32632)
+    dists, idx = index['node_tree'].query(np.column_stack((x_utm, y_utm)), k=2)
+    weight = 1 / (dists + 1e-10)**2
+    depth = functions.numberFormatter(np.sum(weight * index['z'][idx], axis=1)/np.sum(weight, axis=1))
+    return mesh_functions.locatePoints(index['face_tree'], x, y), np.asarray(depth, dtype=float)
+
+def timeit(func, *args, repeat: int=5) -> tuple:
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+if __name__ == "__main__":
+    n_faces = int(sys.argv[1]) if len(sys.argv) > 1 else 30000
+    n_points = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    grid, node_x, node_y, node_z = synthetic_mesh(n_faces)
+    x, y = synthetic_transect(grid, n_points)
+    t_former, (former_faces, former_depth) = timeit(former_lookup, grid, node_x, node_y, node_z, x, y)
+    t_first, (faces, depth) = timeit(lambda: index_lookup(grid, build_index(grid, node_x, node_y, node_z), x, y))
+    index = build_index(grid, node_x, node_y, node_z)
+    t_next, (faces, depth) = timeit(index_lookup, grid, index, x, y)
+    inside = faces >= 0
+    print(f"Faces: {len(grid)}, points: {n_points} ({int((~inside).sum())} outside the mesh)")
+    print(f"Former lookup:         {1000*t_former:.1f} ms")
+    print(f"Index, first transect: {1000*t_first:.1f} ms (x{t_former / t_first:.1f})")
+    print(f"Index, next transects: {1000*t_next:.1f} ms (x{t_former / t_next:.1f})")
+    print(f"Identical faces:       {bool(np.array_equal(former_faces[inside], faces[inside]) and np.isnan(former_faces[~inside]).all())}")
+    print(f"Identical bed levels:  {bool(np.allclose(former_depth, depth))}")
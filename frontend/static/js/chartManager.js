@@ -1,11 +1,11 @@
 import { startLoading, showLeafletMap} from "./mapManager.js";
 import { loadData, interpolateJet, splitLines, getColors, valueFormatter } from "./utils.js";
 import { getState, setState } from "./constants.js";
-import { sendQuery } from "./tableManager.js";
+import { sendFrameQuery, openFrameStream } from "./tableManager.js";
 import { deActivePathQuery, moveWindow } from "./generalOptionManager.js";
 
 let Dragging = false, colorTicks = [], colorTickLabels = [], animationToken = 0;
-let animating = false, frameIndex = 0, duration, nColors;
+let animating = false, frameIndex = 0, duration, nColors, profileProgress = null, thermoclineStream = null;
 
 export const plotWindow = () => document.getElementById('plotWindow');
 const plotHeader = () => document.getElementById('plotHeader');
@@ -318,11 +318,22 @@ export function plotProfileMultiLayer(key, query, data, title, unit) {
             values, local_minmax[0], local_minmax[1], nColors, title, unit);
     // Change header title of window
     profileWindowHeader().childNodes[0].nodeValue = 'Profile Plot';
+    // All time steps are rendered on the server in the background, the frames are then read from its cache
+    if (profileProgress) profileProgress.close();
+    const progress = profileProgress = new EventSource(
+        `/transect_progress?projectName=${encodeURIComponent(getState().projectName)}&key=${key}`);
+    progress.onmessage = (event) => {
+        const job = JSON.parse(event.data), header = profileWindowHeader().childNodes[0];
+        if (job.status === 'running') {
+            header.nodeValue = `Profile Plot (preparing time steps: ${Math.round(100 * job.done / Math.max(1, job.total))}%)`;
+        } else { header.nodeValue = 'Profile Plot'; progress.close(); }
+    };
+    progress.onerror = () => progress.close();
     // Update a single frame
     async function updateFrame(index) {
         if (myToken !== animationToken) return;
         const queryContents = { key: key, query: query, idx: index, projectName: getState().projectName };
-        const data = await sendQuery('select_meshes', queryContents);
+        const data = await sendFrameQuery('select_meshes', queryContents);
         if (data.status === "error") { 
             alert(data.message); animating = false;
             playPauseBtn().textContent = '▶ Play'; return;
@@ -376,7 +387,7 @@ export function plotProfileMultiLayer(key, query, data, title, unit) {
     colorCombo().addEventListener('change', async() => { 
         animating = false; playPauseBtn().textContent = '▶ Play';
         const queryContents = { key: key, query: query, idx: frameIndex, projectName: getState().projectName };
-        const refreshed = await sendQuery('select_meshes', queryContents);
+        const refreshed = await sendFrameQuery('select_meshes', queryContents);
         if (refreshed.status === "error") { alert(data.message); return; }
         const { values, local_minmax } = refreshed.content;
         minValue().value = valueFormatter(local_minmax[0], 1e-3); 
@@ -458,9 +469,10 @@ function colorbarTicks(min, max, numStops){
     return ticks;
 }
 
-export function thermoclinePlotter(key, data, name, titleX, titleY, chartTitle) {
+export function thermoclinePlotter(key, data, name, titleX, titleY, chartTitle, selection) {
     animationToken++;
     const myToken = animationToken;
+    if (thermoclineStream) { thermoclineStream.close(); thermoclineStream = null; }
     chartDivProfile().style.border = "1px solid #aaa"; 
     chartDivProfile().style.borderRadius = "10px"; 
     chartDivProfile().style.boxShadow = "0 2px 8px rgba(0,0,0,0.15)"; 
@@ -468,8 +480,8 @@ export function thermoclinePlotter(key, data, name, titleX, titleY, chartTitle)
     // Hide components
     colorCombo().style.display = "none"; minValue().style.display = "none"; maxValue().style.display = "none";
     colorComboLabel().style.display = "none"; minLabel().style.display = "none"; maxLabel().style.display = "none";
-    let animating = false, frameIndex = 0, duration;
-    const { timestamps, depths, values } = data;
+    let animating = false, frameIndex = 0;
+    const { timestamps, depths } = data, values = nanToNull(data.values);
     // Set up time slider
     timeSlider().min = 0; timeSlider().max = timestamps.length - 1;
     timeSlider().step = 1; timeSlider().value = 0;
@@ -482,54 +494,47 @@ export function thermoclinePlotter(key, data, name, titleX, titleY, chartTitle)
     // Change header title of window
     profileWindowHeader().childNodes[0].nodeValue = 'Thermocline Plot';
     // Update a single frame
-    async function updateFrame(index) {
-        if (myToken !== animationToken) return;
-        const queryContents = { idx: index, type: 'thermocline_update', projectName: getState().projectName };
-        const updateData = await sendQuery('select_thermocline', queryContents);
-        if (updateData.status === "error") { 
-            alert(updateData.message); animating = false;
-            playPauseBtn().textContent = '▶ Play'; return;
-        }
-        const values = updateData.content;
+    async function updateFrame(index, frameValues) {
         // Update the frame
-        await Plotly.update(chartDivProfile(), { x: [values], y: [depths]}, {}, [0]);
+        await Plotly.update(chartDivProfile(), { x: [nanToNull(frameValues)], y: [depths]}, {}, [0]);
         // Update time slider
         timeSlider().value = index; timeLabel().textContent = `Time: ${timestamps[index]}`;
     }
-    // === Play / Pause control === 
-    async function playAnimation() { 
-        duration = parseFloat(durationValue().value)*1000
-        while (animating && frameIndex < timestamps.length && myToken === animationToken) {
-            await updateFrame(frameIndex);
-            frameIndex++;
-            await new Promise(r => setTimeout(r, duration)); 
-        }
-        if (myToken !== animationToken) return;
-        if (frameIndex >= timestamps.length) { 
-            animating = false; playPauseBtn().textContent = '▶ Play'; 
-            frameIndex = 0; // Reset index
-        }
+    // === Play / Pause control ===
+    function stopAnimation() {
+        animating = false; playPauseBtn().textContent = '▶ Play';
+        if (thermoclineStream) { thermoclineStream.close(); thermoclineStream = null; }
+    }
+    // Frames are pushed by the server (one every duration seconds), from the current index to the last one
+    function playAnimation() {
+        const duration = Math.max(0.01, parseFloat(durationValue().value) || 1);
+        thermoclineStream = openFrameStream({kind: 'thermocline', key: key, query: selection.query, idx: selection.idx,
+            start: frameIndex, rate: 1 / duration, projectName: getState().projectName}, async (frame) => {
+            if (myToken !== animationToken || !animating) return;
+            await updateFrame(frame.step, frame.values);
+            frameIndex = frame.step + 1;
+            if (frameIndex >= timestamps.length) { stopAnimation(); frameIndex = 0; } // Reset index
+        }, (message) => { stopAnimation(); alert(message); });
     }
     playPauseBtn().onclick = () => { 
         if (!animating){ 
             animating = true; playPauseBtn().textContent = '⏸ Pause'; 
             playAnimation(); 
-        } else { 
-            animating = false; playPauseBtn().textContent = '▶ Play'; 
-        } 
+        } else stopAnimation();
     };
     // === Slider control === 
     timeSlider().addEventListener('input', async(e) => {
-        animating = false; playPauseBtn().textContent = '▶ Play';
+        stopAnimation();
         frameIndex = parseInt(e.target.value);
     });
     // === Duration control ===
-    durationValue().addEventListener('change', () => { 
-        animating = false; playPauseBtn().textContent = '▶ Play';
-    });
+    durationValue().addEventListener('change', () => { stopAnimation(); });
     profileWindow().style.display = "flex"; setState({isThemocline: false});
 }
 
+// Missing values (NaN in binary frames) as gaps on the category axis
+function nanToNull(values) { return Array.from(values, v => Number.isNaN(v) ? null : v); }
+
 function renderThermocline(key, plotDiv, xValues, yValues, legend, xTitle, yTitle, title){
     // === Layout ===
     const layout = { title: { text: title, font: { color: 'black', weight: 'bold', size: 20 } },
@@ -19,6 +19,10 @@ export const setState = (newState) => { state = { ...state, ...newState }; };
 // Reset state
 export const resetState = () => { state = structuredClone(defaultState); };
 
+// Pixels between two arrows of a vector map (vectors are thinned on the server)
+export const arrow_spacing = 20;
+// Frames read in one request around the slider position (load_dynamic_frames)
+export const frame_batch = 16;
 export const arrowShape = new Path2D();
 arrowShape.moveTo(0, 0);          // Origin
 arrowShape.lineTo(1, 0);          // Main length
@@ -3,7 +3,7 @@ import { colorbar_title, timeControl, colorbar_container, colorbar_vector_contai
 import { plotChart, plotProfileSingleLayer, plotProfileMultiLayer } from "./chartManager.js";
 import { getState, setState } from "./constants.js";
 import { startLoading, showLeafletMap, map, L, ZOOM } from "./mapManager.js";
-import { sendQuery } from './tableManager.js';
+import { sendQuery, sendFrameQuery } from './tableManager.js';
 
 
 export const summaryWindow = () => document.getElementById("summaryWindow");
@@ -394,7 +394,7 @@ async function mapPath(e) {
             const query = getState().showedQuery;
             const queryContents = {key: key, query: query, idx: 'load', 
                 points: orderedPoints, projectName: getState().projectName};
-            const data = await sendQuery('select_meshes', queryContents);
+            const data = await sendFrameQuery('select_meshes', queryContents);
             if (data.status === "error") { alert(data.message); return; }
             plotProfileMultiLayer(key, query, data.content, title, unit);
             showLeafletMap();
@@ -1,8 +1,8 @@
-import { loadData, getColorFromValue, updateColorbar, updateMapByTime, decodeArray } from "./utils.js";
+import { loadData, loadMesh, getColorFromValue, updateColorbar, updateMapByTime } from "./utils.js";
 import { startLoading, showLeafletMap, L, map } from "./mapManager.js";
-import { arrowShape, getState, setState } from "./constants.js";
+import { arrowShape, arrow_spacing, frame_batch, getState, setState } from "./constants.js";
 import { substanceWindowHis } from "./spatialMapManager.js";
-import { sendQuery } from "./tableManager.js";
+import { sendFrameQuery, openFrameStream, frameBatches } from "./tableManager.js";
 
 export const timeControl = () => document.getElementById('time-controls');
 export const colorbar_container = () => document.getElementById("custom-colorbar");
@@ -20,7 +20,7 @@ const colorbar_vector_label = () => document.getElementById("colorbar-labels-vec
 const colorbar_vector_scaler = () => document.getElementById("custom-colorbar-scaler");
 
 let layerAbove = null, layerMap = null, playHandlerAttached = false, 
-    playHandlerRef = null, parsedFrame = null, scale = null;
+    playHandlerRef = null, viewHandlerRef = null, parsedFrame = null, scale = null, streams = [];
 
 // Define CanvasLayer
 L.CanvasLayer = L.Layer.extend({
@@ -58,11 +58,44 @@ L.CanvasLayer = L.Layer.extend({
     }
 });
 
+// Stop the animation and close the frame streams
+function stopPlayback() {
+    clearInterval(getState().isPlaying); setState({isPlaying: null});
+    streams.forEach(stream => stream.close()); streams = [];
+    playBtn().textContent = "▶ Play";
+}
+
+// Map resolution in web mercator metres per pixel (unit of the mesh levels of detail)
+function mapResolution() { return 40075016.686 / (256 * Math.pow(2, map.getZoom())); }
+
+// Coarsest level of detail that is not coarser than the map (same choice as meshLevel on the server)
+function levelForMap(levels) {
+    const resolution = mapResolution();
+    return (levels || []).reduce((level, item) => item.resolution <= resolution ? item.level : level, 0);
+}
+
+// Map view (west, south, east, north) with a margin, only the faces inside are sent during the animation
+function viewBox() {
+    const bounds = map.getBounds().pad(0.1);
+    return [bounds.getWest(), bounds.getSouth(), bounds.getEast(), bounds.getNorth()];
+}
+
+// Spacing of the arrows in map units (degrees), the server keeps one vector per cell of this size
+function arrowSpacing() {
+    const bounds = map.getBounds();
+    return arrow_spacing * (bounds.getEast() - bounds.getWest()) / map.getSize().x;
+}
+
+// Vector display selected by the user: arrows (Velocity) or animated streamlines
+function vectorMode() { return getState().vectorSelected === '1' ? 'streamlines' : 'arrows'; }
+
+function detachView() {
+    if (viewHandlerRef) map.off('moveend', viewHandlerRef);
+    viewHandlerRef = null;
+}
+
 function update(){
-    timeSpeed().addEventListener("change", () => {
-        clearInterval(getState().isPlaying); setState({isPlaying: null});
-        playBtn().textContent = "▶ Play";
-    });
+    timeSpeed().addEventListener("change", () => { stopPlayback(); });
 }
 update();    
 
@@ -108,7 +141,7 @@ function layerCreator(meshes, values, key, vmin, vmax, colorbarTitle, colorbarKe
         const idx = e.layer.properties.index;
         // Show tooltip
         const html = `<div style="text-align: center;">
-                <b>${colorbarTitle.split('\n')[0]}:</b> ${values[idx] ?? 'N/A'}
+                <b>${colorbarTitle.split('\n')[0]}:</b> ${Number.isFinite(values[idx]) ? parseFloat(values[idx].toFixed(3)) : 'N/A'}
             </div>`;
         hoverTooltip.setContent(html).setLatLng(e.latlng)
         map.openTooltip(hoverTooltip);
@@ -137,34 +170,26 @@ function layerCreator(meshes, values, key, vmin, vmax, colorbarTitle, colorbarKe
 
 export async function plot2DMapStatic(key, colorbarTitle, colorbarKey) {
     startLoading();
-    const data = await loadData(key, 'static', getState().projectName);
+    const [data, mesh] = await Promise.all([loadData(key, 'static', getState().projectName),
+        loadMesh(getState().projectName)]);
     if (data.status === 'error') { showLeafletMap(); alert(data.message); return; }
-    setState({isPlaying: false});
+    if (mesh.status === 'error') { showLeafletMap(); alert(mesh.message); return; }
+    stopPlayback(); detachView();
     // Hide timeslider
     timeControl().style.display = 'none'; substanceWindowHis().style.display = 'none';
     // Get the min and max values of the data
     const vmin = data.content.min_max[0], vmax = data.content.min_max[1];
-    const meshes = data.content.meshes, values = data.content.values;
+    const meshes = mesh.content, values = data.content.values;
     layerMap = layerCreator(meshes, values, key, vmin, vmax, colorbarTitle, colorbarKey);
     map.addLayer(layerMap); showLeafletMap();
 }
 
-function buildFrameData(data) {
-    const coordsArray = data.coordinates, result = [], values = data.values;
-    for (let i = 0; i < coordsArray.length; i++) {
-        const coords = coordsArray[i], val = values[i];
-        let parts = [];
-        if (typeof val === 'string') {
-            const temp = val.replace(/[()]/g, '');
-            parts = temp.split(',').map(s => parseFloat(s.trim()));
-        } else if (Array.isArray(val)) { parts = val.map(Number); }
-        if (!isNaN(parts[0]) && !isNaN(parts[1]) && !isNaN(parts[2])) {
-            result.push({
-                x: coords[0], y: coords[1], a: parts[0], b: parts[1], c: parts[2]
-            });
-        }
-    }
-    return result;
+// Coordinates of the faces of a vector frame (face_x/face_y are sent once, on load), streamlines are drawn as they come
+function buildFrameData(frame, faces) {
+    if (frame.offsets) return frame;
+    const index = frame.index, n = index.length, x = new Float64Array(n), y = new Float64Array(n);
+    for (let i = 0; i < n; i++) { x[i] = faces.face_x[index[i]]; y[i] = faces.face_y[index[i]]; }
+    return { x: x, y: y, u: frame.u, v: frame.v, magnitude: frame.magnitude };
 }
 
 function vectorCreator(parsedData, vmin, vmax, title, colorbarKey, scale) {
@@ -173,17 +198,16 @@ function vectorCreator(parsedData, vmin, vmax, title, colorbarKey, scale) {
             const ctx = this._ctx, map = this._map;
             const canvas = ctx.canvas, data = this.options.data;
             ctx.clearRect(0, 0, canvas.width, canvas.height);
-            for (let i = 0; i < data.length; i++) {
-                const pt = data[i];
-                const p = map.latLngToContainerPoint([pt.y, pt.x]);
+            for (let i = 0; i < data.x.length; i++) {
+                const p = map.latLngToContainerPoint([data.y[i], data.x[i]]);
                 if (p.x < 0 || p.x > canvas.width || p.y < 0 || p.y > canvas.height) continue;
-                const dx = pt.a * scale, dy = -pt.b * scale;
+                const dx = data.u[i] * scale, dy = -data.v[i] * scale;
                 const length = Math.sqrt(dx * dx + dy * dy);
                 if (length < 0.1) continue;
                 const angle = Math.atan2(dy, dx);
                 ctx.save(); ctx.translate(p.x, p.y); ctx.rotate(angle);
                 ctx.scale(length, length);
-                const color = getColorFromValue(pt.c, vmin, vmax, colorbarKey);
+                const color = getColorFromValue(data.magnitude[i], vmin, vmax, colorbarKey);
                 ctx.strokeStyle = `rgb(${color.r}, ${color.g}, ${color.b})`;
                 ctx.lineWidth = 1 / length;
                 ctx.stroke(arrowShape); ctx.restore();
@@ -197,6 +221,48 @@ function vectorCreator(parsedData, vmin, vmax, title, colorbarKey, scale) {
     return layer;
 }
 
+function streamlineCreator(lines, vmin, vmax, title, colorbarKey) {
+    const layer = new L.CanvasLayer({ data: lines, phase: 0,
+        drawLayer: function () {
+            const ctx = this._ctx, map = this._map;
+            const canvas = ctx.canvas, data = this.options.data;
+            // Lines are projected again only when the data or the view change, not for every step of the animation
+            const view = `${map.getZoom()}|${map.getCenter().toString()}|${canvas.width}x${canvas.height}`;
+            if (this._projected !== data || this._view !== view) {
+                this._points = new Float32Array(data.x.length * 2);
+                for (let j = 0; j < data.x.length; j++) {
+                    const p = map.latLngToContainerPoint([data.y[j], data.x[j]]);
+                    this._points[2 * j] = p.x; this._points[2 * j + 1] = p.y;
+                }
+                this._projected = data; this._view = view;
+            }
+            const points = this._points;
+            ctx.clearRect(0, 0, canvas.width, canvas.height);
+            ctx.lineWidth = 1.5; ctx.setLineDash([8, 12]); ctx.lineDashOffset = -this.options.phase;
+            for (let i = 0; i < data.speed.length; i++) {
+                const start = data.offsets[i], end = data.offsets[i + 1];
+                ctx.beginPath(); ctx.moveTo(points[2 * start], points[2 * start + 1]);
+                for (let j = start + 1; j < end; j++) ctx.lineTo(points[2 * j], points[2 * j + 1]);
+                const color = getColorFromValue(data.speed[i], vmin, vmax, colorbarKey);
+                ctx.strokeStyle = `rgb(${color.r}, ${color.g}, ${color.b})`;
+                ctx.stroke();
+            }
+        }
+    });
+    // Dashes move along the lines (direction of the flow) while the layer is on the map
+    const animate = () => {
+        if (!layer._map) return;
+        layer.options.phase = (layer.options.phase + 1) % 20; layer._redraw();
+        requestAnimationFrame(animate);
+    };
+    layer.on('add', () => requestAnimationFrame(animate));
+    // Adjust Colorbar Control
+    colorbar_vector_scaler().innerHTML = '';
+    updateColorbar(vmin, vmax, title, colorbarKey, colorbar_vector_color(), 
+                    colorbar_vector_title(), colorbar_vector_label());
+    return layer;
+}
+
 function initDynamicMap(query, key_below, key_above, data_below, data_above, 
     colorbarTitleBelow, colorbarTitleAbove, colorbarKeyBelow, colorbarKeyAbove, scale) {
     // Clear map
@@ -207,16 +273,15 @@ function initDynamicMap(query, key_below, key_above, data_below, data_above,
     // Destroy slider if it exists
     if (slider().noUiSlider) slider().noUiSlider.destroy();
     // Stop animation if running
-    if (getState().isPlaying) {
-        clearInterval(getState().isPlaying); setState({isPlaying: null});
-        playBtn().textContent = "▶ Play";
-    }
+    if (getState().isPlaying) stopPlayback();
+    detachView();
     let timestamp = null, currentIndex, vminBelow, vmaxBelow, vminAbove, vmaxAbove,
-        lastRequestId = 0, debounceTimer = null;
+        lastRequestId = 0, debounceTimer = null, level = 0, lastViewId = 0,
+        mode = data_above && data_above.offsets ? 'streamlines' : 'arrows';
     // Process below layer
     if (data_below !== null) {
         // Get min and max values
-        vminBelow = data_below.min_max[0]; vmaxBelow = data_below.min_max[1];
+        vminBelow = data_below.min_max[0]; vmaxBelow = data_below.min_max[1]; level = data_below.level || 0;
         timestamp = data_below.timestamps; currentIndex = timestamp.length - 1;
         const meshes = data_below.meshes, values = data_below.values;
         if (layerMap) map.removeLayer(layerMap);
@@ -231,9 +296,9 @@ function initDynamicMap(query, key_below, key_above, data_below, data_above,
         vminAbove = data_above.min_max[0], vmaxAbove = data_above.min_max[1];
         timestamp = data_above.timestamps; currentIndex = timestamp.length - 1;
         if (layerAbove) map.removeLayer(layerAbove); // Remove previous layer
-        parsedFrame = buildFrameData(data_above);
-        layerAbove = vectorCreator(parsedFrame, vminAbove, vmaxAbove,
-            colorbarTitleAbove, colorbarKeyAbove, scale);
+        parsedFrame = buildFrameData(data_above, data_above);
+        layerAbove = data_above.offsets ? streamlineCreator(parsedFrame, vminAbove, vmaxAbove, colorbarTitleAbove, colorbarKeyAbove)
+            : vectorCreator(parsedFrame, vminAbove, vmaxAbove, colorbarTitleAbove, colorbarKeyAbove, scale);
         map.addLayer(layerAbove);
         colorbar_vector_container().style.display = "block";
     }
@@ -247,6 +312,10 @@ function initDynamicMap(query, key_below, key_above, data_below, data_above,
             from: value => timestamp.indexOf(value)
         }]
     });
+    // Frames of the slider are read in batches (streamlines are traced frame by frame)
+    const projectName = getState().projectName;
+    const batchBelow = frameBatches({query: query, key: key_below, projectName: projectName}, frame_batch);
+    const batchAbove = frameBatches({vector: true, key: key_above, projectName: projectName}, frame_batch);
     // Slider update event (with debounce to avoid multiple requests)
     const handleSliderUpdate = async (values, handle, unencoded) => {
         const rawIndex = unencoded[handle];
@@ -256,24 +325,25 @@ function initDynamicMap(query, key_below, key_above, data_below, data_above,
         // Token to avoid race conditions
         const requestId = ++lastRequestId;
         if (data_below && layerMap) {
-            const frame_below = await sendQuery('load_general_dynamic', {query: `${query}|${currentIndex}`, 
-                key: key_below, projectName: getState().projectName});
+            const frame_below = await batchBelow(currentIndex, {level: level, bbox: viewBox()});
             if (requestId !== lastRequestId) return;
             if (frame_below.status === 'error') return alert(frame_below.message);
-            let parsedFrame = decodeArray(frame_below.content.values, 3);
+            let parsedFrame = frame_below.content.values;
             if (key_below === 'wd_single_dynamic') parsedFrame = parsedFrame.map(v => -v);
-            updateMapByTime(layerMap, parsedFrame, vminBelow, vmaxBelow, colorbarKeyBelow);
+            updateMapByTime(layerMap, parsedFrame, vminBelow, vmaxBelow, colorbarKeyBelow, frame_below.content.index);
         }
         if (data_above && layerAbove) {
-            const frame_above = await sendQuery('load_vector_dynamic', {query: currentIndex, 
-                key: key_above, projectName: getState().projectName});
+            const frame_above = mode === 'streamlines' ? await sendFrameQuery('load_vector_dynamic', {query: currentIndex,
+                key: key_above, projectName: getState().projectName, bbox: viewBox(), spacing: arrowSpacing(), mode: mode})
+                : await batchAbove(currentIndex, {bbox: viewBox(), spacing: arrowSpacing()});
             if (frame_above.status === 'error') return alert(frame_above.message);
-            parsedFrame = buildFrameData(frame_above.content);
+            parsedFrame = buildFrameData(frame_above.content, data_above);
             layerAbove.options.data = parsedFrame; layerAbove._redraw();
         }
     };
     // Debounce wrapper
     slider().noUiSlider.on('update', async (values, handle, unencoded) => {
+        if (streams.length > 0) return; // Frames come from the streams while playing
         if (debounceTimer) clearTimeout(debounceTimer);
         debounceTimer = setTimeout(() => { handleSliderUpdate(values, handle, unencoded); }, 80);
     });
@@ -284,23 +354,62 @@ function initDynamicMap(query, key_below, key_above, data_below, data_above,
         playHandlerAttached = false;
     }
     playHandlerRef = () => {
-        if (getState().isPlaying) {
-            clearInterval(getState().isPlaying); setState({isPlaying: null});
-            playBtn().textContent = "▶ Play"; return;
+        if (getState().isPlaying) { stopPlayback(); return; }
+        // Frames are pushed by the server at the playback rate, from the next time step
+        const start = (Math.round(slider().noUiSlider.get()) + 1) % (maxIndex + 1);
+        const rate = parseFloat(timeSpeed().value || 1), projectName = getState().projectName;
+        const onError = (message) => { stopPlayback(); alert(message); };
+        const moveSlider = (step) => { currentIndex = step; slider().noUiSlider.set(step); };
+        if (data_below && layerMap) {
+            streams.push(openFrameStream({kind: 'general', query: query, key: key_below, projectName: projectName,
+                start: start, rate: rate, level: level, bbox: viewBox()}, (frame) => {
+                let parsedFrame = frame.values;
+                if (key_below === 'wd_single_dynamic') parsedFrame = parsedFrame.map(v => -v);
+                updateMapByTime(layerMap, parsedFrame, vminBelow, vmaxBelow, colorbarKeyBelow, frame.index);
+                moveSlider(frame.step);
+            }, onError));
+        }
+        if (data_above && layerAbove) {
+            streams.push(openFrameStream({kind: 'vector', key: key_above, projectName: projectName,
+                start: start, rate: rate, bbox: viewBox(), spacing: arrowSpacing(), mode: mode}, (frame) => {
+                layerAbove.options.data = buildFrameData(frame, data_above); layerAbove._redraw();
+                if (!(data_below && layerMap)) moveSlider(frame.step);
+            }, onError));
         }
-        // Get current index
-        let idx = Math.round(slider().noUiSlider.get());
-        const len = maxIndex + 1;
-        const speed = 1000/parseFloat(timeSpeed().value || 1);
-        const interval = setInterval(() => {
-            idx = (idx + 1) % len;
-            slider().noUiSlider.set(idx);
-        }, speed);
-        setState({isPlaying: interval});
+        setState({isPlaying: true});
         playBtn().textContent = "⏸ Pause";
     };
     playBtn().addEventListener("click", playHandlerRef);
     playHandlerAttached = true;
+    // Pan/zoom: switch the dynamic map to the level of detail of the new resolution, or refresh the faces in the view
+    viewHandlerRef = async () => {
+        const shown = (layerMap && map.hasLayer(layerMap)) || (layerAbove && map.hasLayer(layerAbove));
+        if (!shown) return; // The dynamic map has been replaced by another view
+        const newLevel = data_below ? levelForMap(data_below.levels) : level, viewId = ++lastViewId;
+        if (newLevel === level || !(layerMap && map.hasLayer(layerMap))) {
+            if (streams.length > 0) { const bbox = viewBox(); streams.forEach(stream => stream.view(bbox, arrowSpacing())); }
+            else handleSliderUpdate(null, 0, [currentIndex]);
+            return;
+        }
+        const projectName = getState().projectName, wasPlaying = getState().isPlaying;
+        if (wasPlaying) stopPlayback();
+        const [frame, mesh] = await Promise.all([
+            sendFrameQuery('load_general_dynamic', {query: `${query}|${currentIndex}`, key: key_below,
+                projectName: projectName, level: newLevel}),
+            loadMesh(projectName, true, newLevel)]);
+        if (viewId !== lastViewId) return;
+        if (frame.status === 'error') return alert(frame.message);
+        if (mesh.status === 'error') return alert(mesh.message);
+        level = newLevel;
+        let values = frame.content.values;
+        if (key_below === 'wd_single_dynamic') values = values.map(v => -v);
+        map.removeLayer(layerMap);
+        layerMap = layerCreator(mesh.content, values, key_below, vminBelow,
+            vmaxBelow, colorbarTitleBelow, colorbarKeyBelow);
+        map.addLayer(layerMap);
+        if (wasPlaying) playHandlerRef();
+    };
+    map.on('moveend', viewHandlerRef);
 }
 
 function initScaler() {
@@ -323,10 +432,13 @@ export async function plot2DMapDynamic(waterQuality, query, key, colorbarTitle,
     let data_below = null, data_above = null, colorbarTitleAbove = null, colorbarKeyAbove = null, 
         key_below = key, key_above = null;
     setState({showedQuery: key}); setState({isHYD: waterQuality});  // Set HYD flag
-    // Process below layer
-    const dataBelow = await sendQuery('load_general_dynamic', {query: `${query}|load`, key: key, projectName: getState().projectName});
+    // Process below layer, at the level of detail of the current zoom
+    const dataBelow = await sendFrameQuery('load_general_dynamic', {query: `${query}|load`, key: key,
+        projectName: getState().projectName, resolution: mapResolution()});
     if (dataBelow.status === 'error') { showLeafletMap(); alert(dataBelow.message); return; }
-    data_below = dataBelow.content; data_below.values = decodeArray(data_below.values, 3);
+    const mesh = await loadMesh(getState().projectName, true, dataBelow.content.level || 0);
+    if (mesh.status === 'error') { showLeafletMap(); alert(mesh.message); return; }
+    data_below = dataBelow.content; data_below.meshes = mesh.content;
     // If data is water depth, reverse values in below layer    
     if (key === 'wd_single_dynamic') {
         data_below.values = data_below.values.map(v => -v);
@@ -336,11 +448,12 @@ export async function plot2DMapDynamic(waterQuality, query, key, colorbarTitle,
     if (getState().vectorSelected !== '' && key.includes('multi')) {
         const vector = document.getElementById("vector-selector"), layer = document.getElementById("layer-selector");
         key_above = layer.value;         
-        if (vector.selectedOptions[0].text === 'Velocity') { // Process above data for velocity
+        if (vector.selectedOptions[0].text.startsWith('Velocity')) { // Process above data for velocity
             const title = key_above==='-1' ? `Layer: ${layer.selectedOptions[0].text}` : `${layer.selectedOptions[0].text}`;
             colorbarTitleAbove = `${vector.selectedOptions[0].text} (m/s)\n${title}`; colorbarKeyAbove = 'vector';
         }
-        const dataAbove = await sendQuery('load_vector_dynamic', {query: 'load', key: key_above, projectName: getState().projectName});
+        const dataAbove = await sendFrameQuery('load_vector_dynamic', {query: 'load', key: key_above,
+            projectName: getState().projectName, spacing: arrowSpacing(), mode: vectorMode()});
         data_above = dataAbove.content; 
     }
     initDynamicMap(query, key_below, key_above, data_below, data_above, colorbarTitle, colorbarTitleAbove, colorbarKey, colorbarKeyAbove, scale);
@@ -349,7 +462,8 @@ export async function plot2DMapDynamic(waterQuality, query, key, colorbarTitle,
 
 export async function plot2DVectorMap(query, key, colorbarTitle, colorbarKey) {
     startLoading('Preparing Dynamic Vector Map. Please wait...'); scale = initScaler();
-    const data = await sendQuery('load_vector_dynamic', {query: query, key: key, projectName: getState().projectName});
+    const data = await sendFrameQuery('load_vector_dynamic', {query: query, key: key,
+        projectName: getState().projectName, spacing: arrowSpacing(), mode: vectorMode()});
     if (data.status === 'error') { showLeafletMap(); alert(data.message); return; }
     if (layerMap) map.removeLayer(layerMap); layerMap = null;
     if (layerAbove) map.removeLayer(layerAbove); layerAbove = null;
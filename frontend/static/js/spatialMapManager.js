@@ -49,7 +49,7 @@ export async function spatialMapManager() {
         }
         const vectorName = vectorSelector().value, layerName = layerSelector().value;
         titleColorbar = '', colorbarKey = '';
-        if (vectorName === '0') {titleColorbar = 'Velocity (m/s)'; colorbarKey = 'vector';}
+        if (vectorName === '0' || vectorName === '1') {titleColorbar = 'Velocity (m/s)'; colorbarKey = 'vector';}
         const colorbarTitle = layerSelector().value==='-1' ? `${titleColorbar}\nLayer: ${layerSelector().selectedOptions[0].text}` 
             : `${titleColorbar}\n${layerSelector().selectedOptions[0].text}`;
         if (updateStatus()) { 
@@ -1,4 +1,5 @@
 import { toUTC } from "./projectSaver.js";
+import { decodeFrame } from "./utils.js";
 
 export async function sendQuery(functionName, content){
     const response = await fetch(`/${functionName}`, {
@@ -8,6 +9,80 @@ export async function sendQuery(functionName, content){
     return data;
 }
 
+// Query a route in binary mode: arrays come as typed arrays (2D arrays as rows of views), errors stay JSON
+export async function sendFrameQuery(functionName, content){
+    const response = await fetch(`/${functionName}`, {
+        method: 'POST', headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({...content, format: 'binary'})});
+    if (!(response.headers.get('Content-Type') || '').includes('application/octet-stream')) return await response.json();
+    return { status: 'ok', content: frameContent(decodeFrame(await response.arrayBuffer())) };
+}
+
+function frameContent(frame) {
+    const result = { ...frame.meta };
+    Object.entries(frame.arrays).forEach(([name, arr]) => {
+        const shape = frame.shapes[name];
+        if (shape.length !== 2) { result[name] = arr; return; }
+        result[name] = Array.from({ length: shape[0] }, (_, i) => arr.subarray(i * shape[1], (i + 1) * shape[1]));
+    });
+    return result;
+}
+
+// Frames of a range of time steps read in one request (load_dynamic_frames) and reused while the slider moves,
+// a new range is read when the step is outside of it or the view (level, bbox, spacing) changed
+export function frameBatches(content, size){
+    let batch = null;
+    return async (step, view) => {
+        const viewKey = JSON.stringify(view);
+        if (!batch || batch.viewKey !== viewKey || !batch.steps.includes(step)) {
+            const start = Math.max(0, step - Math.floor(size / 4)); // Mostly ahead of the slider
+            const data = await sendFrameQuery('load_dynamic_frames', {...content, ...view, start: start, stop: start + size});
+            if (data.status === 'error') return data;
+            batch = { viewKey: viewKey, steps: data.content.steps, content: data.content };
+        }
+        // Rows of the 2-D arrays are the frames, other arrays (index of the faces) are shared
+        const i = batch.steps.indexOf(step), frame = {};
+        Object.entries(batch.content).forEach(([name, value]) => {
+            frame[name] = Array.isArray(value) && value.length === batch.steps.length && ArrayBuffer.isView(value[0]) ? value[i] : value;
+        });
+        return { status: 'ok', content: frame };
+    };
+}
+
+// Subscribe to frames pushed by the server (kind: 'general', 'vector' or 'thermocline'),
+// each frame is acknowledged once handled so the server never runs too far ahead.
+// The socket is authenticated with a single-use token (browsers do not reliably send Basic credentials with it)
+export function openFrameStream(subscription, onFrame, onError){
+    let socket = null, closed = false;
+    const send = (message) => { if (socket && socket.readyState === WebSocket.OPEN) socket.send(JSON.stringify(message)); };
+    sendQuery('stream_token', {}).then((data) => {
+        if (closed) return;
+        if (data.status === 'error') { onError(data.message); return; }
+        const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
+        socket = new WebSocket(`${protocol}://${window.location.host}/stream_frames?token=${encodeURIComponent(data.content)}`);
+        socket.binaryType = 'arraybuffer';
+        socket.onopen = () => send({ action: 'subscribe', ...subscription });
+        socket.onerror = () => onError('Frame stream is not available.');
+        socket.onmessage = async (event) => {
+            if (typeof event.data === 'string') {
+                const message = JSON.parse(event.data);
+                if (message.status === 'error') onError(message.message);
+                return;
+            }
+            await onFrame(frameContent(decodeFrame(event.data)));
+            send({ action: 'ack' });
+        };
+    }).catch(() => { if (!closed) onError('Frame stream is not available.'); });
+    return {
+        play: () => send({ action: 'play' }), pause: () => send({ action: 'pause' }),
+        seek: (step) => { subscription.start = step; send({ action: 'seek', step: step }); },
+        rate: (rate) => { subscription.rate = rate; send({ action: 'rate', rate: rate }); },
+        // Kept in the subscription too, for a socket that is not open yet
+        view: (bbox, spacing) => { Object.assign(subscription, { bbox: bbox, spacing: spacing }); send({ action: 'view', bbox: bbox, spacing: spacing }); },
+        close: () => { closed = true; if (socket) socket.close(); }
+    };
+}
+
 export function copyPaste(table, nCols){
     const tbody = table.querySelector('tbody');
     table.addEventListener('paste', (e) => {
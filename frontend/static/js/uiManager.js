@@ -4,7 +4,7 @@ import { plotChart, plotEvents, drawChart, plotWindow, thermoclinePlotter } from
 import { timeControl, colorbar_container, colorbar_vector_container, plot2DMapDynamic } from "./map2DManager.js";
 import { generalOptionsManager, summaryWindow } from './generalOptionManager.js';
 import { spatialMapManager, substanceWindowHis, substanceWindowMap } from './spatialMapManager.js';
-import { sendQuery } from './tableManager.js';
+import { sendQuery, sendFrameQuery } from './tableManager.js';
 import { fileUploader } from './utils.js';
 import { getState, resetState, setState } from './constants.js'; 
 
@@ -603,11 +603,11 @@ function updateEvents() {
                                 saveBtn.addEventListener('click', async() => {
                                     const newName = input.value;
                                     if (newName !== '') {
-                                        const initData = await sendQuery('select_thermocline', {key: key,
+                                        const initData = await sendFrameQuery('select_thermocline', {key: key,
                                             query: query, idx: index, type: 'thermocline_init', projectName: getState().projectName});
                                         layer.closePopup(); setState({isThemocline: false});
                                         if (initData.status === "error") { alert(initData.message); return; }
-                                        thermoclinePlotter(key, initData.content, newName, titleX, titleY, chartTitle);
+                                        thermoclinePlotter(key, initData.content, newName, titleX, titleY, chartTitle, {query: query, idx: index});
                                     } else { alert('Please enter a name.'); return; }
                                 });
                             }
@@ -178,10 +178,12 @@ export function updateColorbar(min, max, title, colorbarKey, bar_color, bar_titl
     bar_color.style.background = `linear-gradient(to top, ${colorStops.join(", ")})`;
 }
 
-export function updateMapByTime(layerMap, values, vmin, vmax, colorbarKey) {
-    for (let i = 0; i < getState().mapLayer.length; i++) {
-        const id = getState().mapLayer[i];
-        const value = values[id];
+// Values of all features, or of the features in index only (map view, see viewFaces in functions.py)
+export function updateMapByTime(layerMap, values, vmin, vmax, colorbarKey, index=null) {
+    const ids = index || getState().mapLayer;
+    for (let i = 0; i < ids.length; i++) {
+        const id = ids[i];
+        const value = index ? values[i] : values[id];
         if (value === null || value === undefined) continue;
         const { r, g, b, a } = getColorFromValue(value, vmin, vmax, colorbarKey);
         const colorKey = `${r},${g},${b},${a}`;
@@ -204,6 +206,51 @@ export async function loadData(query, key, projectName){
     return data;
 }
 
+// Read a binary frame (see binary_frame.py), arrays are views on the buffer (no copy)
+const frameTypes = { float32: Float32Array, float64: Float64Array, int32: Int32Array, uint32: Uint32Array,
+    int16: Int16Array, uint16: Uint16Array, int8: Int8Array, uint8: Uint8Array };
+export function decodeFrame(buffer) {
+    const view = new DataView(buffer);
+    const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+    if (magic !== 'DHF1') throw new Error('Invalid binary frame.');
+    const headerLength = view.getUint32(4, true), start = 8 + headerLength;
+    const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, headerLength)));
+    const arrays = {};
+    header.arrays.forEach(entry => {
+        const length = entry.shape.reduce((a, b) => a * b, 1);
+        arrays[entry.name] = new frameTypes[entry.dtype](buffer, start + entry.offset, length);
+    });
+    return { meta: header.meta, arrays: arrays, shapes: Object.fromEntries(header.arrays.map(e => [e.name, e.shape])) };
+}
+
+// Build GeoJSON polygons from deduplicated nodes and face-node indices
+function meshToGeoJSON(frame) {
+    const { nodes, face_offsets, face_nodes } = frame.arrays;
+    const [x0, y0] = frame.meta.origin, features = [];
+    for (let i = 0; i < face_offsets.length - 1; i++) {
+        const ring = [];
+        for (let j = face_offsets[i]; j < face_offsets[i + 1]; j++) {
+            const n = face_nodes[j] * 2;
+            ring.push([x0 + nodes[n], y0 + nodes[n + 1]]);
+        }
+        ring.push(ring[0]); // Close the ring
+        features.push({ type: 'Feature', properties: { index: i }, geometry: { type: 'Polygon', coordinates: [ring] } });
+    }
+    return { type: 'FeatureCollection', features: features };
+}
+
+// Load mesh skeleton (compressed and revalidated with ETag by the browser), level > 0 for coarser levels of detail
+export async function loadMesh(projectName, binary=true, level=0){
+    const format = binary ? 'binary' : 'geojson';
+    const response = await fetch(`/mesh_skeleton?projectName=${encodeURIComponent(projectName)}&format=${format}&level=${level}`);
+    if (!response.ok) {
+        const data = await response.json();
+        return { status: 'error', message: data.message || 'Grid data not found.' };
+    }
+    if (!binary) return { status: 'ok', content: await response.json() };
+    return { status: 'ok', content: meshToGeoJSON(decodeFrame(await response.arrayBuffer())) };
+}
+
 // Split lines into smaller segments and sort by distance
 export function splitLines(pointContainer, polygonCentroids, subset_dis) {
     const interpolatedPoints = [];